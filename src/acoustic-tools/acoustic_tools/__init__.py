@@ -1,5 +1,14 @@
-from . import annotation
+import importlib
 
 __all__ = [
     'annotation'
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    # Submodules are imported when first used, so importing the package (e.g. to start a script) doesn't import pandas,
+    # which takes a while to import.  For the same reason, modules only import pandas (and other heavy dependencies)
+    # in the functions using them, and import it for annotations under `typing.TYPE_CHECKING`
+    if name in __all__:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
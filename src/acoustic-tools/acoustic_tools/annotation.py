@@ -1,10 +1,14 @@
 """Raven annotation parser."""
-import datetime
+from __future__ import annotations
 import logging
+from itertools import repeat
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable
 
-import numpy as np
-import pandas as pd
+from acoustic_tools.timestamps import find_site, parse_timestamp, parse_timestamps
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 # unable to use "usecols" kwarg for read_csv
@@ -30,7 +34,7 @@ RENAME_COLS = {
 }
 
 # directories containing annotation files
-# correspond to filename prefixes in move-mote-data.sh
+# correspond to filename prefixes in scripts/mote-data.csv
 FILE_NAMES = [
     'bermuda',
     'd9-sarasota',
@@ -42,11 +46,19 @@ FILE_NAMES = [
     'usf-glider'
 ]
 
+ENGINES = ('python', 'vectorized')
+
+
+def file_prefix(annotation: Path) -> str | None:
+    """Given path to annotation file, return the name prefix of its wav files, or None if it can't be found."""
+    return find_site(annotation, FILE_NAMES)
+
 
 def read_annotation_file(
     annotation: Path,
     drop_cols: list = DROP_COLS,
-    rename_cols: dict = RENAME_COLS
+    rename_cols: dict = RENAME_COLS,
+    engine: str = 'vectorized'
 ) -> pd.DataFrame:
     """Given path to BlackGrouper annotation file, return annotations as a DataFrame.
 
@@ -54,8 +66,9 @@ def read_annotation_file(
     ----------
     annotation_file: Path
         Path to annotation file
-    new_name: str
-        Prefix of name of file (needs to match organization in `reorg` dir of wav files)
+    engine: str
+        'vectorized' parses columns with pandas string and datetime methods (see `read_annotation_files`),
+        'python' row by row
 
     Returns
     -------
@@ -71,23 +84,29 @@ def read_annotation_file(
         - Level: 3 levels of relative amplitude (1: high, 2: medium, 3: low)
         - Overlap: Do calls overlap (1: yes, 2: no)
         - Cutoff: Are calls cutoff at end (1: yes, 2: no)
+    - Rows annotated on the waveform duplicate those annotated on the spectrogram, so rows whose `View` is a
+      waveform are dropped (see `waveform_rows`).
     """
+    import pandas as pd
+
+    if engine == 'vectorized':
+        df, errors = read_annotation_files([annotation], drop_cols, rename_cols)
+        if errors:
+            raise ValueError(f'Failed to read annotation file {annotation}: {errors[Path(annotation)]}')
+        return df
+    if engine != 'python':
+        raise ValueError(f'Unknown engine {engine}, must be one of {ENGINES}')
 
-    df = (pd.read_csv(
+    df = pd.read_csv(
         annotation,
         sep='\t',
     )
+    # Drop rows with wavform, keep only spec (some files essentially duplicate the annotated calls)
+    df = (df[~waveform_rows(df)]
         .drop(columns=drop_cols)
         .rename(columns=rename_cols)
         .dropna()
     )
-    # Drop rows with wavform, keep only spec (some files essentially duplicate the annotated calls)
-    # File will be of form:
-    # HEADER ...
-    # ix ... Waveform 1 ... LENGTH_1
-    # xi+2 ... Spectrogram 1 ... LENGTH_1
-    if df.iloc[0].call_length == df.iloc[1].call_length:
-        df = df.drop(index=np.arange(0, len(df), 2))
 
     df['signal_level'] = df['signal_level'].astype(int)
     # 1 == True
@@ -105,9 +124,10 @@ def read_annotation_file(
     if bad_column in df.columns:
         df = df.drop(columns=[bad_column])
 
+    new_prefix = file_prefix(annotation)
     new_names = []
     # None Toshiba files
-    if 'DSG' in df['file'].iloc[0]:
+    if len(df) and 'DSG' in df['file'].iloc[0]:
         # Files names have spaces in them, but were removed
         df['file'] = df['file'].apply(lambda x: x.replace(' ', ''))
 
@@ -116,17 +136,12 @@ def read_annotation_file(
         files = df['file']
         for file in files:
             # e.g. 748.DSG_RAWD_HMS_19_0_0__DMY_25_7_16.wav
-            # pull out empty ('') segments, exist because of different number of '_' in filename
-            segments = [seg for seg in file.split('.')[1].split('_') if seg != '']
-            _, _, _, hour, minute, second, _, day, month, year = segments
-            year = int(year) + 2000
-            file_timestamp = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second)).strftime('%Y-%m-%dT%H%M%S')
+            timestamp = parse_timestamp(file)
+            if timestamp is None:
+                raise ValueError(f'Unable to parse timestamp of {file} in {annotation}')
+            file_timestamp = timestamp.strftime('%Y-%m-%dT%H%M%S')
 
             # find file location in `reorg` dir
-            for file_name in FILE_NAMES:
-                if file_name in str(annotation):
-                    new_prefix = file_name
-                    break
             if new_prefix is None:
                 raise ValueError(f'Could not find file name prefix for {annotation}')
 
@@ -134,16 +149,143 @@ def read_annotation_file(
             new_names.append(new_name)
     # Toshiba files
     else:
-        for file_name in FILE_NAMES:
-            if file_name in str(annotation):
-                new_prefix = file_name
-                break
-            if new_prefix is None:
-                logging.warning(f'Could not find file name prefix (location) for {file_name}')
-                new_prefix = 'unknown'
-            new_name = f'{new_prefix}_{filename.name}'
+        if new_prefix is None:
+            logging.warning(f'Could not find file name prefix (location) for {annotation}')
+            new_prefix = 'unknown'
+        for file in df['file']:
+            new_name = f'{new_prefix}_{Path(file).name}'
             new_names.append(new_name)
 
     df['file'] = new_names
 
     return df[rename_cols.values()]
+
+
+def waveform_rows(df: pd.DataFrame) -> pd.Series:
+    """Given a selection table, return which of its rows are annotated on the waveform rather than the spectrogram.
+
+    Some files annotate each call on both, e.g.:
+    HEADER ...
+    ix ... Waveform 1 ... LENGTH_1
+    ix+1 ... Spectrogram 1 ... LENGTH_1
+    """
+    return df['View'].str.startswith('Waveform', na=False)
+
+
+def read_annotation_files(
+    annotations: list[Path],
+    drop_cols: list = DROP_COLS,
+    rename_cols: dict = RENAME_COLS,
+    map_func: Callable = map
+) -> tuple[pd.DataFrame, dict]:
+    """Given paths to annotation files, return their annotations parsed together and errors of unreadable files.
+
+    Tables are read one at a time (with `map_func`, e.g. `Executor.map`), then cleaned and parsed together in a
+    single vectorized pass, which is much faster than cleaning and parsing many small tables one at a time.
+
+    Returns
+    -------
+    annotations: pd.DataFrame
+        Annotations of all readable files, as returned by `read_annotation_file`
+    errors: dict
+        Description of the error of each file that could not be read, by path
+    """
+    import numpy as np
+    import pandas as pd
+
+    errors = {}
+    sources = []
+    tables = []
+    for annotation, table in zip(annotations, map_func(_read_table, annotations, repeat(drop_cols), repeat(rename_cols))):
+        if isinstance(table, str):
+            errors[Path(annotation)] = table
+        else:
+            sources.append(str(annotation))
+            tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=list(rename_cols.values())), errors
+
+    df = pd.concat(tables)
+    # Row labels repeat between tables, so clean and parse with unique labels and restore them at the end
+    index = df.index
+    df = df.reset_index(drop=True)
+    table_ix = np.repeat(np.arange(len(tables)), [len(table) for table in tables])
+    source = pd.Series(np.array(sources, dtype=object)[table_ix], dtype=object)
+
+    # Tables have different columns, only the columns of a row's table are checked for missing values (as `dropna`)
+    columns = [column for column in df.columns if column not in drop_cols]
+    has_column = np.array([[column in table.columns for column in columns] for table in tables], dtype=bool)[table_ix]
+    missing = (df[columns].isna().to_numpy() & has_column).any(axis=1)
+    # Drop rows with wavform, keep only spec (some files essentially duplicate the annotated calls)
+    keep = ~waveform_rows(df).to_numpy() & ~missing
+    df = df[keep].reset_index(drop=True)
+    source = source[keep].reset_index(drop=True)
+    has_column = has_column[keep]
+    index = index[keep]
+
+    # Some files have two call cutoff columns, due to the '?' added in some column labels, keep the first
+    renamed = {}
+    for name in dict.fromkeys(rename_cols.values()):
+        values, found = None, False
+        for column in [column for column in rename_cols if rename_cols[column] == name and column in columns]:
+            values = df[column] if values is None else values.where(found, df[column])
+            found = found | has_column[:, columns.index(column)]
+        renamed[name] = values
+    df = pd.DataFrame(renamed)
+
+    bad = pd.Series(False, index=df.index)
+    for column in ['call_length', 'start_time', 'high_freq', 'signal_level', 'call_overlap', 'call_cutoff']:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+        bad |= df[column].isna()
+    df['signal_level'] = df['signal_level'].fillna(0).astype(int)
+    # 1 == True
+    # 2 == False
+    df['call_overlap'] = (df['call_overlap'] % 2).astype(bool)
+    df['call_cutoff'] = (df['call_cutoff'] % 2).astype(bool)
+
+    # None Toshiba files (whose first call is of a DSG file) have inconsistent formatting, so we'll rename them:
+    # YYYY-MM-DDTHHMMSS.wav
+    dsg = df['file'].groupby(source).transform('first').str.contains('DSG', regex=False).to_numpy()
+    timestamps = parse_timestamps(df['file'][dsg])['timestamp']
+    bad[dsg] |= timestamps.isna()
+    # Toshiba files keep their names
+    names = df['file'].str.rsplit('/', n=1).str[-1]
+    names[dsg] = timestamps.dt.strftime('%Y-%m-%dT%H%M%S') + '.wav'
+
+    # find file location in `reorg` dir
+    prefixes = {}
+    for annotation in dict.fromkeys(sources):
+        prefixes[annotation] = file_prefix(annotation)
+        if prefixes[annotation] is None:
+            if dsg[(source == annotation).to_numpy()].any():
+                errors[Path(annotation)] = f'ValueError: Could not find file name prefix for {annotation}'
+            else:
+                logging.warning(f'Could not find file name prefix (location) for {annotation}')
+                prefixes[annotation] = 'unknown'
+    for annotation in source[bad].unique():
+        errors.setdefault(Path(annotation), f'ValueError: Unable to parse rows {list(index[(bad & (source == annotation)).to_numpy()])}')
+    keep = ~source.isin([annotation for annotation in sources if Path(annotation) in errors]).to_numpy()
+    df = df[keep].set_axis(index[keep])
+    df['file'] = source[keep].map(prefixes).to_numpy() + '_' + names[keep].astype(str).to_numpy()
+
+    return df[rename_cols.values()], errors
+
+
+def _read_table(annotation: Path, drop_cols: list, rename_cols: dict) -> pd.DataFrame | str:
+    """Given path to annotation file, return it as read by `pandas.read_csv` or a description of the error."""
+    import pandas as pd
+
+    try:
+        df = pd.read_csv(
+            annotation,
+            sep='\t',
+        )
+        missing = set(drop_cols) - set(df.columns)
+        if missing:
+            raise KeyError(f'Missing columns {sorted(missing)}')
+        missing = set(rename_cols.values()) - {rename_cols.get(column, column) for column in df.columns if column not in drop_cols}
+        if missing:
+            raise KeyError(f'Missing columns {sorted(missing)}')
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return df
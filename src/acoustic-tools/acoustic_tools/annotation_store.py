@@ -0,0 +1,109 @@
+"""Parquet store of combined annotations, partitioned by call variant.
+
+Annotations are saved as a hive partitioned parquet dataset (requires `pyarrow`) with typed columns, sorted within
+each partition by call overlap, call cutoff and row.  `row` is the row of the annotation in the combined annotation
+csv, so samples are named the same whichever is used.  An index (`index.csv`) records the partition, offset and
+number of rows of every (call_variant, call_overlap, call_cutoff) group, e.g.:
+
+    call_variant,call_overlap,call_cutoff,partition,offset,rows
+    1,False,False,call_variant=1/part-0.parquet,0,1011
+"""
+from __future__ import annotations
+import shutil
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+INDEX_FILE = 'index.csv'
+
+GROUP_COLUMNS = ['call_variant', 'call_overlap', 'call_cutoff']
+
+DTYPES = {
+    'row': 'int64',
+    'file': 'category',
+    'call_length': 'float64',
+    'start_time': 'float64',
+    'call_variant': 'int64',
+    'signal_level': 'int8',
+    'call_overlap': 'bool',
+    'call_cutoff': 'bool',
+    'high_freq': 'float64',
+}
+
+
+def write_annotation_store(annotations: pd.DataFrame, path: Path) -> pd.DataFrame:
+    """Given combined annotations (e.g. from `write_annotation_file.read_annotation_files`), save them to a store.
+
+    An existing store at `path` is replaced.  Returns the index of the store.
+    """
+    import pandas as pd
+
+    path = Path(path)
+    if path.exists():
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+
+    # Some annotation frames have two call cutoff columns, due to the '?' added in some column labels
+    df = annotations.loc[:, ~annotations.columns.duplicated()].reset_index(drop=True)
+    df = df.rename_axis('row').reset_index()
+    # Call variants are saved as ints as `create_training_set` reads them
+    df = df.astype({'call_variant': float}).astype(DTYPES)[list(DTYPES)]
+    df = df.sort_values(GROUP_COLUMNS + ['row'], kind='stable')
+
+    index = []
+    for call_variant, partition in df.groupby('call_variant', sort=True):
+        name = f'call_variant={call_variant}/part-0.parquet'
+        (path / name).parent.mkdir()
+        partition.drop(columns=['call_variant']).to_parquet(path / name, index=False)
+
+        groups = partition.groupby(['call_overlap', 'call_cutoff'], sort=False).size()
+        offset = 0
+        for (call_overlap, call_cutoff), rows in groups.items():
+            index.append({
+                'call_variant': call_variant,
+                'call_overlap': call_overlap,
+                'call_cutoff': call_cutoff,
+                'partition': name,
+                'offset': offset,
+                'rows': rows,
+            })
+            offset += rows
+
+    index = pd.DataFrame(index, columns=GROUP_COLUMNS + ['partition', 'offset', 'rows'])
+    index.to_csv(path / INDEX_FILE, index=False)
+    return index
+
+
+def read_index(path: Path) -> pd.DataFrame:
+    """Given path to a store, return its index."""
+    import pandas as pd
+
+    return pd.read_csv(Path(path) / INDEX_FILE)
+
+
+def read_annotation_store(path: Path, call_variants: list[int] | None = None) -> pd.DataFrame:
+    """Given path to a store, return annotations indexed by row, optionally only those of `call_variants`.
+
+    Only the partitions of the requested call variants are read.
+    """
+    import pandas as pd
+    import pyarrow.dataset
+
+    path = Path(path)
+    index = read_index(path)
+    if call_variants is not None:
+        index = index[index['call_variant'].isin(call_variants)]
+    if index.empty:
+        return pd.DataFrame(columns=list(DTYPES)).astype(DTYPES).set_index('row')
+
+    # Read all partitions at once, pyarrow unifies the categories of files of each partition
+    dataset = pyarrow.dataset.dataset(
+        [str(path / name) for name in index['partition'].unique()],
+        format='parquet',
+        partitioning='hive',
+        partition_base_dir=str(path)
+    )
+    df = dataset.to_table().to_pandas()
+    return df.astype({'call_variant': DTYPES['call_variant']})[list(DTYPES)].set_index('row')
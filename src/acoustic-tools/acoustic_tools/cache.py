@@ -0,0 +1,130 @@
+"""On-disk cache of spectrograms keyed by audio content and spectrogram parameters."""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+def file_hash(fpath: Path, chunk_size: int = 2**20) -> str:
+    """Given path to a file, return a hash of its contents."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SpecCache:
+    """Least recently used cache of arrays saved as `.npy` files in `path`, limited to about `max_bytes`.
+
+    Arrays are keyed by the contents of the source file and the parameters used to calculate them, so renamed or
+    copied files hit the cache and changed files miss.  Recency is tracked by file modification time, which allows
+    several processes to share a cache; each process keeps its own hit, miss and eviction counts.  Arrays may be
+    read and cached from several threads, e.g. the readers of `acoustic_tools.stream`.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 10 * 2**30):
+        self.path = Path(path)
+        self.path.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+
+    def key(self, fpath: Path, params: dict) -> str:
+        """Given path to source file and parameters used to calculate its array, return its key."""
+        # Sorted so the same parameters always serialize the same way
+        params = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.blake2b(f'{file_hash(fpath)}:{params}'.encode(), digest_size=20).hexdigest()
+
+    def get(self, key: str) -> np.ndarray | None:
+        """Given a key, return the cached array or None if it is not cached."""
+        fpath = self._fpath(key)
+        try:
+            array = np.load(fpath)
+            # Mark as recently used
+            os.utime(fpath)
+        except (FileNotFoundError, ValueError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        """Given a key and an array, cache the array, evicting least recently used arrays if the cache is full."""
+        fpath = self._fpath(key)
+        fpath.parent.mkdir(exist_ok=True)
+        # Write to a temporary file first so other processes never read a partial array
+        with tempfile.NamedTemporaryFile(dir=fpath.parent, suffix='.tmp', delete=False) as f:
+            np.save(f, array)
+        os.replace(f.name, fpath)
+        with self._lock:
+            self._size += fpath.stat().st_size
+            full = self._size > self.max_bytes
+
+        if full:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used arrays until the cache is below 90% of `max_bytes`."""
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        entries.sort()
+
+        with self._lock:
+            self._size = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if self._size <= 0.9 * self.max_bytes:
+                    break
+                try:
+                    entry.unlink()
+                except FileNotFoundError:
+                    # Evicted by another process or thread
+                    pass
+                self._size -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Return hit, miss and eviction counts and the size of the cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'bytes': self._size}
+
+    def pop_stats(self) -> dict:
+        """Return hit, miss and eviction counts since the last call and reset them."""
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+            self.hits = self.misses = self.evictions = 0
+        return stats
+
+    def log_stats(self, stats: dict | None = None) -> None:
+        """Log stats, e.g. summed from `pop_stats` of caches in several processes."""
+        stats = stats or self.stats()
+        # Other processes may have added to the cache
+        self._size = sum(entry.stat().st_size for entry in self._entries())
+        requests = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / requests if requests else 0
+        logging.info(
+            f'Spectrogram cache {self.path}: {stats["hits"]} hits, {stats["misses"]} misses ({hit_rate:.1%} hit rate), '
+            f'{stats["evictions"]} evictions, {self._size / 2**20:.1f} MB'
+        )
+
+    def _fpath(self, key: str) -> Path:
+        return self.path / key[:2] / f'{key}.npy'
+
+    def _entries(self):
+        return self.path.glob('*/*.npy')
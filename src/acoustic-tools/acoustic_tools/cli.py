@@ -0,0 +1,59 @@
+"""`acoustic-tools <command> [args]` runs the script of each console script in `setup.cfg` as a subcommand.
+
+Only the module of the command run is imported, and scripts import their heavy dependencies (librosa, matplotlib,
+torch, fastai) where they use them, so `acoustic-tools <command> --help` and short jobs start quickly.  Check
+startup times with `benchmarks/import_time.py`.
+"""
+from __future__ import annotations
+import importlib
+import sys
+
+PROG = 'acoustic-tools'
+
+# module:function and description of each command
+COMMANDS = {
+    'create-spectrograms': ('acoustic_tools.scripts.create_spectrograms:main', 'Create spectrogram images or features of wav files'),
+    'create-training-set': ('acoustic_tools.scripts.create_training_set:main', 'Create training samples from annotations'),
+    'detect': ('acoustic_tools.scripts.detect:main', 'Detect fish calls in long recordings with a trained model'),
+    'export-model': ('acoustic_tools.scripts.export_model:main', 'Export a fastai learner for CPU inference'),
+    'merge-shards': ('acoustic_tools.scripts.merge_shards:main', 'Combine the reports, manifests and feature stores of shards of a run'),
+    'rename-training-set-files': ('acoustic_tools.scripts.rename_training_set_files:main', 'Copy recordings of a directory to timestamped names'),
+    'reorg-data': ('acoustic_tools.scripts.reorg_data:main', 'Copy recordings of the datasets in a config to timestamped names'),
+    'serve-model': ('acoustic_tools.scripts.serve_model:main', 'Serve a trained model over HTTP'),
+    'write-annotation-file': ('acoustic_tools.scripts.write_annotation_file:main', 'Write an annotation file from Raven selection tables'),
+}
+
+
+def usage() -> str:
+    width = max(len(name) for name in COMMANDS)
+    commands = '\n'.join(f'  {name:{width}}  {description}' for name, (_, description) in COMMANDS.items())
+    return f'usage: {PROG} <command> [args]\n\ncommands:\n{commands}\n\nRun `{PROG} <command> --help` for the usage of each command.'
+
+
+def main(argv: list[str] | None = None):
+    """Run the command named by the first argument with the remaining arguments."""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage(), file=sys.stdout if argv else sys.stderr)
+        return 0 if argv else 2
+
+    name, *args = argv
+    if name not in COMMANDS:
+        print(f'{PROG}: unknown command {name!r}\n\n{usage()}', file=sys.stderr)
+        return 2
+
+    module, function = COMMANDS[name][0].split(':')
+    # Scripts parse sys.argv, and name themselves in their usage from its first item
+    sys.argv = [f'{PROG} {name}', *args]
+    command = getattr(importlib.import_module(module), function)
+
+    import click
+
+    if isinstance(command, click.Command):
+        # click would name the command after the module when run with `python -m`
+        return command(prog_name=sys.argv[0])
+    return command()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""PyTorch dataset of spectrograms of annotated calls, calculated from the source recordings as they are loaded.
+
+Samples are clipped from the recordings in `sample_dir` as `create_training_set` clips them and transformed as
+`create_spectrograms` transforms them for the feature store, so preprocessing can be changed without creating
+training sets of wav files and images first, e.g.:
+
+    annotations = create_training_set.read_annotations(Path('mote-samples.csv'))
+    dataset = AnnotationDataset(annotations, Path('reorg'), FFTConfig(), length=10, cache=True)
+    train, valid = torch.utils.data.random_split(dataset, [0.8, 0.2])
+    dls = fastai.data.core.DataLoaders(make_dataloader(train, num_workers=8), make_dataloader(valid, shuffle=False))
+"""
+from __future__ import annotations
+import logging
+import math
+from pathlib import Path
+
+import librosa
+import numpy as np
+import pandas as pd
+import soundfile
+import torch
+
+from acoustic_tools import render, sample
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, audio_to_spec, spec_features, trim
+from acoustic_tools.scripts.create_training_set import EMPTY_CALLS, source_path
+
+
+def label(call_variant: int) -> int:
+    """Given a call variant, return its label, empty calls are all labeled 0 as in `create_training_set`."""
+    return 0 if call_variant in EMPTY_CALLS else int(call_variant)
+
+
+class AnnotationDataset(torch.utils.data.Dataset):
+    """Spectrograms of annotated calls, and their labels.
+
+    Each item is a (1, height, width) float tensor of the spectrogram grid drawn by the 'fast' renderer (see
+    `create_spectrograms.calc_features`), scaled to [0, 1] for 'uint8' features, and the label of the call.
+
+    Parameters
+    ----------
+    annotations: pd.DataFrame
+        Annotations with `file`, `start_time`, `call_length` and `call_variant` columns, e.g. from
+        `create_training_set.read_annotations`
+    sample_dir: Path
+        Path to directory with recordings, organized as `create_training_set` expects
+    fft_config: FFTConfig
+        Spectrogram config
+    length: float
+        Length of sub samples, each clip is split into sub samples of `length` as `sample.create_sample` splits it
+    pad: float
+        Seconds to pad the start and end of each clip
+    lpf: float
+        Frequency at which to low pass filter
+    dtype: str
+        'uint8' (colormap indexes) or 'float16' (spectrogram values) features
+    cache: bool
+        Keep features in shared memory once calculated, so each is only calculated once by any worker.  Requires
+        n_items * height * width bytes (twice that for 'float16').
+    """
+
+    def __init__(
+        self,
+        annotations: pd.DataFrame,
+        sample_dir: Path,
+        fft_config: FFTConfig | None = None,
+        length: float | None = None,
+        pad: float = 0,
+        lpf: float | None = None,
+        dtype: str = 'uint8',
+        cache: bool = False
+    ):
+        self.fft_config = fft_config or FFTConfig()
+        self.length = length
+        self.lpf = lpf
+        self.dtype = dtype
+
+        infos = {}
+        for fname in annotations['file'].unique():
+            infile = source_path(fname, sample_dir)
+            try:
+                infos[fname] = (infile, soundfile.info(infile))
+            except RuntimeError:
+                logging.warning(f'Unable to read {infile}, skipping its annotations')
+
+        # (source, start, end, sub sample index, label) of each sub sample, the index is None without `length`
+        self.items = []
+        for fname, start_time, call_length, call_variant in zip(
+            annotations['file'], annotations['start_time'], annotations['call_length'], annotations['call_variant']
+        ):
+            if fname not in infos:
+                continue
+            infile, info = infos[fname]
+            start, end = start_time - (pad or 0), start_time + call_length + (pad or 0)
+            if not length:
+                self.items.append((infile, start, end, None, label(call_variant)))
+                continue
+            # Frames of the clip as `sample.read_clip` clamps them, split as `sample.sample_outputs` splits them
+            start_frame = min(info.frames, max(0, int(start * info.samplerate)))
+            end_frame = min(info.frames, max(start_frame, int(end * info.samplerate)))
+            for subclip_ix in range(math.ceil((end_frame - start_frame) / int(length * info.samplerate))):
+                self.items.append((infile, start, end, subclip_ix, label(call_variant)))
+
+        self.labels = [item[-1] for item in self.items]
+
+        self._features = None
+        if cache:
+            width, height = self.fft_config.image_size or render.MATPLOTLIB_SIZE
+            # Shared with DataLoader worker processes
+            self._features = torch.zeros((len(self.items), 1, height, width), dtype=getattr(torch, dtype)).share_memory_()
+            self._cached = torch.zeros(len(self.items), dtype=torch.bool).share_memory_()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, ix: int) -> tuple[torch.Tensor, int]:
+        if self._features is not None and self._cached[ix]:
+            return self._scale(self._features[ix]), self.labels[ix]
+
+        features = torch.from_numpy(self.features(ix)).unsqueeze(0)
+        if self._features is not None:
+            self._features[ix] = features
+            self._cached[ix] = True
+
+        return self._scale(features), self.labels[ix]
+
+    def features(self, ix: int) -> np.ndarray:
+        """Given index of an item, return its (height, width) spectrogram grid."""
+        infile, start, end, subclip_ix, _ = self.items[ix]
+        with soundfile.SoundFile(infile) as audio:
+            clip = sample.read_clip(audio, start, end, dtype='float32')
+            sr = audio.samplerate
+        # The whole clip is filtered before it is split, as `sample.create_sample` filters it
+        if self.lpf and len(clip):
+            clip = sample.low_pass_filter(clip, self.lpf, sr)
+        if subclip_ix is not None:
+            # Split as `sample.sample_outputs` splits clips
+            frames = int(self.length * sr)
+            clip = clip[subclip_ix * frames:(subclip_ix + 1) * frames]
+        # Mix down, resample and trim as `create_spectrograms.load_wav` does, decimated clips are kept at their own rate
+        clip = clip.mean(axis=1)
+        if sr != self.fft_config.sr and not self.fft_config.decimate:
+            clip = librosa.resample(clip, orig_sr=sr, target_sr=self.fft_config.sr)
+            sr = self.fft_config.sr
+        clip = trim(clip, sr)
+
+        spec = audio_to_spec(clip, sr, self.fft_config)
+        return spec_features(spec, self.fft_config, self.dtype)
+
+    def _scale(self, features: torch.Tensor) -> torch.Tensor:
+        if features.dtype == torch.uint8:
+            return features.float() / 255
+        return features.float()
+
+
+def _init_worker(worker_id: int) -> None:
+    # Workers each transform a clip at a time, so avoid oversubscribing cores with threads
+    torch.set_num_threads(1)
+
+
+def make_dataloader(
+    dataset: torch.utils.data.Dataset,
+    batch_size: int = 16,
+    num_workers: int = 4,
+    shuffle: bool = True,
+    prefetch_factor: int = 2,
+    **kwargs
+) -> torch.utils.data.DataLoader:
+    """Given a dataset, return a DataLoader which calculates items in `num_workers` processes.
+
+    Each worker prefetches `prefetch_factor` batches and workers are kept between epochs.  Other keyword arguments
+    are passed to `torch.utils.data.DataLoader`.
+    """
+    return torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor if num_workers else None,
+        persistent_workers=num_workers > 0,
+        worker_init_fn=_init_worker,
+        **kwargs
+    )
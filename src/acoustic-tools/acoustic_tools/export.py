@@ -0,0 +1,144 @@
+"""Export a trained fastai learner as a TorchScript (or ONNX) model for CPU inference, optionally quantized to int8.
+
+Exported models take batches of (height, width, 3) uint8 spectrogram images, as rendered by `render.render_spec`,
+and return the probability of each label.  Scaling and normalization of the learner's dataloaders are part of the
+model, so only `torch` is needed to run them (see `scripts/export_model.py`), e.g.:
+
+    model, labels = serve.load_torchscript(Path('fish-sounds.pt'))
+    probs = model(torch.from_numpy(np.stack(images)))
+"""
+from __future__ import annotations
+import json
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Tuple, Union
+
+import numpy as np
+import torch
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Name of the file in TorchScript archives listing the label of each output
+LABELS_FILE = 'labels.json'
+
+
+class ImageClassifier(torch.nn.Module):
+    """Model taking (n, height, width, 3) uint8 images, scaled and normalized as by the learner's dataloaders."""
+
+    def __init__(self, model: torch.nn.Module, mean: torch.Tensor, std: torch.Tensor):
+        super().__init__()
+        self.model = model
+        self.register_buffer('mean', mean.reshape(1, 3, 1, 1).float())
+        self.register_buffer('std', std.reshape(1, 3, 1, 1).float())
+
+    def preprocess(self, images: torch.Tensor) -> torch.Tensor:
+        x = images.permute(0, 3, 1, 2).float() / 255
+        x = (x - self.mean) / self.std
+        return x.contiguous(memory_format=torch.channels_last)
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        return self.model(self.preprocess(images)).softmax(-1)
+
+
+def image_classifier(learner) -> ImageClassifier:
+    """Given a fastai learner, return its model with the normalization of its dataloaders."""
+    mean, std = torch.zeros(3), torch.ones(3)
+    for tfm in learner.dls.after_batch.fs:
+        if type(tfm).__name__ == 'Normalize':
+            mean, std = torch.as_tensor(tfm.mean).cpu(), torch.as_tensor(tfm.std).cpu()
+    model = learner.model.cpu().eval().to(memory_format=torch.channels_last)
+    return ImageClassifier(model, mean, std).eval()
+
+
+def quantize_dynamic(classifier: ImageClassifier) -> ImageClassifier:
+    """Given a classifier, return it with the weights of its linear layers quantized to int8.
+
+    Only the head of a CNN has linear layers, so this shrinks the head but does not speed up the body.
+    """
+    classifier.model = torch.ao.quantization.quantize_dynamic(classifier.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return classifier
+
+
+def quantize_static(
+    classifier: ImageClassifier,
+    calibration_images: List[np.ndarray],
+    backend: str = 'x86',
+    batch_size: int = 16
+) -> ImageClassifier:
+    """Given a classifier and images to calibrate activation ranges with, return it with an int8 body.
+
+    Convolutions, batch norms and activations of the body (the first module of a fastai CNN learner's model) are fused
+    and quantized with FX graph mode post training quantization.  The head is left in float.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = backend
+    sequential = isinstance(classifier.model, torch.nn.Sequential)
+    body = classifier.model[0] if sequential else classifier.model
+
+    example = classifier.preprocess(torch.from_numpy(np.stack(calibration_images[:1])))
+    prepared = prepare_fx(body, get_default_qconfig_mapping(backend), example_inputs=(example,))
+
+    def set_body(module: torch.nn.Module) -> None:
+        if sequential:
+            classifier.model[0] = module
+        else:
+            classifier.model = module
+
+    # Observers record activation ranges of the calibration images as they pass through the classifier
+    set_body(prepared)
+    with torch.no_grad():
+        for start in range(0, len(calibration_images), batch_size):
+            classifier(torch.from_numpy(np.stack(calibration_images[start:start + batch_size])))
+    set_body(convert_fx(prepared))
+    return classifier
+
+
+def export_torchscript(classifier: ImageClassifier, example: torch.Tensor, output: Path, labels: List[str]) -> None:
+    """Given a classifier and example batch of images, save it traced and frozen to output, with its labels."""
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(classifier, example))
+    torch.jit.save(traced, str(output), _extra_files={LABELS_FILE: json.dumps(labels)})
+
+
+def export_onnx(classifier: ImageClassifier, example: torch.Tensor, output: Path, labels: List[str]) -> None:
+    """Given a classifier and example batch of images, save it to output as ONNX (requires `onnx`), with its labels.
+
+    Labels are saved next to the model as json.
+    """
+    torch.onnx.export(
+        classifier,
+        (example,),
+        str(output),
+        input_names=['images'],
+        output_names=['probs'],
+        dynamic_axes={'images': {0: 'batch'}, 'probs': {0: 'batch'}},
+        dynamo=False
+    )
+    output.with_suffix('.json').write_text(json.dumps(labels))
+
+
+def read_images(fpaths: List[Path]) -> List[np.ndarray]:
+    """Given paths to images, return them as (height, width, 3) uint8 arrays, as fastai's `PILImage.create`."""
+    from PIL import Image
+
+    return [np.asarray(Image.open(fpath).convert('RGB')) for fpath in fpaths]
+
+
+def read_labeled_images(csv: Path, replace_prefix: Union[Tuple[str, str], None] = None) -> pd.DataFrame:
+    """Given a csv of `fname` and `label` of images (as saved by the training notebook), return those that exist.
+
+    `replace_prefix` (old, new) moves images saved under `old` to `new`.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv)
+    if replace_prefix:
+        old, new = replace_prefix
+        df['fname'] = [new + fname[len(old):] if fname.startswith(old) else fname for fname in df['fname']]
+    exists = np.array([Path(fname).is_file() for fname in df['fname']], dtype=bool)
+    if not exists.all():
+        logging.warning(f'{(~exists).sum()} of {len(df)} images in {csv} do not exist, skipping them')
+    return df[exists]
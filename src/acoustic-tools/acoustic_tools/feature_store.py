@@ -0,0 +1,185 @@
+"""Sharded array store of spectrograms for model development.
+
+Spectrograms of the same shape are stacked into shards of `shard_size` arrays, saved as `.npy` files which can be
+memory mapped when training (or compressed `.npz` files which are loaded whole).  An index (`index.csv`) records
+the shard and offset of every spectrogram along with its label and source file, and the recording the source was
+clipped from and the offset (s) of the clip in it if known (see `Manifest.recordings`), e.g.:
+
+    shard,offset,label,condition,source,recording,recording_offset
+    shard-00000.npy,0,1,clean,training/call-1/clean/sample-0001-0000.wav,reorg/mote/2021/06/01/mote_2021-06-01T12-00-00.wav,12.345
+"""
+from __future__ import annotations
+import re
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+INDEX_FILE = 'index.csv'
+
+INDEX_COLUMNS = ['shard', 'offset', 'label', 'condition', 'source', 'recording', 'recording_offset']
+
+# Label directories written by `create_training_set`, e.g. call-1/clean/sample-0001-0000.wav
+LABEL_DIR = re.compile(r'^call-(\d+)$')
+
+
+def parse_label(fpath: Path) -> Tuple[int | None, str | None]:
+    """Given path to a sample in a training set, return the call variant and condition (e.g. 'clean') of the sample.
+
+    Condition is None for samples saved directly in the call variant directory (e.g. call-0/sample-0001-0000.wav)
+    and both are None if the path is not in a call variant directory.
+    """
+    dirs = Path(fpath).parts[:-1]
+    for ix in range(len(dirs) - 1, -1, -1):
+        match = LABEL_DIR.match(dirs[ix])
+        if match:
+            condition = dirs[ix + 1] if ix + 1 < len(dirs) else None
+            return int(match.group(1)), condition
+
+    return None, None
+
+
+class ShardWriter:
+    """Write arrays of the same shape and dtype into shards in `output_dir`.
+
+    Use as a context manager, or call `close` to write the last shard and the index.  Paths of the files written
+    are kept in `written`.
+    """
+
+    def __init__(self, output_dir: Path, shard_size: int = 1024, compress: bool = False):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(exist_ok=True, parents=True)
+        self.shard_size = shard_size
+        self.compress = compress
+        self.written = []
+        self._arrays = []
+        self._index = []
+        self._n_shards = 0
+
+    def __enter__(self) -> ShardWriter:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(
+        self,
+        array: np.ndarray,
+        source: Path,
+        recording: str | None = None,
+        recording_offset: float | None = None
+    ) -> None:
+        """Add an array of the spectrogram of `source`, labeled from the path of `source`.
+
+        `recording` is the file `source` was clipped from, and `recording_offset` the offset (s) of the clip in it.
+        """
+        if self._arrays and array.shape != self._arrays[0].shape:
+            raise ValueError(f'Shape of {source} {array.shape} does not match shard shape {self._arrays[0].shape}')
+
+        label, condition = parse_label(source)
+        self._index.append({
+            'shard': self._shard_name(self._n_shards),
+            'offset': len(self._arrays),
+            'label': label,
+            'condition': condition,
+            'source': str(source),
+            'recording': recording,
+            'recording_offset': recording_offset,
+        })
+        self._arrays.append(array)
+        if len(self._arrays) == self.shard_size:
+            self._flush()
+
+    def close(self) -> pd.DataFrame:
+        """Write any remaining arrays and the index, returning the index."""
+        if self._arrays:
+            self._flush()
+        index = pd.DataFrame(self._index, columns=INDEX_COLUMNS)
+        index = index.astype({'label': 'Int64', 'recording_offset': 'float64'})
+        index.to_csv(self.output_dir / INDEX_FILE, index=False)
+        self.written.append(self.output_dir / INDEX_FILE)
+        return index
+
+    def _shard_name(self, shard_ix: int) -> str:
+        return f'shard-{shard_ix:05}.{"npz" if self.compress else "npy"}'
+
+    def _flush(self) -> None:
+        shard = np.stack(self._arrays)
+        fpath = self.output_dir / self._shard_name(self._n_shards)
+        if self.compress:
+            np.savez_compressed(fpath, features=shard)
+        else:
+            np.save(fpath, shard)
+        self.written.append(fpath)
+        self._arrays = []
+        self._n_shards += 1
+
+
+def merge_stores(paths: list[Path], output_dir: Path, link_mode: str = 'hardlink') -> pd.DataFrame:
+    """Given paths to stores (e.g. written by shards of a run), combine them into a store in `output_dir`.
+
+    Shards of each store are linked into `output_dir` with `link_mode` (see `acoustic_tools.files.link_file`),
+    numbered in the order of `paths`, and the index of the combined store is returned.
+    """
+    from acoustic_tools import files
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True, parents=True)
+    indexes = []
+    n_shards = 0
+    for path in paths:
+        index = pd.read_csv(Path(path) / INDEX_FILE, dtype={'label': 'Int64'})
+        names = {}
+        for name in index['shard'].unique():
+            names[name] = f'shard-{n_shards:05}{Path(name).suffix}'
+            files.link_file(Path(path) / name, output_dir / names[name], link_mode)
+            n_shards += 1
+        indexes.append(index.assign(shard=index['shard'].map(names)))
+
+    index = pd.concat(indexes, ignore_index=True) if indexes else pd.DataFrame(columns=INDEX_COLUMNS)
+    index.to_csv(output_dir / INDEX_FILE, index=False)
+    return index
+
+
+class FeatureStore:
+    """Read spectrograms written by `ShardWriter`.
+
+    Uncompressed shards are memory mapped, so only the spectrograms that are accessed are read from disk.
+
+    Examples
+    --------
+    >>> store = FeatureStore('spec-store')
+    >>> spec, label = store[0]
+    >>> specs = store.arrays(store.index.query('condition == "clean"').index)
+    """
+
+    def __init__(self, path: Path, mmap: bool = True):
+        self.path = Path(path)
+        self.mmap = mmap
+        self.index = pd.read_csv(self.path / INDEX_FILE, dtype={'label': 'Int64'})
+        self._shards = {}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, ix: int) -> Tuple[np.ndarray, int]:
+        row = self.index.iloc[ix]
+        return self.shard(row.shard)[row.offset], row.label
+
+    def shard(self, name: str) -> np.ndarray:
+        """Given name of a shard, return all of its arrays."""
+        if name not in self._shards:
+            fpath = self.path / name
+            if fpath.suffix == '.npz':
+                with np.load(fpath) as npz:
+                    self._shards[name] = npz['features']
+            else:
+                self._shards[name] = np.load(fpath, mmap_mode='r' if self.mmap else None)
+
+        return self._shards[name]
+
+    def arrays(self, ixs) -> np.ndarray:
+        """Given positions in the index, return the arrays stacked in the same order."""
+        rows = self.index.iloc[list(ixs)]
+        return np.stack([self.shard(row.shard)[row.offset] for row in rows.itertuples()])
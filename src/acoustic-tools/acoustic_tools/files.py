@@ -0,0 +1,85 @@
+"""Functions for copying or linking files."""
+from __future__ import annotations
+import errno
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Callable
+
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+
+# Linux FICLONE ioctl, clones a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    import fcntl
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def link_file(src: Path, dst: Path, mode: str = 'copy', copy_function: Callable = shutil.copy2) -> str:
+    """Given source and destination paths, copy or link the source to the destination.
+
+    Parameters
+    ----------
+    src: Path
+        Path to source file
+    dst: Path
+        Path to destination file, replaced if it exists
+    mode: str
+        One of 'copy', 'hardlink', 'reflink' (copy-on-write clone) or 'symlink'
+    copy_function: Callable
+        Function used to copy files
+
+    Returns
+    -------
+    mode: str
+        Mode used, 'copy' if the file had to be copied because it couldn't be linked (e.g. across filesystems)
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f'Unknown link mode {mode}, must be one of {LINK_MODES}')
+
+    src = Path(src)
+    dst = Path(dst)
+    # Files are written to a temporary file next to the destination and moved over it, so a hard link or symlink
+    # already at the destination is replaced rather than written through (overwriting its other names or target)
+    tmp = dst.with_name(f'.{dst.name}.tmp')
+    if tmp.exists() or tmp.is_symlink():
+        tmp.unlink()
+    try:
+        used = _link_or_copy(src, tmp, mode, copy_function)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists() or tmp.is_symlink():
+            tmp.unlink()
+    return used
+
+
+def _link_or_copy(src: Path, dst: Path, mode: str, copy_function: Callable) -> str:
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+            return mode
+        if mode == 'symlink':
+            os.symlink(src.resolve(), dst)
+            return mode
+        if mode == 'reflink':
+            _reflink(src, dst)
+            return mode
+    except (OSError, ImportError) as e:
+        # Links across filesystems or on filesystems without support for them fail, so copy instead
+        if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK):
+            raise
+        logging.debug(f'Unable to {mode} {src} to {dst} ({e}), copying')
+
+    copy_function(src, dst)
+    return 'copy'
@@ -0,0 +1,297 @@
+"""Timing and throughput of the stages of batch scripts.
+
+Library functions time their stages (e.g. 'decode', 'filter', 'stft', 'render', 'write', 'copy') and count bytes
+with the module level functions, which record to the current `Instrument` of the process:
+
+    with instrument.stage('stft'):
+        stft = librosa.stft(audio)
+
+Scripts start an instrument for a run, count files as they are done (logging a progress line every
+`progress_interval` seconds) and log, or save, a JSON report at the end, e.g.:
+
+    {"name": "create-spectrograms", "seconds": 61.2, "files": 1000, "files_per_second": 16.3, "failed": 2,
+     "bytes_read": 88200000, "bytes_written": 41000000, "failures_by_type": {"LibsndfileError": 2},
+     "stages": {"decode": {"seconds": 20.1, "calls": 1000, "share": 0.33}, ...}}
+
+Worker processes record to their own instrument, `pop_stats` returns what they recorded to be merged into the
+instrument of the main process with `merge`.  Stage times of workers are summed, so shares are of total work.
+Reports of runs on several nodes (e.g. shards, see `acoustic_tools.shard`) are combined with `merge_reports`.
+
+Scripts overlapping reading and writing with computing (see `acoustic_tools.stream`) also report the mean and max
+depth of their queues and the seconds spent waiting on each, e.g. `"queues": {"read": {"calls": 1000,
+"mean_depth": 0.2, "max_depth": 3, "stall_seconds": 12.5}, ...}`.
+"""
+from __future__ import annotations
+import cProfile
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+# Progress lines and reports are logged at INFO by scripts that otherwise only log warnings
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Instrument:
+    """Durations of stages, counts of files, bytes and failures of a run.
+
+    Parameters
+    ----------
+    name: str
+        Name of the run in progress lines and the report
+    total: int
+        Number of files to process, if known, for progress lines
+    progress_interval: float
+        Least seconds between progress lines, progress isn't logged if None
+    """
+
+    def __init__(self, name: str = 'run', total: int | None = None, progress_interval: float | None = 60.0):
+        self.name = name
+        self.total = total
+        self.progress_interval = progress_interval
+        self.start_time = time.perf_counter()
+        self._last_progress = self.start_time
+        self._lock = threading.Lock()
+        self.stages = collections.defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+        self.queues = collections.defaultdict(_new_queue)
+        self.files = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.failures_by_type = collections.Counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the block as stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float, calls: int = 1) -> None:
+        with self._lock:
+            self.stages[name]['seconds'] += seconds
+            self.stages[name]['calls'] += calls
+
+    def add_queue(self, name: str, depth: int, stall_seconds: float, calls: int = 1, max_depth: int | None = None) -> None:
+        """Record the depth of queue `name` when an item was taken from or added to it, and the time spent waiting."""
+        with self._lock:
+            queue = self.queues[name]
+            queue['calls'] += calls
+            queue['depth'] += depth
+            queue['max_depth'] = max(queue['max_depth'], depth if max_depth is None else max_depth)
+            queue['stall_seconds'] += stall_seconds
+
+    def add_bytes(self, read: int = 0, written: int = 0) -> None:
+        with self._lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+    def done(self, n: int = 1, errors: list[str | Exception | None] | None = None) -> None:
+        """Count `n` files as done (or one per error of `errors`, None for files without errors) and log progress."""
+        if errors is not None:
+            n = len(errors)
+            for error in errors:
+                if error is not None:
+                    self.fail(error)
+        with self._lock:
+            self.files += n
+        self.progress()
+
+    def fail(self, error: str | Exception) -> None:
+        """Count a failure, categorized by its exception type (or the prefix of an error as `'<type>: <message>'`)."""
+        category = type(error).__name__ if isinstance(error, Exception) else error.split(':')[0]
+        with self._lock:
+            self.failed += 1
+            self.failures_by_type[category] += 1
+
+    def progress(self, force: bool = False) -> None:
+        """Log a progress line if `progress_interval` seconds have passed since the last."""
+        now = time.perf_counter()
+        if not force and (self.progress_interval is None or now - self._last_progress < self.progress_interval):
+            return
+        self._last_progress = now
+        elapsed = now - self.start_time
+        rate = self.files / elapsed if elapsed else 0.0
+        files = f'{self.files}/{self.total}' if self.total else f'{self.files}'
+        eta = ''
+        if self.total and rate:
+            eta = f', {(self.total - self.files) / rate:.0f} s left'
+        logger.info(
+            f'{self.name}: {files} files ({rate:.1f} files/s{eta}), {self.failed} failed, '
+            f'{self.bytes_read / 2**20:.1f} MB read, {self.bytes_written / 2**20:.1f} MB written'
+        )
+
+    def pop_stats(self) -> dict:
+        """Return what has been recorded and reset, e.g. to return records of a worker process to the main process."""
+        with self._lock:
+            stats = {
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'queues': {name: dict(queue) for name, queue in self.queues.items()},
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+            }
+            self.stages = collections.defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+            self.queues = collections.defaultdict(_new_queue)
+            self.bytes_read = 0
+            self.bytes_written = 0
+        return stats
+
+    def merge(self, stats: dict | None) -> None:
+        """Given stats from `pop_stats` of another instrument, add them to this one."""
+        if stats is None:
+            return
+        for name, stage in stats['stages'].items():
+            self.add_stage(name, stage['seconds'], stage['calls'])
+        for name, queue in stats.get('queues', {}).items():
+            self.add_queue(name, queue['depth'], queue['stall_seconds'], queue['calls'], queue['max_depth'])
+        self.add_bytes(stats['bytes_read'], stats['bytes_written'])
+
+    def report(self) -> dict:
+        """Return the stats of the run, with the share of the total time of all stages spent in each."""
+        seconds = time.perf_counter() - self.start_time
+        with self._lock:
+            return {
+                'name': self.name,
+                'seconds': seconds,
+                'files': self.files,
+                'files_per_second': self.files / seconds if seconds else 0.0,
+                'failed': self.failed,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'failures_by_type': dict(self.failures_by_type),
+                'stages': _with_shares(self.stages),
+                'queues': _with_means(self.queues),
+            }
+
+    def log_report(self, path: Path | None = None) -> dict:
+        """Log the report, and save it to `path` as JSON if given.  Returns the report."""
+        report = self.report()
+        logger.info(f'{self.name} report: {json.dumps(report)}')
+        if path is not None:
+            Path(path).write_text(json.dumps(report, indent=2) + '\n')
+        return report
+
+
+def _with_shares(stages: dict) -> dict:
+    """Given the seconds and calls of stages, return them with their share of the total, slowest first."""
+    total = sum(stage['seconds'] for stage in stages.values())
+    return {
+        name: {'seconds': stage['seconds'], 'calls': stage['calls'], 'share': stage['seconds'] / total if total else 0.0}
+        for name, stage in sorted(stages.items(), key=lambda item: -item[1]['seconds'])
+    }
+
+
+def _new_queue() -> dict:
+    return {'calls': 0, 'depth': 0, 'max_depth': 0, 'stall_seconds': 0.0}
+
+
+def _with_means(queues: dict) -> dict:
+    """Given the summed depths of queues, return their mean and max depth and the seconds spent waiting on them."""
+    return {
+        name: {
+            'calls': queue['calls'],
+            'mean_depth': queue['depth'] / queue['calls'] if queue['calls'] else 0.0,
+            'max_depth': queue['max_depth'],
+            'stall_seconds': queue['stall_seconds'],
+        }
+        for name, queue in queues.items()
+    }
+
+
+def merge_reports(reports: list[dict]) -> dict:
+    """Given reports of runs at the same time (e.g. shards of a run on several nodes), return their report together.
+
+    Files, failures, bytes and stage times are summed.  `seconds` is of the longest run, so `files_per_second` is
+    of the runs together.
+    """
+    stages = collections.defaultdict(lambda: {'seconds': 0.0, 'calls': 0})
+    queues = collections.defaultdict(_new_queue)
+    failures_by_type = collections.Counter()
+    for report in reports:
+        failures_by_type.update(report['failures_by_type'])
+        for name, stage in report['stages'].items():
+            stages[name]['seconds'] += stage['seconds']
+            stages[name]['calls'] += stage['calls']
+        for name, queue in report.get('queues', {}).items():
+            queues[name]['calls'] += queue['calls']
+            queues[name]['depth'] += queue['mean_depth'] * queue['calls']
+            queues[name]['max_depth'] = max(queues[name]['max_depth'], queue['max_depth'])
+            queues[name]['stall_seconds'] += queue['stall_seconds']
+
+    seconds = max((report['seconds'] for report in reports), default=0.0)
+    files = sum(report['files'] for report in reports)
+    return {
+        'name': reports[0]['name'] if reports else 'run',
+        'seconds': seconds,
+        'files': files,
+        'files_per_second': files / seconds if seconds else 0.0,
+        'failed': sum(report['failed'] for report in reports),
+        'bytes_read': sum(report['bytes_read'] for report in reports),
+        'bytes_written': sum(report['bytes_written'] for report in reports),
+        'failures_by_type': dict(failures_by_type),
+        'stages': _with_shares(stages),
+        'queues': _with_means(queues),
+        'runs': len(reports),
+    }
+
+
+# Instrument of this process, see `start`
+_current = Instrument(progress_interval=None)
+
+
+def start(name: str, total: int | None = None, progress_interval: float | None = 60.0) -> Instrument:
+    """Start a new run, returning its instrument, which stages of this process are recorded to."""
+    global _current
+    _current = Instrument(name, total, progress_interval)
+    return _current
+
+
+def current() -> Instrument:
+    """Return the instrument stages of this process are recorded to."""
+    return _current
+
+
+def stage(name: str) -> contextlib.AbstractContextManager:
+    """Time the block as stage `name` of the current instrument."""
+    return _current.stage(name)
+
+
+def add_bytes(read: int = 0, written: int = 0) -> None:
+    """Count bytes read and written by the current instrument."""
+    _current.add_bytes(read, written)
+
+
+def file_size(fpath: Path) -> int:
+    """Given path to a file, return its size, or 0 if it doesn't exist."""
+    try:
+        return os.stat(fpath).st_size
+    except OSError:
+        return 0
+
+
+@contextlib.contextmanager
+def profile(path: Path | None = None) -> Iterator[None]:
+    """Profile the block with cProfile, saving stats to `path` (read them with `pstats`), if a path is given.
+
+    Only the calling process is profiled, not worker processes.
+    """
+    if path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        logger.info(f'Saved profile to {path}')
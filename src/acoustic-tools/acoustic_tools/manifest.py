@@ -0,0 +1,156 @@
+"""SQLite manifest of samples written by `create_training_set`, used to only redo new or changed work."""
+from __future__ import annotations
+import json
+import logging
+import sqlite3
+from pathlib import Path
+
+# Columns which must match for a sample to be up to date
+SIGNATURE_COLUMNS = [
+    'infile',
+    'source_mtime_ns',
+    'source_size',
+    'start_time',
+    'call_length',
+    'length',
+    'lpf',
+    'whole_outfile',
+]
+
+
+class Manifest:
+    """Record of each sample created from an annotation, keyed by the sample's output path.
+
+    Samples recorded in a manifest are named from the source file and times of their annotation (see
+    `create_training_set.sample_name`) in the directory of their call variant, so records of a sample are found
+    again when other annotations change.
+
+    A sample is up to date if its source file (by modification time and size), times, `length` and `lpf` are
+    unchanged and all of its output files exist.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS samples ('
+            'fpath_out TEXT PRIMARY KEY, '
+            'infile TEXT, '
+            'source_mtime_ns INTEGER, '
+            'source_size INTEGER, '
+            'start_time REAL, '
+            'call_length REAL, '
+            'length REAL, '
+            'lpf REAL, '
+            'whole_outfile TEXT, '
+            'outputs TEXT'
+            ')'
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def signature(self, job: dict, length: float | None, lpf: float | None) -> dict | None:
+        """Given a sample to create, return the values recorded for it, or None if its source does not exist."""
+        try:
+            stat = Path(job['infile']).stat()
+        except OSError:
+            return None
+
+        return {
+            'infile': str(job['infile']),
+            'source_mtime_ns': stat.st_mtime_ns,
+            'source_size': stat.st_size,
+            # Rounded, as times re-read from annotations (or their difference) may change in the last bit
+            'start_time': round(float(job['time_start']), 6),
+            'call_length': round(float(job['time_end'] - job['time_start']), 6),
+            'length': length,
+            'lpf': lpf,
+            'whole_outfile': str(job['whole_outfile']),
+        }
+
+    def pending(self, jobs: list[dict], length: float | None, lpf: float | None) -> list[dict]:
+        """Given samples to create, return those that are not up to date, removing outputs of stale samples.
+
+        Outputs of samples which are no longer in `jobs`, or which changed, are deleted.
+        """
+        recorded = {
+            row[0]: row
+            for row in self.conn.execute(f'SELECT fpath_out, {", ".join(SIGNATURE_COLUMNS)}, outputs FROM samples')
+        }
+        current = {str(job['fpath_out']) for job in jobs}
+
+        removed = 0
+        for fpath_out in set(recorded) - current:
+            self._remove(fpath_out, recorded[fpath_out])
+            removed += 1
+
+        pending = []
+        for job in jobs:
+            row = recorded.get(str(job['fpath_out']))
+            if row is not None:
+                signature = self.signature(job, length, lpf)
+                outputs = json.loads(row[-1])
+                if signature is not None and dict(zip(SIGNATURE_COLUMNS, row[1:-1])) == signature \
+                        and all(Path(output).exists() for output in outputs):
+                    continue
+                self._remove(str(job['fpath_out']), row)
+                removed += 1
+            pending.append(job)
+
+        self.conn.commit()
+        logging.info(
+            f'Manifest {self.path}: {len(jobs) - len(pending)} samples up to date, {len(pending)} to create, '
+            f'{removed} stale samples removed'
+        )
+        return pending
+
+    def record(self, job: dict, length: float | None, lpf: float | None, outputs: list[Path]) -> None:
+        """Given a created sample and the files written for it, record it as up to date."""
+        signature = self.signature(job, length, lpf)
+        if signature is None:
+            return
+
+        values = {'fpath_out': str(job['fpath_out']), **signature, 'outputs': json.dumps([str(o) for o in outputs])}
+        self.conn.execute(
+            f'INSERT OR REPLACE INTO samples ({", ".join(values)}) VALUES ({", ".join("?" * len(values))})',
+            list(values.values())
+        )
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def recordings(self) -> dict[Path, tuple[str, float]]:
+        """Return the source file of each file written for the recorded samples, and its offset (s) in the source.
+
+        Files are keyed by their resolved path.  Sub samples of `length` are offset from the start of their clip as
+        `sample.sample_outputs` splits it (to within a sample), whole files are offset 0.
+        """
+        recordings = {}
+        rows = self.conn.execute('SELECT infile, start_time, length, whole_outfile, outputs FROM samples')
+        for infile, start_time, length, whole_outfile, outputs in rows:
+            clips = [output for output in json.loads(outputs) if output != whole_outfile]
+            for ix, output in enumerate(clips):
+                recordings[Path(output).resolve()] = (infile, round(max(0.0, start_time) + ix * (length or 0), 6))
+            recordings[Path(whole_outfile).resolve()] = (infile, 0.0)
+        return recordings
+
+    def merge(self, path: Path) -> int:
+        """Given path to another manifest (e.g. of a shard), add its samples to this one, returning how many.
+
+        Samples recorded in both are replaced by the record of the other manifest.
+        """
+        columns = ', '.join(['fpath_out', *SIGNATURE_COLUMNS, 'outputs'])
+        self.conn.execute('ATTACH DATABASE ? AS other', (str(path),))
+        try:
+            cursor = self.conn.execute(f'INSERT OR REPLACE INTO samples ({columns}) SELECT {columns} FROM other.samples')
+            self.conn.commit()
+        finally:
+            self.conn.execute('DETACH DATABASE other')
+        return cursor.rowcount
+
+    def _remove(self, fpath_out: str, row: tuple) -> None:
+        for output in json.loads(row[-1]):
+            Path(output).unlink(missing_ok=True)
+        self.conn.execute('DELETE FROM samples WHERE fpath_out = ?', (fpath_out,))
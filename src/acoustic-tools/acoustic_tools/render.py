@@ -0,0 +1,113 @@
+"""Render spectrograms to images without creating matplotlib figures."""
+from __future__ import annotations
+import functools
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+# (width, height) of images saved by `create_spectrograms.plot_spec` with matplotlib's default figure size and dpi
+MATPLOTLIB_SIZE = (496, 369)
+
+# Frequency scales which are drawn linearly by `librosa.display.specshow`
+LINEAR_Y_AXES = ('linear', 'fft', 'hz')
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_lut(cmap: str) -> np.ndarray:
+    """Given a matplotlib colormap name, return an (N, 3) uint8 lookup table of its RGB colors."""
+    import matplotlib
+
+    colormap = matplotlib.colormaps[cmap]
+    return colormap(np.arange(colormap.N), bytes=True)[:, :3]
+
+
+def render_spec(
+    spec: np.ndarray,
+    sr: int,
+    ylim: Tuple[float, float] | None = None,
+    cmap: str = 'magma',
+    vmin: float | None = None,
+    vmax: float | None = None,
+    size: Tuple[int, int] | None = None,
+    y_axis: str = 'linear'
+) -> np.ndarray:
+    """Given a spectrogram, return it as an RGB image.
+
+    Parameters
+    ----------
+    spec: np.ndarray
+        Spectrogram with frequency bins on the first axis and frames on the second
+    sr: int
+        Sample rate of the audio used to calculate the spectrogram
+    ylim: tuple
+        Frequency band (Hz) to include in the image
+    cmap: str
+        Name of matplotlib colormap
+    vmin, vmax: float
+        Values mapped to the bottom and top of the colormap, default to the min and max of `spec`
+    size: tuple
+        (width, height) of image, defaults to size of images saved by matplotlib
+    y_axis: str
+        Frequency scale, only linear scales are supported
+
+    Returns
+    -------
+    image: np.ndarray
+        (height, width, 3) uint8 image with low frequencies at the bottom
+
+    Notes
+    -----
+    See `resample_spec` for how pixels are sampled from the spectrogram.
+    """
+    width, height = size or MATPLOTLIB_SIZE
+    # Only normalize the cells that are drawn, but colormap limits are taken from the whole spectrogram
+    cells = resample_spec(spec, sr, ylim, (width, height), y_axis)
+    lut = colormap_lut(cmap)
+    ix = normalize(cells, np.nanmin(spec) if vmin is None else vmin, np.nanmax(spec) if vmax is None else vmax, len(lut))
+
+    return lut[ix]
+
+
+def resample_spec(
+    spec: np.ndarray,
+    sr: int,
+    ylim: Tuple[float, float] | None = None,
+    size: Tuple[int, int] | None = None,
+    y_axis: str = 'linear'
+) -> np.ndarray:
+    """Given a spectrogram, return the (height, width) grid of its values drawn by `render_spec`.
+
+    Pixels are sampled from the nearest spectrogram cell, with cells laid out as `librosa.display.specshow`
+    lays them out on a linear frequency axis.  Low frequencies are in the last row.
+    """
+    if y_axis not in LINEAR_Y_AXES:
+        raise ValueError(f'Unable to render y_axis {y_axis}, must be one of {LINEAR_Y_AXES}')
+
+    width, height = size or MATPLOTLIB_SIZE
+    n_bins, n_frames = spec.shape
+
+    # Row k is centered on k * (sr / 2) / (n_bins - 1) Hz
+    bin_width = (sr / 2) / max(n_bins - 1, 1)
+    if ylim is None:
+        ylim = (-bin_width / 2, (n_bins - 0.5) * bin_width)
+    # Pixel centers, top row is the highest frequency
+    freqs = ylim[1] - (np.arange(height) + 0.5) * (ylim[1] - ylim[0]) / height
+    rows = np.clip(np.round(freqs / bin_width).astype(int), 0, n_bins - 1)
+    cols = np.clip(((np.arange(width) + 0.5) * n_frames / width).astype(int), 0, n_frames - 1)
+
+    return spec[np.ix_(rows, cols)]
+
+
+def normalize(values: np.ndarray, vmin: float, vmax: float, levels: int = 256) -> np.ndarray:
+    """Given values and colormap limits, return the index of each value in a colormap with `levels` colors."""
+    scale = vmax - vmin if vmax != vmin else 1
+    ix = ((values - vmin) * (levels / scale)).astype(int)
+    return np.clip(ix, 0, levels - 1)
+
+
+def save_image(image: np.ndarray, output: Path) -> None:
+    """Given an image from `render_spec`, save it as a PNG."""
+    import matplotlib.image
+
+    matplotlib.image.imsave(output, image, format='png')
@@ -1,9 +1,73 @@
 """Functions for processing wav files."""
 from __future__ import annotations
+import logging
+import math
+import wave
 from pathlib import Path
 
 import numpy as np
-import pydub
+import soundfile
+
+from acoustic_tools import instrument
+
+# dtype read for each subtype, so clips are written with the same subtype without conversion
+SUBTYPE_DTYPES = {
+    'PCM_16': 'int16',
+    'PCM_24': 'int32',
+    'PCM_32': 'int32',
+    'FLOAT': 'float32',
+    'DOUBLE': 'float64',
+}
+
+
+def read_clip(audio: soundfile.SoundFile, time_start: float, time_end: float, dtype: str | None = None) -> np.ndarray:
+    """Given an open audio file and start and end times (s), return the (frames, channels) array of the clip.
+
+    Only the frames of the clip are read.  Times are clamped to the file.  By default the clip is read in the dtype
+    of the file's samples, float dtypes are scaled to [-1, 1].
+    """
+    start = min(audio.frames, max(0, int(time_start * audio.samplerate)))
+    end = min(audio.frames, max(start, int(time_end * audio.samplerate)))
+    audio.seek(start)
+    return audio.read(end - start, dtype=dtype or SUBTYPE_DTYPES.get(audio.subtype, 'int16'), always_2d=True)
+
+
+def write_wav(fpath_out: Path, clip: np.ndarray, sr: int, subtype: str) -> None:
+    """Given a (frames, channels) array read by `read_clip`, write it to a wav file of `subtype`.
+
+    16 and 32 bit PCM arrays are written from the array's buffer with the `wave` module, which is much quicker than
+    libsndfile for short clips.
+    """
+    if subtype not in ('PCM_16', 'PCM_32'):
+        soundfile.write(fpath_out, clip, sr, subtype=subtype)
+        return
+
+    with wave.open(str(fpath_out), 'wb') as f:
+        f.setnchannels(clip.shape[1])
+        f.setsampwidth(clip.dtype.itemsize)
+        f.setframerate(sr)
+        f.writeframes(np.ascontiguousarray(clip))
+
+
+def low_pass_filter(clip: np.ndarray, cutoff: float, sr: int) -> np.ndarray:
+    """Given a (frames, channels) array, return it filtered by a first order low pass filter, as pydub's.
+
+    Integer arrays are rounded and clipped back to their dtype.
+    """
+    import scipy.signal as signal
+
+    rc = 1 / (2 * math.pi * cutoff)
+    dt = 1 / sr
+    alpha = dt / (rc + dt)
+    # y[i] = y[i - 1] + alpha * (x[i] - y[i - 1]), starting from y[0] = x[0]
+    b, a = [alpha], [1, alpha - 1]
+    zi = (1 - alpha) * clip[:1].astype(np.float64)
+    filtered, _ = signal.lfilter(b, a, clip, axis=0, zi=zi)
+
+    if np.issubdtype(clip.dtype, np.integer):
+        info = np.iinfo(clip.dtype)
+        filtered = np.clip(np.round(filtered), info.min, info.max)
+    return filtered.astype(clip.dtype)
 
 
 def create_sample(
@@ -13,34 +77,131 @@ def create_sample(
     time_end: float,
     length: float | None = None,
     pad: float=0,
-    lpf: float | None = None
-    ) -> None:
-    """Given input and output paths, sample time start and time end, add a pad and save to a new file."""
-    sample = pydub.AudioSegment.from_wav(fpath_in)
-    if lpf:
-        sample = sample.low_pass_filter(lpf)
+    lpf: float | None = None,
+    audio: soundfile.SoundFile | None = None
+    ) -> list[Path]:
+    """Given input and output paths, sample time start and time end, add a pad and save to a new file.
+
+    Only the padded clip is read from `fpath_in` (and filtered if `lpf` is given).  Sub samples of `length` are
+    written from views of the clip.  If `audio` is given (an open `soundfile.SoundFile`) the clip is read from it
+    and `fpath_in` is not opened.  Returns paths of the files written.
+    """
+    if audio is None:
+        with soundfile.SoundFile(fpath_in) as audio:
+            return create_sample(fpath_in, fpath_out, time_start, time_end, length, pad, lpf, audio=audio)
 
     if not pad:
         pad = 0
 
-    # convert s to ms and add padding
-    start_time = int(max(0, (time_start - pad) * 1000))
-    last_time = len(sample)
-    end_time = int(min(last_time, (time_end + pad) * 1000))
-    clip = sample[start_time:end_time]
+    sr = audio.samplerate
+    with instrument.stage('decode'):
+        clip = read_clip(audio, time_start - pad, time_end + pad)
+    instrument.add_bytes(read=clip.nbytes)
+    if lpf and len(clip):
+        with instrument.stage('filter'):
+            clip = low_pass_filter(clip, lpf, sr)
+
+    written = []
+    with instrument.stage('write'):
+        for subclip_out, subclip in sample_outputs(fpath_out, clip, sr, length):
+            write_wav(subclip_out, subclip, sr, audio.subtype)
+            written.append(subclip_out)
+    instrument.add_bytes(written=clip.nbytes)
 
+    return written
+
+
+def sample_outputs(fpath_out: Path, clip: np.ndarray, sr: int, length: float | None = None) -> list[tuple[Path, np.ndarray]]:
+    """Given output path and a clip, return the paths and (views of the) frames of the files `create_sample` writes.
+
+    Raises ValueError if `length` is shorter than a sample.
+    """
     # Create sub samples of length `length`
     if length:
-        clip_length = len(clip)
-        length = int(length * 1000)
-        for subclip_ix, start_ix in enumerate(np.arange(0, clip_length, length)):
-            end_ix = min(last_time, start_ix + length)
-            subclip = clip[start_ix:end_ix]
-            # some samples are length 0, skip them
-            if len(subclip) == 0:
+        frames = int(length * sr)
+        if frames < 1:
+            raise ValueError(f'Sub samples of {length} s are shorter than a sample at {sr} Hz')
+        return [
+            (fpath_out.parent / (fpath_out.name + f"-{subclip_ix:04}.wav"), clip[start_ix:start_ix + frames])
+            for subclip_ix, start_ix in enumerate(range(0, len(clip), frames))
+        ]
+
+    return [(fpath_out.parent / (fpath_out.name + ".wav"), clip)]
+
+
+def read_clips(fpath_in: Path, clips: list[dict], pad: float = 0) -> tuple[list[np.ndarray | str], int, str]:
+    """Given an input file and clips to cut from it, open the file once and read each clip, padded by `pad` seconds.
+
+    Parameters
+    ----------
+    fpath_in: Path
+        Path to source wav file
+    clips: list[dict]
+        Clips to read, each with keys `time_start` and `time_end`
+    pad: float
+        Seconds to pad the start and end of each clip
+
+    Returns
+    -------
+    clips: list
+        The (frames, channels) array of each clip (see `read_clip`), or a description of the error reading it
+    sr: int
+        Sample rate of the file
+    subtype: str
+        Subtype of the file, to write clips with
+    """
+    pad = pad or 0
+    arrays = []
+    with soundfile.SoundFile(fpath_in) as audio:
+        for clip in clips:
+            try:
+                with instrument.stage('decode'):
+                    array = read_clip(audio, clip['time_start'] - pad, clip['time_end'] + pad)
+            except Exception as e:
+                arrays.append(f'{type(e).__name__}: {e}')
                 continue
-            subclip_name = fpath_out.name + f"-{subclip_ix:04}.wav"
-            subclip.export(fpath_out.parent / subclip_name, format='wav')
-    else:
-        clip_name = fpath_out.name + ".wav"
-        clip.export(fpath_out.parent / clip_name, format='wav')
+            instrument.add_bytes(read=array.nbytes)
+            arrays.append(array)
+
+        return arrays, audio.samplerate, audio.subtype
+
+
+def create_samples(
+    fpath_in: Path,
+    clips: list[dict],
+    length: float | None = None,
+    pad: float = 0,
+    lpf: float | None = None
+) -> list[list[Path] | None]:
+    """Given an input file and clips to cut from it, open the file once and create a sample for each clip.
+
+    Parameters
+    ----------
+    fpath_in: Path
+        Path to source wav file
+    clips: list[dict]
+        Clips to create, each with keys `fpath_out`, `time_start` and `time_end`
+    length: float
+        Length of sub samples to create
+    pad: float
+        Seconds to pad the start and end of each clip
+    lpf: float
+        Frequency at which to low pass filter
+
+    Returns
+    -------
+    written: list
+        Paths of files written for each clip, None for clips that could not be created (counted as failures by
+        the current `acoustic_tools.instrument`)
+    """
+    written = []
+    with soundfile.SoundFile(fpath_in) as audio:
+        for clip in clips:
+            try:
+                written.append(create_sample(fpath_in, clip['fpath_out'], clip['time_start'], clip['time_end'], length, pad, lpf, audio=audio))
+            except Exception as e:
+                logging.debug(f'Unable to create sample {clip["fpath_out"]}: {type(e).__name__}: {e}')
+                instrument.current().fail(e)
+                written.append(None)
+
+    return written
@@ -1,21 +1,29 @@
 #!python
-"""Create spectrograms from audio files using matplotlib"""
+"""Create spectrograms from audio files, drawn with matplotlib or the fast renderer (see `acoustic_tools.render`)"""
+import collections
+import concurrent.futures
+import dataclasses
+import fractions
+import functools
+import io
+import itertools
 import logging
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Tuple, Union
+from typing import Iterator, List, Tuple, Union
 
+# librosa, matplotlib.pyplot and scipy take seconds to import, so are imported by the functions using them
 import click
-import librosa
-import librosa.display
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.signal as signal
+
+from acoustic_tools import instrument, render, stream
+from acoustic_tools.cache import SpecCache
+from acoustic_tools.shard import Shard, parse_shard_option, select
 
 logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
 
 
-@dataclass
+@dataclass(frozen=True)
 class FFTConfig():
     n_fft: Union[int, None] = 2**12
     win_length: Union[int, None] = None
@@ -34,96 +42,1077 @@ class FFTConfig():
     vmax: Union[float, None] = None
     bandpass: bool = True
     ylim: Union[Tuple[float, float], None] = (0, 512)
+    # 'matplotlib' draws a figure with specshow, 'fast' renders the array directly (see `acoustic_tools.render`)
+    renderer: str = 'matplotlib'
+    # (width, height) of images from the 'fast' renderer, defaults to the size of matplotlib images
+    image_size: Union[Tuple[int, int], None] = None
+    # Load audio at its own rate and decimate it to the lowest rate keeping `ylim` (see `spec_config`)
+    decimate: bool = False
+
+
+# Fields of FFTConfig only used after spectrogram magnitudes are calculated, changing them doesn't invalidate
+# cached magnitudes
+RENDER_FIELDS = ('db', 'cmap', 'vmin', 'vmax', 'y_axis', 'ylim', 'renderer', 'image_size')
+
+# Mel spectrograms were calculated from a second STFT with librosa's default `n_fft` before version 2, when they
+# were first calculated from the configured STFT, mel magnitudes cached before then aren't reused
+MEL_VERSION = 2
+
+# PCEN was calculated and discarded for the mel spectrogram if both were configured before version 2, when PCEN was
+# first calculated from the mel spectrogram, so spectrograms of both are drawn differently and magnitudes cached
+# before then aren't reused
+PCEN_VERSION = 2
+
+# Decimated audio keeps frequencies up to its Nyquist frequency divided by this margin, its anti-aliasing filter
+# attenuates frequencies above them
+DECIMATION_MARGIN = 1.25
+
+# Sample rate audio files are loaded at unless decimated, librosa's default
+LOAD_SR = 22_050
+
+# Clips are calculated in batches padded to the length of their longest clip, which is at most this many times the
+# length of each clip, e.g. clips of `create_training_set --length` trimmed by different amounts
+BATCH_PADDING = 1.25
+
+# Cache used by worker processes, see `_init_worker`
+_worker_cache: Union[SpecCache, None] = None
+
+
+def cache_params(fft_config: FFTConfig) -> dict:
+    """Given config, return the fields used to calculate spectrogram magnitudes."""
+    params = {k: v for k, v in dataclasses.asdict(fft_config).items() if k not in RENDER_FIELDS}
+    if fft_config.mel:
+        params['mel_version'] = MEL_VERSION
+        if fft_config.pcen:
+            params['pcen_version'] = PCEN_VERSION
+    return params
+
+
+def decimation_factor(fft_config: FFTConfig) -> int:
+    """Given config, return the factor its sample rate is divided by if `decimate` is set, otherwise 1.
+
+    The factor is the largest power of 2 dividing `n_fft`, `hop_length` and `win_length`, so bins and frames keep
+    their frequencies and times, that keeps the top of `ylim` (and `fmax` of mel spectrograms) below the decimated
+    Nyquist frequency by `DECIMATION_MARGIN`.
+    """
+    if not fft_config.decimate or fft_config.ylim is None:
+        return 1
+    top = max(fft_config.ylim[1], fft_config.fmax) if fft_config.mel else fft_config.ylim[1]
+    lengths = [length for length in (fft_config.n_fft, fft_config.hop_length, fft_config.win_length) if length]
+
+    factor = 1
+    while all(length % (2 * factor) == 0 for length in lengths) and fft_config.sr / (4 * factor) >= DECIMATION_MARGIN * top:
+        factor *= 2
+    return factor
+
+
+def spec_config(fft_config: FFTConfig) -> FFTConfig:
+    """Given config, return the config spectrograms are calculated and drawn with.
+
+    If `decimate` is set, its sample rate, `n_fft`, `hop_length` and `win_length` are divided by
+    `decimation_factor`, so spectrograms have the same bin frequencies and frame times from a fraction of the
+    samples, e.g. 129 bins up to 689 Hz at 1378.125 Hz rather than 2049 bins up to 11,025 Hz by default.
+    """
+    if not fft_config.decimate:
+        return fft_config
+    factor = decimation_factor(fft_config)
+    return dataclasses.replace(
+        fft_config,
+        sr=fft_config.sr / factor,
+        n_fft=fft_config.n_fft // factor if fft_config.n_fft else None,
+        hop_length=fft_config.hop_length // factor,
+        win_length=fft_config.win_length // factor if fft_config.win_length else None,
+        decimate=False
+    )
+
+
+def trim(audio: np.ndarray, sr: float) -> np.ndarray:
+    """Given audio, return it with leading and trailing silence trimmed, as `librosa.effects.trim` trims it at 22,050 Hz."""
+    import librosa
+
+    audio, _ = librosa.effects.trim(audio, frame_length=round(2048 * sr / LOAD_SR), hop_length=round(512 * sr / LOAD_SR))
+    return audio
+
 
-def load_wav(fpath):
-    y, sr = librosa.load(fpath)
-    audio, _ = librosa.effects.trim(y)
+def load_wav(fpath, native: bool = False):
+    """Given path to audio file, return its audio, mixed down to mono and trimmed, and its sample rate.
+
+    Audio is resampled to `LOAD_SR`, or kept at the rate of the file if `native`.
+    """
+    import librosa
+
+    with instrument.stage('decode'):
+        y, sr = librosa.load(fpath, sr=None if native else LOAD_SR)
+        audio = trim(y, sr)
+    instrument.add_bytes(read=instrument.file_size(fpath))
 
     return audio, sr
 
 
+@functools.lru_cache(maxsize=None)
+def polyphase_filter(up: int, down: int) -> np.ndarray:
+    """Return the anti-aliasing filter `scipy.signal.resample_poly` designs by default, designed once per ratio.
+
+    The returned array is shared between callers and must not be modified.
+    """
+    import scipy.signal as signal
+
+    max_rate = max(up, down)
+    return signal.firwin(2 * 10 * max_rate + 1, 1 / max_rate, window=('kaiser', 5.0))
+
+
+@functools.lru_cache(maxsize=None)
+def decimation_filter(factor: int, passband: float) -> np.ndarray:
+    """Return a low-pass filter for decimating by `factor` that keeps `passband` (a fraction of the decimated Nyquist
+    frequency) free of aliases, designed once per factor.
+
+    Frequencies between the passband and the first frequency aliased into it are left unattenuated, so the filter is
+    a fraction of the length of `polyphase_filter(1, factor)`, e.g. 439 rather than 641 taps for 32.  The returned
+    array is shared between callers and must not be modified.
+    """
+    import scipy.signal as signal
+
+    numtaps, beta = signal.kaiserord(60, 2 * (1 - passband) / factor)
+    return signal.firwin(numtaps | 1, 1 / factor, window=('kaiser', beta))
+
+
+def decimate(audio: np.ndarray, factor: int, passband: float) -> np.ndarray:
+    """Given audio, or a batch of audio, return it low-pass filtered by `decimation_filter` and decimated by `factor`.
+
+    Samples are filtered in blocks of `factor` by a single matrix product with the filter split into blocks, rather
+    than a sample at a time, and are aligned as `scipy.signal.resample_poly` aligns them.
+    """
+    taps = decimation_filter(factor, passband)
+    blocks = -(-len(taps) // factor)
+    kernel = np.zeros(blocks * factor, dtype=audio.dtype)
+    kernel[:len(taps)] = taps[::-1]
+
+    length = audio.shape[-1]
+    outputs = -(-length // factor)
+    start = len(taps) // 2
+    padded = np.zeros(audio.shape[:-1] + ((outputs + blocks - 1) * factor,), dtype=audio.dtype)
+    padded[..., start:start + length] = audio
+    products = padded.reshape(audio.shape[:-1] + (-1, factor)) @ kernel.reshape(blocks, factor).T
+
+    decimated = np.zeros(audio.shape[:-1] + (outputs,), dtype=audio.dtype)
+    for block in range(blocks):
+        decimated += products[..., block:block + outputs, block]
+    return decimated
+
+
+@functools.lru_cache(maxsize=None)
+def resample_steps(sr: float, target_sr: float) -> Tuple[int, fractions.Fraction]:
+    """Given sample rates, return the integer factor to decimate by and the fraction to resample by after it.
+
+    Of the factors keeping audio at or above `target_sr`, the one leaving the fraction with the smallest terms (then
+    the largest) is used, as the filter of a fraction is 20 taps per unit of its largest term, e.g. 48,000 Hz audio
+    is decimated by 32 and resampled by 147/160 to 1378.125 Hz, rather than resampled by 147/5120 (102,401 taps).
+    """
+    ratio = fractions.Fraction(target_sr) / fractions.Fraction(sr)
+    factors = range(1, max(int(1 / ratio), 1) + 1)
+    factor = min(factors, key=lambda factor: (max((ratio * factor).numerator, (ratio * factor).denominator), -factor))
+    return factor, ratio * factor
+
+
+def mask_lengths(audio: np.ndarray, lengths: Union[List[int], None]) -> np.ndarray:
+    """Given a batch of clips padded to a common length and their lengths, zero each clip after its length in place.
+
+    Returns the batch, unchanged if `lengths` is None.
+    """
+    if lengths is not None:
+        for clip, length in zip(audio, lengths):
+            clip[length:] = 0
+    return audio
+
+
+def resampled_length(length: int, sr: float, target_sr: float) -> int:
+    """Given the number of samples of audio at `sr`, return the number of samples `resample` returns at `target_sr`."""
+    factor, ratio = resample_steps(sr, target_sr)
+    length = -(-length // factor)
+    return -(-length * ratio.numerator // ratio.denominator)
+
+
+def resample(
+    audio: np.ndarray,
+    sr: float,
+    target_sr: float,
+    lengths: Union[List[int], None] = None
+) -> np.ndarray:
+    """Given audio, or a batch of audio, at `sr`, return it resampled to `target_sr`.
+
+    Audio is decimated by an integer factor first (see `decimate`), keeping the frequencies below the Nyquist
+    frequency of `target_sr` divided by `DECIMATION_MARGIN` free of aliases, then resampled by the remaining fraction
+    with a polyphase filter (see `resample_steps`).  If the lengths of clips of a batch padded with zeros are given,
+    each clip is zeroed after its own length after each step, so it is resampled as it would be alone.
+    """
+    import scipy.signal as signal
+
+    factor, ratio = resample_steps(sr, target_sr)
+    resampled = audio
+    if factor > 1:
+        resampled = decimate(resampled, factor, float(ratio) / DECIMATION_MARGIN)
+        lengths = None if lengths is None else [-(-length // factor) for length in lengths]
+        mask_lengths(resampled, lengths)
+    if ratio != 1:
+        up, down = ratio.numerator, ratio.denominator
+        resampled = signal.resample_poly(resampled, up, down, axis=-1, window=polyphase_filter(up, down))
+        lengths = None if lengths is None else [-(-length * up // down) for length in lengths]
+        mask_lengths(resampled, lengths)
+    return resampled.astype(audio.dtype, copy=False)
+
+
 def calc_stft(audio, fft_config):
-    stft = librosa.stft(audio, n_fft=fft_config.n_fft, hop_length=fft_config.hop_length, win_length=fft_config.win_length)
+    import librosa
+
+    with instrument.stage('stft'):
+        stft = librosa.stft(audio, n_fft=fft_config.n_fft, hop_length=fft_config.hop_length, win_length=fft_config.win_length)
     return np.abs(stft)
 
 
-def plot_spec(fpath: Path, output: Path, fft_config: FFTConfig):
-    audio, sr = load_wav(fpath)
-    if fft_config.bandpass:
-        audio = fish_filter(audio, fs=sr)
+def calc_spec(fpath: Path, fft_config: FFTConfig, cache: Union[SpecCache, None] = None) -> np.ndarray:
+    """Given path to audio file, return its spectrogram as configured by `fft_config`.
+
+    If a cache is given, magnitudes are read from it if the file was transformed with the same config before.
+    """
+    if cache is None:
+        audio, sr = load_wav(fpath, native=fft_config.decimate)
+        return audio_to_spec(audio, sr, fft_config)
+
+    with instrument.stage('cache'):
+        key = cache.key(fpath, cache_params(fft_config))
+        magnitudes = cache.get(key)
+    if magnitudes is None:
+        audio, sr = load_wav(fpath, native=fft_config.decimate)
+        magnitudes = calc_magnitudes(audio, sr, fft_config)
+        with instrument.stage('cache'):
+            cache.put(key, magnitudes)
+
+    return scale_spec(magnitudes, fft_config)
+
+
+def audio_to_spec(audio: np.ndarray, sr: int, fft_config: FFTConfig) -> np.ndarray:
+    """Given audio, return its spectrogram as configured by `fft_config`.
+
+    `audio` may be a single clip or a batch of clips of the same length stacked on the first axis, in which case
+    the spectrograms are returned stacked on the first axis.  If `decimate` is set, `sr` may be any rate.
+    """
+    return scale_spec(calc_magnitudes(audio, sr, fft_config), fft_config)
+
+
+def calc_magnitudes(audio: np.ndarray, sr: int, fft_config: FFTConfig) -> np.ndarray:
+    """Given audio, or a batch of audio, return spectrogram magnitudes before they are converted to dB."""
+    return SpecGraph(audio, sr, fft_config).magnitudes()
+
+
+@functools.lru_cache(maxsize=None)
+def mel_basis(sr: int, n_fft: int, n_mels: int, fmin: float, fmax: float) -> np.ndarray:
+    """Return the (n_mels, 1 + n_fft // 2) mel filterbank, built once per set of parameters.
+
+    The returned array is shared between callers and must not be modified.
+    """
+    import librosa
+
+    return librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmin=fmin, fmax=fmax)
+
+
+class SpecGraph:
+    """Features of audio, or a batch of audio, each calculated at most once, when first needed.
+
+    Each feature is calculated from those before it, as configured by `fft_config`:
+
+        audio -> resampled (if `decimate`) -> filtered (if `bandpass`) -> stft (magnitudes) -> power
+              -> mel (if `mel`) -> pcen (if `pcen`)
+
+    The mel spectrogram is the power of the configured STFT through a cached mel filterbank, as
+    `librosa.feature.melspectrogram` calculates it from audio.  PCEN is of the mel spectrogram if configured,
+    otherwise of the STFT magnitudes.  Features are read by name, e.g. `graph['mel']`.
+
+    If `decimate` is set, audio is resampled from `sr` and features are calculated as `spec_config` configures
+    them, with STFT magnitudes scaled to those of tones at the configured rate.
+
+    If `lengths` are given, the batch is of clips of those lengths padded with zeros to a common length.  Resampled
+    and filtered clips are zeroed after their own lengths, so the first `frames()` frames of each clip's features are
+    those of the clip alone, as the STFT pads clips with zeros and PCEN only depends on earlier frames.
+    """
 
-    stft = calc_stft(audio, fft_config)
+    def __init__(self, audio: np.ndarray, sr: float, fft_config: FFTConfig, lengths: Union[List[int], None] = None):
+        self.fft_config = fft_config
+        self.config = spec_config(fft_config)
+        # Sample rate of the audio, and of features after it
+        self.audio_sr = sr
+        self.sr = self.config.sr if fft_config.decimate else sr
+        self.lengths = lengths
+        self._features = {'audio': audio}
 
-    if fft_config.pcen:
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self._features:
+            self._features[name] = getattr(self, f'_calc_{name}')()
+        return self._features[name]
+
+    def __contains__(self, name: str) -> bool:
+        """Return whether the feature has been calculated."""
+        return name in self._features
+
+    def magnitudes(self) -> np.ndarray:
+        """Return the last feature configured, the spectrogram before it is converted to dB."""
+        if self.fft_config.pcen:
+            return self['pcen']
+        if self.fft_config.mel:
+            return self['mel']
+        return self['stft']
+
+    def frames(self) -> List[int]:
+        """Return the number of frames of the features of each clip, given `lengths`."""
+        return [1 + length // self.config.hop_length for length in self._lengths()]
+
+    def _lengths(self) -> Union[List[int], None]:
+        """Return the number of samples of each clip after it is resampled, if `lengths` are given."""
+        if self.lengths is None or not self.fft_config.decimate:
+            return self.lengths
+        return [resampled_length(length, self.audio_sr, self.sr) for length in self.lengths]
+
+    def _calc_resampled(self) -> np.ndarray:
+        if not self.fft_config.decimate:
+            return self['audio']
+        with instrument.stage('resample'):
+            return resample(self['audio'], self.audio_sr, self.sr, self.lengths)
+
+    def _calc_filtered(self) -> np.ndarray:
+        resampled = self['resampled']
+        if not self.fft_config.bandpass:
+            return resampled
+        with instrument.stage('filter'):
+            return mask_lengths(fish_filter(resampled, fs=self.sr), self._lengths())
+
+    def _calc_stft(self) -> np.ndarray:
+        stft = calc_stft(self['filtered'], self.config)
+        if self.config.n_fft != self.fft_config.n_fft:
+            # Magnitudes of tones are proportional to the number of samples in each frame
+            stft *= self.fft_config.n_fft / self.config.n_fft
+        return stft
+
+    def _calc_power(self) -> np.ndarray:
+        stft = self['stft']
+        with instrument.stage('mel'):
+            return stft ** 2
+
+    def _calc_mel(self) -> np.ndarray:
+        power = self['power']
+        with instrument.stage('mel'):
+            config = self.config
+            return mel_basis(self.sr, config.n_fft, config.n_mels, config.fmin, config.fmax) @ power
+
+    def _calc_pcen(self) -> np.ndarray:
+        import librosa
+
+        magnitudes = self['mel'] if self.fft_config.mel else self['stft']
         # Scale PCEN: https://librosa.org/doc/latest/generated/librosa.pcen.html?highlight=pcen#librosa.pcen
-        stft = librosa.pcen(stft * (2**31), sr=fft_config.sr, hop_length=fft_config.hop_length)
-        fft_config.db = True
+        with instrument.stage('pcen'):
+            return librosa.pcen(magnitudes * (2**31), sr=self.sr, hop_length=self.config.hop_length)
 
-    if fft_config.mel:
-        stft = librosa.feature.melspectrogram(
-            y=audio,
+
+def scale_spec(stft: np.ndarray, fft_config: FFTConfig) -> np.ndarray:
+    """Given spectrogram magnitudes, or a batch of them, convert to dB if configured."""
+    import librosa
+
+    # PCEN and mel spectrograms are always in dB
+    if fft_config.db or fft_config.pcen or fft_config.mel:
+        # Reference is the max of each clip
+        with instrument.stage('db'):
+            if stft.ndim > 2:
+                stft = np.stack([librosa.amplitude_to_db(clip_stft, ref=np.max) for clip_stft in stft])
+            else:
+                stft = librosa.amplitude_to_db(stft, ref=np.max)
+
+    return stft
+
+
+def plot_spec(
+    fpath: Path,
+    output: Path,
+    fft_config: FFTConfig,
+    cache: Union[SpecCache, None] = None
+) -> Union[np.ndarray, None]:
+    """Given path to audio file, save spectrogram to output, returning the image if rendered with the 'fast' renderer."""
+    return save_spec(calc_spec(fpath, fft_config, cache), output, fft_config)
+
+
+def plot_specs(
+    fpaths: List[Path],
+    outputs: List[Path],
+    fft_config: FFTConfig,
+    cache: Union[SpecCache, None] = None
+) -> List[Union[str, None]]:
+    """Given input and output paths, save spectrograms calculated in batches and return errors for each file.
+
+    Spectrograms are the same as those from `plot_spec`, but clips of similar lengths (e.g. from
+    `create_training_set --length`) are filtered and transformed together (see `calc_batch`).
+    """
+    batch = read_specs(fpaths, fft_config, cache)
+    calc_batch(batch, fft_config, cache)
+    return write_images(encode_specs(batch, fft_config), outputs, batch['errors'])
+
+
+def read_specs(fpaths: List[Path], fft_config: FFTConfig, cache: Union[SpecCache, None] = None) -> dict:
+    """Given paths to audio files, return their cached magnitudes, or their audio to calculate magnitudes from.
+
+    Returns
+    -------
+    batch: dict
+        'errors' of each file (None if it was read), and by index of file the cache 'keys', cached 'magnitudes',
+        and 'audios' and their sample rates ('srs') of files that weren't cached
+    """
+    batch = {'errors': [None] * len(fpaths), 'keys': {}, 'magnitudes': {}, 'audios': {}, 'srs': {}}
+    for ix, fpath in enumerate(fpaths):
+        try:
+            if cache is not None:
+                with instrument.stage('cache'):
+                    batch['keys'][ix] = cache.key(fpath, cache_params(fft_config))
+                    magnitudes = cache.get(batch['keys'][ix])
+                if magnitudes is not None:
+                    batch['magnitudes'][ix] = magnitudes
+                    continue
+            # Files are at the same rate unless decimated from their own rates
+            batch['audios'][ix], batch['srs'][ix] = load_wav(fpath, native=fft_config.decimate)
+        except Exception as e:
+            batch['errors'][ix] = f'{type(e).__name__}: {e}'
+
+    return batch
+
+
+def batch_groups(lengths: dict) -> List[List]:
+    """Given the length of each clip by index, return groups of indexes, longest first, to calculate together.
+
+    Each clip is at least `1 / BATCH_PADDING` of the length of the longest clip of its group.
+    """
+    groups = []
+    for ix in sorted(lengths, key=lengths.get, reverse=True):
+        if groups and lengths[ix] * BATCH_PADDING >= lengths[groups[-1][0]]:
+            groups[-1].append(ix)
+        else:
+            groups.append([ix])
+    return groups
+
+
+def calc_batch(batch: dict, fft_config: FFTConfig, cache: Union[SpecCache, None] = None) -> None:
+    """Given a batch from `read_specs`, calculate the magnitudes of its audio together, saving them to the cache if given.
+
+    Clips at the same rate are padded to the length of the longest clip of their group (see `batch_groups`) and
+    calculated together, with the features of each clip cut to its own frames (see `SpecGraph`).
+    """
+    audios, srs = batch.pop('audios'), batch.pop('srs')
+    ixs = list(audios)
+    try:
+        by_sr = {}
+        for ix in ixs:
+            by_sr.setdefault(srs[ix], {})[ix] = len(audios[ix])
+        for sr, lengths in by_sr.items():
+            for group in batch_groups(lengths):
+                padded = np.zeros((len(group), lengths[group[0]]), dtype=audios[group[0]].dtype)
+                for row, ix in zip(padded, group):
+                    row[:lengths[ix]] = audios[ix]
+                graph = SpecGraph(padded, sr, fft_config, lengths=[lengths[ix] for ix in group])
+                for ix, clip_magnitudes, frames in zip(group, graph.magnitudes(), graph.frames()):
+                    batch['magnitudes'][ix] = clip_magnitudes[..., :frames]
+                    if cache is not None:
+                        with instrument.stage('cache'):
+                            cache.put(batch['keys'][ix], batch['magnitudes'][ix])
+    except Exception as e:
+        for ix in ixs:
+            batch['errors'][ix] = f'{type(e).__name__}: {e}'
+
+
+def encode_specs(batch: dict, fft_config: FFTConfig) -> List[Union[bytes, None]]:
+    """Given a batch with magnitudes from `calc_batch`, return the PNG of each spectrogram, recording errors to the batch."""
+    pngs = [None] * len(batch['errors'])
+    for ix, error in enumerate(batch['errors']):
+        if error is not None:
+            continue
+        try:
+            _, pngs[ix] = encode_spec(scale_spec(batch['magnitudes'][ix], fft_config), fft_config)
+        except Exception as e:
+            batch['errors'][ix] = f'{type(e).__name__}: {e}'
+
+    return pngs
+
+
+def write_images(pngs: List[Union[bytes, None]], outputs: List[Path], errors: List[Union[str, None]]) -> List[Union[str, None]]:
+    """Given PNGs, output paths and errors of files, save the PNGs of files without errors and return errors for each file."""
+    errors = list(errors)
+    for ix, (png, output) in enumerate(zip(pngs, outputs)):
+        if errors[ix] is not None:
+            continue
+        try:
+            write_image(png, output)
+        except Exception as e:
+            errors[ix] = f'{type(e).__name__}: {e}'
+
+    return errors
+
+
+def save_spec(stft: np.ndarray, output: Path, fft_config: FFTConfig) -> Union[np.ndarray, None]:
+    """Given a spectrogram, save it to output, returning the image if rendered with the 'fast' renderer."""
+    image, png = encode_spec(stft, fft_config, encode=bool(output))
+    if output:
+        write_image(png, output)
+    return image
+
+
+def encode_spec(
+    stft: np.ndarray,
+    fft_config: FFTConfig,
+    encode: bool = True
+) -> Tuple[Union[np.ndarray, None], Union[bytes, None]]:
+    """Given a spectrogram, return the image if rendered with the 'fast' renderer, and the PNG if `encode`."""
+    # Decimated spectrograms are drawn at their own rate
+    fft_config = spec_config(fft_config)
+    if fft_config.renderer == 'fast':
+        with instrument.stage('render'):
+            image = render.render_spec(
+                stft,
+                sr=fft_config.sr,
+                ylim=fft_config.ylim,
+                cmap=fft_config.cmap,
+                vmin=fft_config.vmin,
+                vmax=fft_config.vmax,
+                size=fft_config.image_size,
+                y_axis=fft_config.y_axis
+            )
+            png = None
+            if encode:
+                buffer = io.BytesIO()
+                render.save_image(image, buffer)
+                png = buffer.getvalue()
+        return image, png
+
+    import librosa.display
+    import matplotlib.pyplot as plt
+
+    with instrument.stage('render'):
+        fig, ax = plt.subplots(1, 1)
+        _ = librosa.display.specshow(
+            stft,
             sr=fft_config.sr,
-            n_mels=fft_config.n_mels,
+            hop_length=fft_config.hop_length,
+            x_axis='time',
+            y_axis=fft_config.y_axis,
             fmin=fft_config.fmin,
-            fmax=fft_config.fmax
+            fmax=fft_config.fmax,
+            cmap=fft_config.cmap,
+            ax=ax,
+            vmin=fft_config.vmin,
+            vmax=fft_config.vmax
         )
-        # Mel is in db
-        fft_config.db = True
-
-    if fft_config.db:
-        stft = librosa.amplitude_to_db(stft, ref=np.max)
-
-    fig, ax = plt.subplots(1, 1)
-    _ = librosa.display.specshow(
-        stft,
-        sr=fft_config.sr,
-        hop_length=fft_config.hop_length,
-        x_axis='time',
-        y_axis=fft_config.y_axis,
-        fmin=fft_config.fmin,
-        fmax=fft_config.fmax,
-        cmap=fft_config.cmap,
-        ax=ax,
-        vmin=fft_config.vmin,
-        vmax=fft_config.vmax
-    )
-    ax.set_axis_off()
-    if fft_config.ylim is not None:
-        ax.set_ylim(fft_config.ylim)
-
-    if output:
-        fig.savefig(output, bbox_inches='tight', pad_inches=0)
-        plt.close(fig=fig)
+        ax.set_axis_off()
+        if fft_config.ylim is not None:
+            ax.set_ylim(fft_config.ylim)
+        png = None
+        if encode:
+            # Figures are drawn as they are saved
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png', bbox_inches='tight', pad_inches=0)
+            png = buffer.getvalue()
 
     plt.close('all')
 
+    return None, png
+
+
+def write_image(png: bytes, output: Path) -> None:
+    """Given a PNG from `encode_spec`, save it to output."""
+    with instrument.stage('write'):
+        Path(output).write_bytes(png)
+    instrument.add_bytes(written=len(png))
+
+
+@functools.lru_cache(maxsize=None)
+def butter_sos(low: float, high: float, order: int, fs: float) -> np.ndarray:
+    """Return second-order sections of a Butterworth bandpass filter, designed once per set of parameters.
+
+    The returned array is shared between callers and must not be modified.
+    """
+    import scipy.signal as signal
+
+    return signal.butter(order, [low, high], 'bandpass', output='sos', fs=fs)
+
 
 def fish_filter(call, low=50, high=512, order=8, fs=22_050):
-    sos = signal.butter(order, [low, high], 'bandpass', output='sos', fs=fs)
-    return signal.sosfilt(sos, call)
+    """Bandpass filter a clip, or a batch of clips stacked on the first axis."""
+    import scipy.signal as signal
+
+    return signal.sosfilt(butter_sos(low, high, order, fs), call, axis=-1)
+
+
+def convert_stream(
+    fpath_jobs: List[List[Path]],
+    output_jobs: List[List[Path]],
+    fft_config: FFTConfig,
+    readers: int = 4,
+    queue_size: int = 8,
+    cache: Union[SpecCache, None] = None
+) -> Iterator[List[Union[str, None]]]:
+    """Given jobs of input and output paths, save their spectrograms with `plot_specs`, yielding the errors of each job.
+
+    Files of jobs are read in `readers` threads and their PNGs written in a writer thread while the spectrograms of
+    other jobs are calculated and drawn, with at most `queue_size` jobs waiting between stages (see
+    `acoustic_tools.stream`).
+    """
+    def read(job):
+        return read_specs(job[0], fft_config, cache)
+
+    def compute(job, batch):
+        calc_batch(batch, fft_config, cache)
+        return encode_specs(batch, fft_config), batch['errors']
+
+    def write(job, encoded):
+        pngs, errors = encoded
+        return write_images(pngs, job[1], errors)
+
+    jobs = list(zip(fpath_jobs, output_jobs))
+    for (fpath_job, _), job_errors, error in stream.stream(jobs, read, compute, write, readers, queue_size):
+        yield job_errors if error is None else [error] * len(fpath_job)
+
+
+def convert_chunk(
+    fpath_jobs: List[List[Path]],
+    output_jobs: List[List[Path]],
+    fft_config: FFTConfig,
+    readers: int = 4,
+    queue_size: int = 8,
+    cache: Union[SpecCache, None] = None
+) -> List[List[Union[str, None]]]:
+    """Given jobs of input and output paths, save their spectrograms with `convert_stream` and return errors of each job."""
+    return list(convert_stream(fpath_jobs, output_jobs, fft_config, readers, queue_size, cache))
+
+
+def _init_worker(cache_path: Union[Path, None] = None, cache_bytes: Union[int, None] = None) -> None:
+    """Use a non-interactive matplotlib backend, open the spectrogram cache and start instrumenting worker processes."""
+    global _worker_cache
+    import matplotlib
+
+    matplotlib.use('agg')
+    # Forked workers would otherwise return what the main process recorded before they started
+    instrument.start('worker', progress_interval=None)
+    if cache_path is not None:
+        _worker_cache = SpecCache(cache_path, cache_bytes)
+
+
+def _in_worker(func, *args):
+    """Call `func` with the worker's cache, returning the result, and the cache stats and instrument stats of the call."""
+    result = func(*args, cache=_worker_cache)
+    return result, _worker_cache.pop_stats() if _worker_cache is not None else None, instrument.current().pop_stats()
+
+
+def _pool(workers: int, cache: Union[SpecCache, None]) -> concurrent.futures.ProcessPoolExecutor:
+    initargs = (cache.path, cache.max_bytes) if cache is not None else ()
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+
+
+def _sum_stats(stats: List[Union[dict, None]]) -> Union[dict, None]:
+    stats = [s for s in stats if s is not None]
+    if not stats:
+        return None
+    return {k: sum(s[k] for s in stats) for k in stats[0]}
+
+
+def convert_files(
+    fpaths: List[Path],
+    outputs: List[Path],
+    fft_config: FFTConfig,
+    workers: int = 1,
+    batch_size: int = 1,
+    cache: Union[SpecCache, None] = None,
+    readers: int = 4,
+    queue_size: int = 8
+) -> dict:
+    """Given input and output paths, save spectrograms using `workers` processes and return a summary.
+
+    If `batch_size` is greater than 1, spectrograms of up to `batch_size` files are calculated together
+    (see `plot_specs`).  If a cache is given, magnitudes are read from and saved to it.  Each process reads and
+    writes files while it calculates spectrograms of others, see `convert_stream`.
+
+    Returns
+    -------
+    summary: dict
+        Counts of converted and failed files, failure counts by error type, the errors for each failed file and
+        cache hit, miss and eviction counts
+    """
+    batches = [slice(ix, ix + batch_size) for ix in range(0, len(fpaths), batch_size)]
+    fpath_jobs = [fpaths[batch] for batch in batches]
+    output_jobs = [outputs[batch] for batch in batches]
+
+    run = instrument.current()
+    if workers > 1:
+        executor = _pool(workers, cache)
+        # Jobs are small, so send several to a worker at a time
+        chunksize = max(1, min(64, len(fpath_jobs) // (workers * 4)))
+        chunks = [slice(ix, ix + chunksize) for ix in range(0, len(fpath_jobs), chunksize)]
+        fpath_chunks = [fpath_jobs[chunk] for chunk in chunks]
+        chunk_results = executor.map(
+            functools.partial(_in_worker, convert_chunk),
+            fpath_chunks,
+            [output_jobs[chunk] for chunk in chunks],
+            itertools.repeat(fft_config),
+            itertools.repeat(readers),
+            itertools.repeat(queue_size)
+        )
+    else:
+        executor = None
+        # Stages are recorded to the instrument of this process directly, as each job is done
+        fpath_chunks = [fpath_jobs]
+        chunk_results = [(convert_stream(fpath_jobs, output_jobs, fft_config, readers, queue_size, cache), None, None)]
+
+    results = []
+    worker_stats = []
+    try:
+        for fpath_chunk, (chunk_errors, stats, instrument_stats) in zip(fpath_chunks, chunk_results):
+            worker_stats.append(stats)
+            run.merge(instrument_stats)
+            for fpath_job, job_errors in zip(fpath_chunk, chunk_errors):
+                logging.debug(f'Converted {len(fpath_job)} files from {fpath_job[0]}')
+                run.done(errors=job_errors)
+                results.extend(zip(fpath_job, job_errors))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if executor is not None:
+        cache_stats = _sum_stats(worker_stats)
+    else:
+        cache_stats = cache.pop_stats() if cache is not None else None
+
+    failures = {str(fpath): error for fpath, error in results if error is not None}
+    return _summarize(len(results), failures, cache_stats)
+
+
+def _summarize(n_files: int, failures: dict, cache_stats: Union[dict, None] = None) -> dict:
+    return {
+        'converted': n_files - len(failures),
+        'failed': len(failures),
+        'failures_by_type': dict(collections.Counter(error.split(':')[0] for error in failures.values())),
+        'failures': failures,
+        'cache': cache_stats,
+    }
+
+
+def calc_features(
+    fpath: Path,
+    fft_config: FFTConfig,
+    dtype: str = 'uint8',
+    cache: Union[SpecCache, None] = None
+) -> np.ndarray:
+    """Given path to audio file, return the (height, width) grid of spectrogram values drawn by the 'fast' renderer.
+
+    'uint8' values are colormap indexes (0 - 255), 'float16' values are the spectrogram values.
+    """
+    return spec_features(calc_spec(fpath, fft_config, cache), fft_config, dtype)
+
+
+def spec_features(spec: np.ndarray, fft_config: FFTConfig, dtype: str = 'uint8') -> np.ndarray:
+    """Given a spectrogram, return the (height, width) grid of its values drawn by the 'fast' renderer (see `calc_features`)."""
+    cells = render.resample_spec(spec, spec_config(fft_config).sr, fft_config.ylim, fft_config.image_size, fft_config.y_axis)
+    if dtype == 'uint8':
+        vmin = np.nanmin(spec) if fft_config.vmin is None else fft_config.vmin
+        vmax = np.nanmax(spec) if fft_config.vmax is None else fft_config.vmax
+        return render.normalize(cells, vmin, vmax, 256).astype(np.uint8)
+
+    return cells.astype(dtype)
+
+
+def stream_features(
+    fpaths: List[Path],
+    fft_config: FFTConfig,
+    dtype: str = 'uint8',
+    readers: int = 4,
+    queue_size: int = 8,
+    write=None,
+    cache: Union[SpecCache, None] = None
+) -> Iterator[Union[np.ndarray, str, None]]:
+    """Given paths to audio files, yield their features (see `calc_features`) or a description of the error of each.
+
+    Files are read in `readers` threads while features of others are calculated (see `acoustic_tools.stream`).  If
+    `write` is given, it is called with the features and path of each file in a writer thread, and its result is
+    yielded rather than the features.
+    """
+    def read(fpath):
+        return read_specs([fpath], fft_config, cache)
+
+    def compute(fpath, batch):
+        calc_batch(batch, fft_config, cache)
+        if batch['errors'][0] is not None:
+            return batch['errors'][0]
+        return spec_features(scale_spec(batch['magnitudes'][0], fft_config), fft_config, dtype)
+
+    def write_or_error(fpath, features):
+        if write is None or isinstance(features, str):
+            return features
+        return write(features, fpath)
+
+    for _, result, error in stream.stream(fpaths, read, compute, write_or_error, readers, queue_size):
+        yield result if error is None else error
+
+
+def features_chunk(
+    fpaths: List[Path],
+    fft_config: FFTConfig,
+    dtype: str = 'uint8',
+    readers: int = 4,
+    queue_size: int = 8,
+    cache: Union[SpecCache, None] = None
+) -> List[Union[np.ndarray, str]]:
+    """Given paths to audio files, return their features, or a description of the error of each, with `stream_features`."""
+    return list(stream_features(fpaths, fft_config, dtype, readers, queue_size, cache=cache))
+
+
+def write_features(
+    fpaths: List[Path],
+    output_dir: Path,
+    fft_config: FFTConfig,
+    workers: int = 1,
+    dtype: str = 'uint8',
+    shard_size: int = 1024,
+    compress: bool = False,
+    cache: Union[SpecCache, None] = None,
+    readers: int = 4,
+    queue_size: int = 8,
+    recordings: Union[dict, None] = None
+) -> dict:
+    """Given input paths, write spectrogram arrays to a sharded feature store and return a summary.
+
+    See `acoustic_tools.feature_store` for the layout of the store and `convert_files` for the summary.  With one
+    worker, arrays are added to the store in a writer thread while features of other files are calculated.  The
+    recording and offset of each input are recorded in the index if given in `recordings` by resolved path (see
+    `acoustic_tools.manifest.Manifest.recordings`).
+    """
+    from acoustic_tools import feature_store
+
+    run = instrument.current()
+    failures = {}
+    worker_stats = []
+    recordings = recordings or {}
+    with feature_store.ShardWriter(output_dir, shard_size=shard_size, compress=compress) as writer:
+
+        def add(features, fpath):
+            recording, offset = recordings.get(Path(fpath).resolve(), (None, None))
+            with instrument.stage('write'):
+                writer.add(features, fpath, recording, offset)
+
+        if workers > 1:
+            executor = _pool(workers, cache)
+            chunksize = max(1, min(64, len(fpaths) // (workers * 4)))
+            fpath_chunks = [fpaths[ix:ix + chunksize] for ix in range(0, len(fpaths), chunksize)]
+            chunk_results = executor.map(
+                functools.partial(_in_worker, features_chunk),
+                fpath_chunks,
+                itertools.repeat(fft_config),
+                itertools.repeat(dtype),
+                itertools.repeat(readers),
+                itertools.repeat(queue_size)
+            )
+        else:
+            executor = None
+            fpath_chunks = [fpaths]
+            chunk_results = [(stream_features(fpaths, fft_config, dtype, readers, queue_size, add, cache), None, None)]
+
+        try:
+            for fpath_chunk, (results, stats, instrument_stats) in zip(fpath_chunks, chunk_results):
+                worker_stats.append(stats)
+                run.merge(instrument_stats)
+                for fpath, result in zip(fpath_chunk, results):
+                    if isinstance(result, str):
+                        failures[str(fpath)] = result
+                        run.done(errors=[result])
+                        continue
+                    if executor is not None:
+                        add(result, fpath)
+                    run.done()
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    run.add_bytes(written=sum(instrument.file_size(fpath) for fpath in writer.written))
+    if executor is not None:
+        cache_stats = _sum_stats(worker_stats)
+    else:
+        cache_stats = cache.pop_stats() if cache is not None else None
+
+    return _summarize(len(fpaths), failures, cache_stats)
 
 
 @click.command()
 @click.argument('path_to_wavs', type=click.Path(exists=True))
 @click.argument('path_to_output', type=click.Path())
-def main(path_to_wavs: Path, path_to_output: Path) -> None:
+@click.option('--workers', type=int, default=1, show_default=True, help='Number of processes used to create spectrograms')
+@click.option(
+    '--renderer',
+    type=click.Choice(['matplotlib', 'fast']),
+    default='matplotlib',
+    show_default=True,
+    help='Draw spectrograms with matplotlib or render arrays directly to images'
+)
+@click.option(
+    '--output-format',
+    type=click.Choice(['png', 'npy', 'npz']),
+    default='png',
+    show_default=True,
+    help='Save a PNG per file, or arrays in a sharded feature store (npz shards are compressed)'
+)
+@click.option(
+    '--dtype',
+    type=click.Choice(['uint8', 'float16']),
+    default='uint8',
+    show_default=True,
+    help='Feature store dtype, colormap indexes (uint8) or spectrogram values (float16)'
+)
+@click.option(
+    '--batch-size',
+    type=int,
+    default=1,
+    show_default=True,
+    help='Number of files whose spectrograms are calculated together (clips of the same length are batched)'
+)
+@click.option(
+    '--readers',
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help='Number of threads in each process reading files while others are calculated'
+)
+@click.option(
+    '--queue-size',
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help='Most jobs read ahead of, or waiting to be written after, calculating spectrograms in each process'
+)
+@click.option('--shard-size', type=int, default=1024, show_default=True, help='Number of spectrograms per feature store shard')
+@click.option(
+    '--manifest',
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help='Manifest of create-training-set, to record the recording and offset of each sample in the feature store index'
+)
+@click.option(
+    '--decimate',
+    is_flag=True,
+    help='Load audio at its own rate and decimate it to the lowest rate keeping the frequencies drawn before the STFT'
+)
+@click.option(
+    '--cache-dir',
+    type=click.Path(),
+    default=None,
+    help='Directory to cache spectrogram magnitudes in, reused while only rendering options (e.g. cmap, db) change'
+)
+@click.option('--cache-size', type=float, default=10.0, show_default=True, help='Maximum size of the cache (GB)')
+@click.option(
+    '--shard',
+    type=str,
+    default=None,
+    callback=parse_shard_option,
+    help='Only convert shard i of N (e.g. 0/4) of the wav files, by their path in PATH_TO_WAVS (see acoustic_tools.shard)'
+)
+@click.option('--report', type=click.Path(), default=None, help='Path to save a JSON report of the time spent in each stage to')
+@click.option('--progress-interval', type=float, default=60.0, show_default=True, help='Seconds between progress lines')
+@click.option('--profile', type=click.Path(), default=None, help='Path to save cProfile stats of the main process to')
+def main(
+    path_to_wavs: Path,
+    path_to_output: Path,
+    workers: int,
+    renderer: str,
+    output_format: str,
+    dtype: str,
+    batch_size: int,
+    readers: int,
+    queue_size: int,
+    shard_size: int,
+    manifest: Union[Path, None],
+    decimate: bool,
+    cache_dir: Union[Path, None],
+    cache_size: float,
+    shard: Union[Shard, None],
+    report: Union[Path, None],
+    progress_interval: float,
+    profile: Union[Path, None]
+) -> None:
     """Given paths to input audio files save spectrograms in output directory"""
     logging.info(f'Saving spectrograms from audio files in {path_to_wavs} in {path_to_output}')
     base_out = Path(path_to_output)
     path_to_wavs = Path(path_to_wavs)
 
-    fft_config = FFTConfig()
+    fft_config = FFTConfig(renderer=renderer, decimate=decimate)
+    cache = SpecCache(cache_dir, int(cache_size * 2**30)) if cache_dir else None
+
+    wavs = sorted(path_to_wavs.glob('**/*.wav'))
+    if shard is not None:
+        n_wavs = len(wavs)
+        wavs = select(wavs, shard, key=lambda wav: wav.relative_to(path_to_wavs).as_posix())
+        logging.info(f'Converting shard {shard[0]}/{shard[1]}, {len(wavs)} of {n_wavs} files')
 
-    for training_file in path_to_wavs.glob('**/*.wav'):
-        logging.info(f'Converting {training_file}')
+    if output_format != 'png':
+        training_files = wavs
+        recordings = None
+        if manifest is not None:
+            from acoustic_tools.manifest import Manifest
+
+            samples = Manifest(manifest)
+            try:
+                recordings = samples.recordings()
+            finally:
+                samples.close()
+        logging.info(f'Writing {len(training_files)} files to feature store using {workers} worker(s)')
+        run = instrument.start('create-spectrograms', len(training_files), progress_interval)
+        with instrument.profile(profile):
+            summary = write_features(
+                training_files,
+                base_out,
+                fft_config,
+                workers=workers,
+                dtype=dtype,
+                shard_size=shard_size,
+                compress=output_format == 'npz',
+                cache=cache,
+                readers=readers,
+                queue_size=queue_size,
+                recordings=recordings
+            )
+        _log_summary(summary, cache)
+        run.log_report(report)
+        return
+
+    training_files = []
+    output_files = []
+    for training_file in wavs:
         output_dir = base_out / str(training_file.parents[0])
         output_dir.mkdir(exist_ok=True, parents=True)
         output_name = str(training_file.name).replace('.wav', '.png')
-        output_file = output_dir / output_name
-        try:
-            plot_spec(training_file, output_file, fft_config)
-        except:
-            logging.error(f'Failed to convert {training_file}')
+        training_files.append(training_file)
+        output_files.append(output_dir / output_name)
+
+    logging.info(f'Converting {len(training_files)} files using {workers} worker(s)')
+    run = instrument.start('create-spectrograms', len(training_files), progress_interval)
+    with instrument.profile(profile):
+        summary = convert_files(
+            training_files,
+            output_files,
+            fft_config,
+            workers,
+            batch_size,
+            cache,
+            readers=readers,
+            queue_size=queue_size
+        )
+    _log_summary(summary, cache)
+    run.log_report(report)
+
+
+def _log_summary(summary: dict, cache: Union[SpecCache, None] = None) -> None:
+    for training_file, error in summary['failures'].items():
+        logging.error(f'Failed to convert {training_file}: {error}')
+    logging.info(
+        f'Converted {summary["converted"]} files, failed to convert {summary["failed"]} files '
+        f'{summary["failures_by_type"]}'
+    )
+    if cache is not None and summary['cache'] is not None:
+        cache.log_stats(summary['cache'])
 
 
 if __name__ == '__main__':
@@ -2,20 +2,83 @@
 """Create training dateset given sample files and annotation DataFrame."""
 from __future__ import annotations
 import datetime
-import itertools
 import logging
 import shutil
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import pandas as pd
+from acoustic_tools import annotation_store, files, instrument, sample, stream
+from acoustic_tools.manifest import Manifest
+from acoustic_tools.shard import Shard, parse_shard, select_rows
 
-from acoustic_tools import sample
+if TYPE_CHECKING:
+    import pandas as pd
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s: %(message)s')
 
+CALL_VARIANTS = [
+    1,  # grouper 1
+    2,  # grouper 2
+    3,  # grouper grunt
+    4,  # grouper spawning rush
+    5,  # grouper chorus < 50% of file
+    6,  # grouper chrous > 50% of file
+    8,  # unidentified sound type
+    9,  # red grouper 1
+    10,  # red grouper 2
+    17,  # red hind 1
+    18,  # red hind 2
+    19,  # red hind 3
+    25,  # goliath grouper 1
+    27,  # multi-phase goliath grouper
+    28,  # sea trout chorus
+    29,  # silver perch call
+    30,  # snowy grouper primary call
+    33,  # gag grouper primary call
+    34,  # manatee primary call
+    35,  # mantaee click
+    36,  # mantee chrip
+]
+EMPTY_CALLS = [
+    7,  # no calls
+    15,  # no red grouper sound
+    23,  # no red hind
+    26,  # no goliath grouper calls
+]
 
 
-def create_training_set(sample_dir: Path, annotations_path: Path, outdir: Path, length: float | None, lpf: float | None, signal_level: int | None) -> None:
+def read_annotations(annotations_path: Path, call_variants: list[int] | None = None) -> pd.DataFrame:
+    """Given path to annotation csv file or annotation store directory, return annotations indexed by row.
+
+    Only annotations of `call_variants` are returned if given (only their partitions are read from a store).
+    """
+    import pandas as pd
+
+    if annotations_path.is_dir():
+        return annotation_store.read_annotation_store(annotations_path, call_variants)
+
+    annotations = pd.read_csv(annotations_path)
+    # Ensure call_variant is an int
+    annotations = annotations.astype({'call_variant': int}, errors='raise')
+    if call_variants is not None:
+        annotations = annotations[annotations['call_variant'].isin(call_variants)]
+    return annotations
+
+
+
+def create_training_set(
+    sample_dir: Path,
+    annotations_path: Path,
+    outdir: Path,
+    length: float | None,
+    lpf: float | None,
+    signal_level: int | None,
+    manifest_path: Path | None = None,
+    link_mode: str = 'copy',
+    shard: Shard | None = None,
+    readers: int = 4,
+    queue_size: int = 8
+) -> None:
     """Given an annotation DataFrame, copy annotated files into new directory for model dev.
 
     Parameters
@@ -23,7 +86,7 @@ def create_training_set(sample_dir: Path, annotations_path: Path, outdir: Path,
     sample_dir: Path
         Path to directory with sample files
     annotations: Path
-        Path to annotations file.
+        Path to annotations csv file or annotation store (see `acoustic_tools.annotation_store`).
     outdir: Path
         Path to directory to write sampled data.  Whole files will be copied to f'{outdir}-whole'.
     length: float
@@ -32,6 +95,20 @@ def create_training_set(sample_dir: Path, annotations_path: Path, outdir: Path,
         Frequency at which to low pass filter
     signal_level: int
         If provided, only calls of the given signal level will be used (1: high SNR, 2: medium SNR, 3: low SNR)
+    manifest_path: Path
+        If provided, samples are recorded in a manifest and only new or changed samples are created on reruns.
+        Outputs of samples no longer in the annotations are removed.  Samples are then named from their annotation
+        (see `sample_name`) rather than their row, and duplicate annotations are sampled once.
+    link_mode: str
+        How whole files are written to f'{outdir}-whole', one of `acoustic_tools.files.LINK_MODES`
+    shard: Shard
+        If provided, only samples of annotated files in the shard (i, N) are created (see `acoustic_tools.shard`).
+        Samples of each shard should be recorded in their own manifest, as samples missing from a manifest's
+        annotations are removed.
+    readers: int
+        Number of threads reading clips from source files while clips of others are filtered and written
+    queue_size: int
+        Most source files read ahead of, or waiting to be written after, filtering
 
     Notes
     -----
@@ -47,54 +124,31 @@ def create_training_set(sample_dir: Path, annotations_path: Path, outdir: Path,
     ...
     """
     logging.info(f'Creating sample from {annotations_path}')
-    annotations = pd.read_csv(annotations_path)
-    # Ensure call_variant is an int
-    annotations = annotations.astype({'call_variant': int}, errors='raise')
+    annotations = read_annotations(annotations_path, CALL_VARIANTS + EMPTY_CALLS)
+    if signal_level is not None:
+        logging.info(f'Including only samples of level: {signal_level}')
+        # Empty calls have no signal level to filter on
+        annotations = annotations[annotations['call_variant'].isin(EMPTY_CALLS) | (annotations['signal_level'] == signal_level)]
+    if shard is not None:
+        # Annotations of a file are in the same shard, so each source file is read by one shard
+        n_annotations = len(annotations)
+        annotations = select_rows(annotations, shard, 'file')
+        logging.info(f'Creating shard {shard[0]}/{shard[1]}, {len(annotations)} of {n_annotations} annotations')
 
     outdir.mkdir(exist_ok=True)
     whole_outdir = Path(f'{outdir}-whole')
     whole_outdir.mkdir(exist_ok=True)
 
-    CALL_VARIANTS = [
-        1,  # grouper 1
-        2,  # grouper 2
-        3,  # grouper grunt
-        4,  # grouper spawning rush
-        5,  # grouper chorus < 50% of file
-        6,  # grouper chrous > 50% of file
-        8,  # unidentified sound type
-        9,  # red grouper 1
-        10,  # red grouper 2
-        17,  # red hind 1
-        18,  # red hind 2
-        19,  # red hind 3
-        25,  # goliath grouper 1
-        27,  # multi-phase goliath grouper
-        28,  # sea trout chorus
-        29,  # silver perch call
-        30,  # snowy grouper primary call
-        33,  # gag grouper primary call
-        34,  # manatee primary call
-        35,  # mantaee click
-        36,  # mantee chrip
-    ]
-    EMPTY_CALLS = [
-        7,  # no calls
-        15,  # no red grouper sound
-        23,  # no red hind
-        26,  # no goliath grouper calls
-    ]
-    CALL_OVERLAP = [True, False]
-    CALL_CUTOFF = [True, False]
-    for params in itertools.product(CALL_VARIANTS, CALL_OVERLAP, CALL_CUTOFF):
-        call_variant = params[0]
-        call_overlap = params[1]
-        call_cutoff = params[2]
-        signal_level = params[3]
-
+    # Collect every sample to create first so each source file is only opened once below
+    jobs = []
+    for (call_variant, call_overlap, call_cutoff), samples in annotations.groupby(annotation_store.GROUP_COLUMNS, observed=True):
         logging.info(f'Sampling {call_variant}:, call overlap: {call_overlap}, call cutoff: {call_cutoff}')
+        # All empty calls go into a single dir for training
+        if call_variant in EMPTY_CALLS:
+            variant_outdir = outdir / 'call-0'
+            variant_whole_outdir = whole_outdir / 'call-0'
         # If the call is cutoff and overlapping
-        if call_overlap and call_cutoff:
+        elif call_overlap and call_cutoff:
             variant_outdir = outdir / f'call-{call_variant}' / 'call-cutoff-and-overlap'
             variant_whole_outdir = whole_outdir / f'call-{call_variant}' / 'call-cutoff-and-overlap'
         # Calls are only overlapping
@@ -112,79 +166,212 @@ def create_training_set(sample_dir: Path, annotations_path: Path, outdir: Path,
         variant_outdir.mkdir(exist_ok=True, parents=True)
         variant_whole_outdir.mkdir(exist_ok=True, parents=True)
 
-        samples = annotations.query(
-            f'call_variant=={call_variant} and '
-            f'call_overlap=={call_overlap} and '
-            f'call_cutoff=={call_cutoff}'
-        )
-        if signal_level is not None:
-            logging.info(f'Including only samples of level: {signal_level}')
-            samples = samples.query(f'signal_level=={signal_level}')
+        # Samples recorded in a manifest are named from their annotation, so their records are found on reruns
+        jobs.extend(_sample_jobs(samples, sample_dir, variant_outdir, variant_whole_outdir, manifest_path is not None))
 
-        for ix, row in samples.iterrows():
-            try:
-                fname = row.file
-            except KeyError:
-                logging.warning(f'Sample fname {row.file} not available')
+    run = instrument.current()
+    if manifest_path is None:
+        run.total = len(jobs)
+        write_samples(jobs, length, lpf, link_mode=link_mode, readers=readers, queue_size=queue_size)
+        return
+
+    manifest = Manifest(manifest_path)
+    try:
+        pending = manifest.pending(jobs, length, lpf)
+        run.total = len(pending)
+        write_samples(pending, length, lpf, manifest, link_mode, readers, queue_size)
+    finally:
+        manifest.close()
+
+
+def source_path(fname: str, sample_dir: Path) -> Path:
+    """Given name of an annotated file, return its path in `sample_dir`."""
+    name, datestr = fname.split('.')[0].split('_')
+    filedate = datetime.datetime.strptime(datestr, '%Y-%m-%dT%H%M%S')
+    fname = f'{name}_{filedate:%Y-%m-%dT%H-%M-%S}.wav'
+    # <sample-dir>/<name>/yyyy/mm/dd/<name>_yyyy-mm-ddTHHMMSS.wav
+    name_dir = sample_dir
+    if name == 'exxon':
+        name_dir = 'exxon-template-tower'
+
+    return Path(f'{name_dir}/{name}/{filedate.year}/{filedate.month:02}/{filedate.day:02}/{fname}')
+
+
+def sample_name(infile: Path, start_time: float, call_length: float) -> str:
+    """Given the source file and times (s) of an annotated call, return the name of its sample.
+
+    Names only depend on the annotation, not on its position in the annotations, so samples keep their names (and
+    manifest records) when other annotations are added or removed, e.g. 'sample-<source>-00012345-001500' for a
+    1.5 s call 12.345 s into the source.
+    """
+    return f'sample-{Path(infile).stem}-{round(start_time * 1000):08}-{round(call_length * 1000):06}'
+
+
+def _sample_jobs(
+    samples: pd.DataFrame,
+    sample_dir: Path,
+    outdir: Path,
+    whole_outdir: Path,
+    annotation_names: bool = False
+) -> list[dict]:
+    """Given annotations for a single output directory, return the samples to create from them.
+
+    Samples are named by their row in the annotations (sample-NNNN), or from their annotation if
+    `annotation_names` (see `sample_name`), in which case calls annotated more than once (same file and times) are
+    sampled once.
+    """
+    # Many calls are annotated in each file
+    infiles = {fname: source_path(fname, sample_dir) for fname in samples['file'].unique()}
+
+    jobs = {}
+    for ix, fname, start_time, call_length in zip(samples.index, samples['file'], samples['start_time'], samples['call_length']):
+        name = sample_name(infiles[fname], start_time, call_length) if annotation_names else f'sample-{ix:04}'
+        if name in jobs:
+            logging.warning(f'Annotation {ix} is a duplicate of another annotation of {fname}, sampling it once as {name}')
+            continue
+        jobs[name] = {
+            'infile': infiles[fname],
+            'fpath_out': outdir / name,
+            'whole_outfile': whole_outdir / name,
+            'time_start': start_time,
+            'time_end': start_time + call_length,
+        }
+
+    return list(jobs.values())
+
+
+def write_samples(
+    jobs: list[dict],
+    length: float | None,
+    lpf: float | None,
+    manifest: Manifest | None = None,
+    link_mode: str = 'copy',
+    readers: int = 4,
+    queue_size: int = 8
+) -> None:
+    """Given samples to create, create the clips and copy the whole files, opening each source file once.
+
+    Clips of source files are read in `readers` threads, and clips and whole files of source files are written in a
+    writer thread, while clips of other source files are filtered, with at most `queue_size` source files waiting
+    between stages (see `acoustic_tools.stream`).
+
+    Whole files are written with `link_mode` (see `acoustic_tools.files.link_file`).  If a source can't be linked
+    to, it is only copied once and its other whole file outputs are hard links to that copy where possible.  With
+    'copy', every whole file output is its own copy.
+    Samples whose clips and whole file were written are recorded in `manifest` if given.  Stages, bytes and
+    failures are recorded to the current `acoustic_tools.instrument`, which counts each sample as a file.
+    """
+    run = instrument.current()
+    jobs_by_file = {}
+    for job in jobs:
+        jobs_by_file.setdefault(job['infile'], []).append(job)
+
+    def read(item):
+        infile, file_jobs = item
+        logging.info(f'Creating {len(file_jobs)} samples from {infile}')
+        try:
+            return sample.read_clips(infile, file_jobs)
+        except Exception as e:
+            logging.warning(f'Problem creating samples from {infile}: {type(e).__name__}: {e}')
+            # Whole files are still written
+            return [f'{type(e).__name__}: {e}'] * len(file_jobs), None, None
+
+    def compute(item, clips):
+        _, file_jobs = item
+        clips, sr, subtype = clips
+        samples = []
+        for job, clip in zip(file_jobs, clips):
+            if isinstance(clip, str):
+                samples.append(clip)
                 continue
-            name, datestr = fname.split('.')[0].split('_')
-            filedate = datetime.datetime.strptime(datestr, '%Y-%m-%dT%H%M%S')
-            fname = f'{name}_{filedate:%Y-%m-%dT%H-%M-%S}.wav'
-            # <sample-dir>/<name>/yyyy/mm/dd/<name>_yyyy-mm-ddTHHMMSS.wav
-            if name == 'exxon':
-                sample_dir = 'exxon-template-tower'
-
-            infile = Path(f'{sample_dir}/{name}/{filedate.year}/{filedate.month:02}/{filedate.day:02}/{fname}')
-            outfile = variant_outdir / f'sample-{ix:04}'
-            whole_outfile = variant_whole_outdir / f'sample-{ix:04}'
-            end_time = row.start_time + row.call_length
-
-            logging.info(f'Creating sample {outfile}')
             try:
-                sample.create_sample(infile, outfile, row.start_time, end_time, length, lpf)
-            except:
-                logging.warning(f'Problem creating samples from {infile}')
-            try:
-                shutil.copy(infile, whole_outfile)
-            except:
-                logging.warning(f'Problem copying whole sample {infile}')
+                if lpf and len(clip):
+                    with run.stage('filter'):
+                        clip = sample.low_pass_filter(clip, lpf, sr)
+                samples.append(sample.sample_outputs(job['fpath_out'], clip, sr, length))
+            except Exception as e:
+                samples.append(f'{type(e).__name__}: {e}')
+        return samples, sr, subtype
 
-    for empty_call in EMPTY_CALLS:
-        logging.info(f'Sampling empty call {empty_call}')
-        # All empty calls go into a single dir for training
-        call_outdir = outdir / 'call-0'
-        call_outdir.mkdir(exist_ok=True, parents=True)
-        call_whole_outdir = whole_outdir / 'call-0'
-        call_whole_outdir.mkdir(exist_ok=True, parents=True)
-
-        samples = annotations.query(
-            f'call_variant=={empty_call}'
-        )
-        for ix, row in samples.iterrows():
+    def write(item, samples):
+        infile, file_jobs = item
+        samples, sr, subtype = samples
+        results = []
+        whole_copy = None
+        for job, outputs in zip(file_jobs, samples):
+            if not isinstance(outputs, str):
+                try:
+                    with run.stage('write'):
+                        for fpath_out, clip in outputs:
+                            sample.write_wav(fpath_out, clip, sr, subtype)
+                    run.add_bytes(written=sum(clip.nbytes for _, clip in outputs))
+                    outputs = [fpath_out for fpath_out, _ in outputs]
+                except Exception as e:
+                    outputs = f'{type(e).__name__}: {e}'
             try:
-                fname = row.file
-            except KeyError:
-                logging.warning(f'Sample fname {row.file} not available')
+                with run.stage('copy'):
+                    if whole_copy is not None:
+                        files.link_file(whole_copy, job['whole_outfile'], 'hardlink', copy_function=shutil.copy)
+                    elif files.link_file(infile, job['whole_outfile'], link_mode, copy_function=shutil.copy) == 'copy':
+                        run.add_bytes(read=instrument.file_size(infile), written=instrument.file_size(job['whole_outfile']))
+                        # Copies made because a link wasn't possible are linked to, copies asked for are independent
+                        if link_mode != 'copy':
+                            whole_copy = job['whole_outfile']
+            except Exception as e:
+                results.append((outputs, f'{type(e).__name__}: {e}'))
                 continue
-            name, datestr = fname.split('.')[0].split('_')
-            filedate = datetime.datetime.strptime(datestr, '%Y-%m-%dT%H%M%S')
-            fname = f'{name}_{filedate:%Y-%m-%dT%H-%M-%S}.wav'
-            # <sample-dir>/<name>/yyyy/mm/dd/<name>_yyyy-mm-ddTHHMMSS.wav
-            infile = Path(f'{sample_dir}/{name}/{filedate.year}/{filedate.month:02}/{filedate.day:02}/{fname}')
-            outfile = call_outdir / f'sample-{ix:04}'
-            whole_outfile = call_whole_outdir / f'sample-{ix:04}'
-            end_time = row.start_time + row.call_length
+            results.append((outputs, None))
+        return results
 
-            logging.info(f'Creating sample {outfile} from {infile}')
+    # The manifest's connection is only used from this thread
+    for (infile, file_jobs), results, error in stream.stream(jobs_by_file.items(), read, compute, write, readers, queue_size):
+        if error is not None:
+            logging.warning(f'Problem creating samples from {infile}: {error}')
+            results = [(error, None)] * len(file_jobs)
+
+        for job, (outputs, copy_error) in zip(file_jobs, results):
+            if isinstance(outputs, str):
+                logging.debug(f'Unable to create sample {job["fpath_out"]}: {outputs}')
+                run.fail(outputs)
+                logging.warning(f'Problem creating sample {job["fpath_out"]} from {infile}')
+            if copy_error is not None:
+                logging.warning(f'Problem copying whole sample {infile}: {copy_error}')
+                run.fail(copy_error)
+                continue
+            if manifest is not None and not isinstance(outputs, str):
+                manifest.record(job, length, lpf, outputs + [job['whole_outfile']])
+
+        if manifest is not None:
+            with run.stage('manifest'):
+                manifest.commit()
+        run.done(len(file_jobs))
+
+
+def positive_int(value: str) -> int:
+    """Given an option value, return it as an integer of at least 1, as `click.IntRange(min=1)` parses it."""
+    import argparse
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value!r} is not a valid integer') from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not in the range x>=1')
+    return number
+
+
+def positive_float(value: str) -> float:
+    """Given an option value, return it as a number greater than 0."""
+    import argparse
+
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value!r} is not a valid number') from None
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f'{value} is not greater than 0')
+    return number
 
-            try:
-                sample.create_sample(infile, outfile, row.start_time, end_time, length, lpf)
-            except:
-                logging.warning(f'Problem creating samples from {infile}')
-            try:
-                shutil.copy(infile, whole_outfile)
-            except:
-                logging.warning(f'Problem copying whole sample {infile}')
 
 def main():
     import argparse
@@ -197,7 +384,7 @@ def main():
     parser.add_argument(
         'annotations',
         type=Path,
-        help='Path to annotation csv file.'
+        help='Path to annotation csv file or annotation store directory.'
     )
     parser.add_argument(
         'output_dir',
@@ -206,7 +393,7 @@ def main():
     )
     parser.add_argument(
         '--length',
-        type=float,
+        type=positive_float,
         help='Length of sample',
         default=None
     )
@@ -222,12 +409,64 @@ def main():
         help='SNR level to optionally filter for.  (1: High, 2: Medium, 3: Low)',
         default=None
     )
+    parser.add_argument(
+        '--manifest',
+        type=Path,
+        help='Path to manifest (SQLite) of created samples.  If provided, only new or changed samples are created.',
+        default=None
+    )
+
+    parser.add_argument(
+        '--link-mode',
+        choices=files.LINK_MODES,
+        help='How whole files are written.  Links fall back to copies if they are not supported (e.g. across filesystems).',
+        default='copy'
+    )
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        help='Only create samples of shard i of N (e.g. 0/4) of the annotated files.  Give each shard its own --manifest.',
+        default=None
+    )
+    parser.add_argument(
+        '--readers',
+        type=positive_int,
+        help='Number of threads reading clips from source files while clips of others are filtered and written',
+        default=4
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=positive_int,
+        help='Most source files read ahead of, or waiting to be written after, filtering their clips',
+        default=8
+    )
+    parser.add_argument(
+        '--report',
+        type=Path,
+        help='Path to save a JSON report of the time spent in each stage to',
+        default=None
+    )
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        help='Seconds between progress lines',
+        default=60.0
+    )
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        help='Path to save cProfile stats to',
+        default=None
+    )
 
     args = parser.parse_args()
     logging.info(f'Reading annotations from {args.annotations}')
     logging.info(f'Creating samples in {args.output_dir} from files in {args.sample_dir}')
 
-    create_training_set(args.sample_dir, args.annotations, args.output_dir, args.length, args.lpf, args.snr_level)
+    run = instrument.start('create-training-set', progress_interval=args.progress_interval)
+    with instrument.profile(args.profile):
+        create_training_set(args.sample_dir, args.annotations, args.output_dir, args.length, args.lpf, args.snr_level, args.manifest, args.link_mode, args.shard, args.readers, args.queue_size)
+    run.log_report(args.report)
 
 
 if __name__ == '__main__':
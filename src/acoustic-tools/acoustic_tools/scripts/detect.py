@@ -0,0 +1,195 @@
+#!python
+"""Detect fish calls in long recordings with a trained model, writing Raven selection tables of call probabilities."""
+import dataclasses
+import logging
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+# fastai and librosa take seconds to import, so are imported by the functions using them
+import click
+import numpy as np
+import soundfile
+
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, audio_to_spec, save_spec
+from acoustic_tools.shard import Shard, parse_shard_option, select
+
+logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+
+def stream_windows(
+    fpath: Path,
+    window: float,
+    hop: float,
+    windows_per_block: int = 32
+) -> Iterator[Tuple[np.ndarray, np.ndarray, int]]:
+    """Given path to audio file, yield blocks of overlapping windows of audio.
+
+    Only `windows_per_block` windows are read at a time, so memory use does not depend on the length of the file.
+    Windows that would extend past the end of the file are not returned, so files shorter than `window` yield
+    nothing.  Raises ValueError if `window` or `hop` is shorter than a sample.
+
+    Yields
+    ------
+    start_times: np.ndarray
+        Start time (s) of each window in the block
+    windows: np.ndarray
+        (n_windows, window samples) array of mono audio, windows start `hop` seconds apart
+    sr: int
+        Sample rate of the audio
+    """
+    with soundfile.SoundFile(fpath) as f:
+        sr = f.samplerate
+        window_frames = int(window * sr)
+        hop_frames = int(hop * sr)
+        if window_frames < 1 or hop_frames < 1:
+            raise ValueError(f'Window ({window} s) and hop ({hop} s) must be at least a sample (1/{sr} s) long')
+        start = 0
+        while start + window_frames <= f.frames:
+            n_windows = min(windows_per_block, (f.frames - window_frames - start) // hop_frames + 1)
+            f.seek(start)
+            # Mix down to mono as librosa.load does
+            block = f.read(window_frames + (n_windows - 1) * hop_frames, dtype='float32', always_2d=True).mean(axis=1)
+            windows = np.lib.stride_tricks.sliding_window_view(block, window_frames)[::hop_frames]
+            yield (start + np.arange(n_windows) * hop_frames) / sr, windows, sr
+            start += n_windows * hop_frames
+
+
+def window_images(windows: np.ndarray, sr: int, fft_config: FFTConfig) -> List[np.ndarray]:
+    """Given windows of audio, return spectrogram images preprocessed as in `create_spectrograms.plot_spec`."""
+    # Decimated spectrograms are calculated from audio at its own rate
+    if sr != fft_config.sr and not fft_config.decimate:
+        import librosa
+
+        windows = librosa.resample(windows, orig_sr=sr, target_sr=fft_config.sr, axis=-1)
+        sr = fft_config.sr
+    specs = audio_to_spec(windows, sr, fft_config)
+    return [save_spec(spec, None, fft_config) for spec in specs]
+
+
+def detect(
+    learner,
+    fpath: Path,
+    output: Path,
+    fft_config: FFTConfig,
+    window: float,
+    hop: float,
+    batch_size: int = 32
+) -> int:
+    """Given a fastai learner and path to audio file, write probability of each call variant in each window to output.
+
+    Output is a tab separated Raven selection table with a selection per window, the most likely call variant in
+    `call variant` and the probability of each call variant in `prob <call variant>` columns.
+
+    Returns
+    -------
+    n_windows: int
+        Number of windows in selection table
+    """
+    import fastai.vision.all as fai_vision
+
+    # Images are rendered from arrays, matching images drawn by matplotlib (see benchmarks/render_parity.py)
+    fft_config = dataclasses.replace(fft_config, renderer='fast')
+    vocab = [str(label) for label in learner.dls.vocab]
+    low_freq, high_freq = fft_config.ylim or (0, fft_config.sr / 2)
+    columns = [
+        'Selection',
+        'View',
+        'Channel',
+        'Begin Time (s)',
+        'End Time (s)',
+        'Low Freq (Hz)',
+        'High Freq (Hz)',
+        'Begin File',
+        'File Offset (s)',
+        'call variant',
+    ] + [f'prob {label}' for label in vocab]
+
+    n_windows = 0
+    with open(output, 'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for start_times, windows, sr in stream_windows(fpath, window, hop, batch_size):
+            images = window_images(windows, sr, fft_config)
+            dl = learner.dls.test_dl([fai_vision.PILImage.create(image) for image in images], bs=batch_size)
+            probs, _ = learner.get_preds(dl=dl)
+            probs = probs.numpy()
+
+            for begin, window_probs in zip(start_times, probs):
+                row = [
+                    n_windows + 1,
+                    'Spectrogram 1',
+                    1,
+                    f'{begin:.4f}',
+                    f'{begin + window:.4f}',
+                    low_freq,
+                    high_freq,
+                    fpath.name,
+                    f'{begin:.4f}',
+                    vocab[int(window_probs.argmax())],
+                ] + [f'{prob:.4f}' for prob in window_probs]
+                f.write('\t'.join(str(value) for value in row) + '\n')
+                n_windows += 1
+
+    return n_windows
+
+
+@click.command()
+@click.argument('path_to_model', type=click.Path(exists=True))
+@click.argument('path_to_wavs', type=click.Path(exists=True))
+@click.argument('path_to_output', type=click.Path())
+@click.option('--window', type=click.FloatRange(min=0, min_open=True), default=10.0, show_default=True, help='Length (s) of windows to classify')
+@click.option('--hop', type=click.FloatRange(min=0, min_open=True), default=5.0, show_default=True, help='Time (s) between the start of windows')
+@click.option('--batch-size', type=int, default=32, show_default=True, help='Number of windows read and classified at a time')
+@click.option('--decimate', is_flag=True, help='Decimate audio before the STFT, as `create-spectrograms --decimate`')
+@click.option(
+    '--shard',
+    type=str,
+    default=None,
+    callback=parse_shard_option,
+    help='Only detect calls in shard i of N (e.g. 0/4) of the wav files (see acoustic_tools.shard)'
+)
+def main(
+    path_to_model: Path,
+    path_to_wavs: Path,
+    path_to_output: Path,
+    window: float,
+    hop: float,
+    batch_size: int,
+    decimate: bool,
+    shard: Union[Shard, None]
+) -> None:
+    """Given a model and a wav file or directory of wav files, save a selection table of detections for each file
+
+    Selection tables are saved at the path of their file relative to the directory, so files of the same name in
+    different directories each keep their table.
+    """
+    import fastai.vision.all as fai_vision
+
+    path_to_wavs = Path(path_to_wavs)
+    base_out = Path(path_to_output)
+    base_out.mkdir(exist_ok=True, parents=True)
+
+    logging.info(f'Loading model {path_to_model}')
+    learner = fai_vision.load_learner(path_to_model, cpu=True)
+    fft_config = FFTConfig(decimate=decimate)
+
+    wavs = [path_to_wavs] if path_to_wavs.is_file() else sorted(path_to_wavs.glob('**/*.wav'))
+    if shard is not None:
+        wavs = select(wavs, shard, key=lambda wav: wav.relative_to(path_to_wavs).as_posix())
+        logging.info(f'Detecting calls in shard {shard[0]}/{shard[1]}, {len(wavs)} files')
+    for wav in wavs:
+        relative = Path(wav.name) if wav == path_to_wavs else wav.relative_to(path_to_wavs)
+        output = base_out / relative.parent / f'{wav.stem}.selections.txt'
+        output.parent.mkdir(exist_ok=True, parents=True)
+        logging.info(f'Detecting calls in {wav}')
+        try:
+            n_windows = detect(learner, wav, output, fft_config, window, hop, batch_size)
+        except Exception as e:
+            logging.error(f'Failed to detect calls in {wav}: {type(e).__name__}: {e}')
+            continue
+        if n_windows == 0:
+            logging.warning(f'{wav} is shorter than a window ({window} s)')
+        logging.info(f'Saved {n_windows} windows to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!python
+"""Export a trained fastai learner as a TorchScript (or ONNX) model for CPU inference (see `acoustic_tools.export`)."""
+import logging
+from pathlib import Path
+from typing import Tuple, Union
+
+import click
+
+logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+QUANTIZE = ('none', 'dynamic', 'static')
+
+FORMATS = ('torchscript', 'onnx')
+
+
+@click.command()
+@click.argument('path_to_model', type=click.Path(exists=True))
+@click.argument('output', type=click.Path())
+@click.option('--quantize', type=click.Choice(QUANTIZE), default='static', show_default=True, help='Quantize the whole body (static, needs --calibration-csv) or only weights of linear layers (dynamic) to int8')
+@click.option('--format', 'output_format', type=click.Choice(FORMATS), default='torchscript', show_default=True, help='Format to save the model in')
+@click.option('--calibration-csv', type=click.Path(exists=True), default=None, help='Csv of images (fname, label) to calibrate static quantization and trace with')
+@click.option('--calibration-size', type=int, default=100, show_default=True, help='Number of images to calibrate with')
+@click.option('--replace-prefix', type=(str, str), default=None, help='Replace the first prefix of image paths in the csv with the second')
+@click.option('--backend', type=click.Choice(['x86', 'fbgemm', 'qnnpack']), default='x86', show_default=True, help='Quantized engine of the CPUs the model will run on (qnnpack for ARM)')
+def main(
+    path_to_model: str,
+    output: str,
+    quantize: str,
+    output_format: str,
+    calibration_csv: Union[str, None],
+    calibration_size: int,
+    replace_prefix: Union[Tuple[str, str], None],
+    backend: str
+) -> None:
+    """Given a fastai learner, export it for CPU inference without fastai"""
+    if quantize == 'static' and calibration_csv is None:
+        raise click.UsageError('--calibration-csv is required to quantize with --quantize static (the default)')
+    if quantize != 'none' and output_format == 'onnx':
+        raise click.UsageError('Quantized models can only be exported as torchscript, export ONNX with --quantize none')
+
+    # torch and fastai take seconds to import, so they aren't imported to show help or usage errors
+    import fastai.vision.all as fai_vision
+    import numpy as np
+    import torch
+
+    from acoustic_tools import export
+
+    logging.info(f'Loading model {path_to_model}')
+    learner = fai_vision.load_learner(path_to_model, cpu=True)
+    labels = [str(label) for label in learner.dls.vocab]
+    classifier = export.image_classifier(learner)
+
+    if calibration_csv is not None:
+        df = export.read_labeled_images(Path(calibration_csv), replace_prefix)
+        if df.empty:
+            raise click.UsageError(f'None of the images in {calibration_csv} exist, see --replace-prefix')
+        calibration_images = export.read_images(df['fname'].sample(min(calibration_size, len(df)), random_state=0))
+        example = torch.from_numpy(np.stack(calibration_images[:1]))
+    else:
+        from acoustic_tools.render import MATPLOTLIB_SIZE
+        width, height = MATPLOTLIB_SIZE
+        example = torch.zeros((1, height, width, 3), dtype=torch.uint8)
+
+    if quantize == 'dynamic':
+        classifier = export.quantize_dynamic(classifier)
+    elif quantize == 'static':
+        logging.info(f'Calibrating with {len(calibration_images)} images')
+        classifier = export.quantize_static(classifier, calibration_images, backend=backend)
+
+    output = Path(output)
+    output.parent.mkdir(exist_ok=True, parents=True)
+    if output_format == 'onnx':
+        export.export_onnx(classifier, example, output, labels)
+    else:
+        export.export_torchscript(classifier, example, output, labels)
+    logging.info(f'Saved {quantize} quantized model to {output}')
+
+
+if __name__ == '__main__':
+    main()
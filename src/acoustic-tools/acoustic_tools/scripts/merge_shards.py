@@ -0,0 +1,122 @@
+#!python
+"""Combine the outputs of a run sharded between nodes with `--shard i/N` (see `acoustic_tools.shard`).
+
+Reports (`--report`) of the shards are combined into the report of the run, manifests of `create_training_set.py`
+(`--manifest`) into one manifest, and feature stores of `create_spectrograms.py --output-format npy` into one
+store.  Outputs written per file (spectrogram PNGs, samples, selection tables, copies) need no merging when shards
+write to the same output directory.
+"""
+from __future__ import annotations
+import json
+import logging
+from pathlib import Path
+
+from acoustic_tools import files, instrument
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s: %(message)s', level=logging.INFO)
+
+
+def merge_reports(paths: list[Path], output: Path) -> dict:
+    """Given paths to JSON reports of shards, save their combined report (see `instrument.merge_reports`) to output."""
+    report = instrument.merge_reports([json.loads(Path(path).read_text()) for path in paths])
+    Path(output).write_text(json.dumps(report, indent=2) + '\n')
+    logging.info(
+        f'Merged {len(paths)} reports to {output}: {report["files"]} files ({report["files_per_second"]:.1f} files/s), '
+        f'{report["failed"]} failed {report["failures_by_type"]}'
+    )
+    return report
+
+
+def merge_manifests(paths: list[Path], output: Path) -> int:
+    """Given paths to manifests of shards, add their samples to the manifest at output, returning how many."""
+    from acoustic_tools.manifest import Manifest
+
+    manifest = Manifest(output)
+    try:
+        n_samples = sum(manifest.merge(path) for path in paths)
+    finally:
+        manifest.close()
+    logging.info(f'Merged {n_samples} samples from {len(paths)} manifests to {output}')
+    return n_samples
+
+
+def merge_feature_stores(paths: list[Path], output: Path, link_mode: str = 'hardlink') -> int:
+    """Given paths to feature stores of shards, combine them into a store at output, returning its size."""
+    from acoustic_tools import feature_store
+
+    index = feature_store.merge_stores(paths, output, link_mode)
+    logging.info(f'Merged {len(index)} spectrograms from {len(paths)} feature stores to {output}')
+    return len(index)
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--reports',
+        type=Path,
+        nargs='+',
+        help='Paths to JSON reports (--report) of each shard',
+        default=[]
+    )
+    parser.add_argument(
+        '--report-output',
+        type=Path,
+        help='Path to save the combined report to',
+        default=None
+    )
+    parser.add_argument(
+        '--manifests',
+        type=Path,
+        nargs='+',
+        help='Paths to manifests (create_training_set.py --manifest) of each shard',
+        default=[]
+    )
+    parser.add_argument(
+        '--manifest-output',
+        type=Path,
+        help='Path to the manifest to add the samples of every shard to',
+        default=None
+    )
+    parser.add_argument(
+        '--feature-stores',
+        type=Path,
+        nargs='+',
+        help='Paths to feature stores (create_spectrograms.py --output-format npy) of each shard',
+        default=[]
+    )
+    parser.add_argument(
+        '--feature-store-output',
+        type=Path,
+        help='Path to directory to combine the feature stores in',
+        default=None
+    )
+    parser.add_argument(
+        '--link-mode',
+        choices=files.LINK_MODES,
+        help='How shards of feature stores are written to the combined store',
+        default='hardlink'
+    )
+
+    args = parser.parse_args()
+    merges = [
+        (args.reports, args.report_output, '--report-output'),
+        (args.manifests, args.manifest_output, '--manifest-output'),
+        (args.feature_stores, args.feature_store_output, '--feature-store-output'),
+    ]
+    for inputs, output, option in merges:
+        if inputs and output is None:
+            parser.error(f'{option} is required to merge {len(inputs)} inputs')
+    if not any(inputs for inputs, _, _ in merges):
+        parser.error('Nothing to merge, give --reports, --manifests or --feature-stores')
+
+    if args.reports:
+        merge_reports(args.reports, args.report_output)
+    if args.manifests:
+        merge_manifests(args.manifests, args.manifest_output)
+    if args.feature_stores:
+        merge_feature_stores(args.feature_stores, args.feature_store_output, args.link_mode)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,78 +6,83 @@ import logging
 import shutil
 from pathlib import Path
 
+from acoustic_tools import files, instrument
+from acoustic_tools.shard import Shard, parse_shard, select
+from acoustic_tools.timestamps import parse_timestamp, parse_timestamps
+
 logging.basicConfig(format='%(asctime)s - %(levelname)s: %(message)s')
 
 
 def get_file_timestamp(fname: Path) -> datetime.datetime | None:
-    """Given path to old file name, return the timestap as a datetime"""
-    # Old style names
-    # 0059.DSG_RAWD_HMS__7__0__0__DMY_27__1_16.wav
-    # rileys-hump 2009 names
-    # 3035.DSG_HMS_12_50_ 0__DMY_ 4_ 7_ 9.wav
-    # steamboat
-    # DSG_6_RG_3-000.5078.YMD_2009_04_27_HMS_21_30_00.dsg_RAWD_HMS_21_30__0__DMY_27__4__9.wav
-    try:
-        if 'rileys-hump' in str(fname) and '2009' in str(fname):
-            logging.info(f'rileys-hump 2009 file: {fname}')
-            # pull out empty ('') segments, exist because of different number of '_' in filename
-            segments = [seg for seg in fname.name.split('.')[1].split('_') if seg != '']
-            _, _, hour, minute, second, _, day, month, year = segments
-        elif 'steamboat' in str(fname):
-            logging.info(f'steamboat file: {fname}')
-            segments = [seg for seg in fname.name.split('.')[2].split('_') if seg != '']
-            # YMD_2009_04_27_HMS_21_30_00
-            _, year, month, day, _, hour, minute, second = segments
-        else:
-            # pull out empty ('') segments, exist because of different number of '_' in filename
-            segments = [seg for seg in fname.name.split('.')[1].split('_') if seg != '']
-            _, _, _, hour, minute, second, _, day, month, year = segments
-    except ValueError:
-        logging.warn(f'Unable to split {fname}, skipping')
-        return None
-
-    try:
-        if not 'steamboat' in str(fname):
-            dt = datetime.datetime(int(year) + 2000, int(month), int(day), int(hour), int(minute), int(second))
-        else:
-            dt = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
-    except:
-        logging.warn(f'Unable to parse {fname}, skipping')
-        dt = None
-
-    return dt
-
-
-
-def copy_files(sample_dir: Path, output_dir: Path, output_name_prefix: str) -> None:
+    """Given path to old file name, return the timestap as a datetime, see `acoustic_tools.timestamps`"""
+    timestamp = parse_timestamp(fname)
+    if timestamp is None:
+        logging.warning(f'Unable to parse {fname}, skipping')
+    return timestamp
+
+
+def new_paths(fnames: list[Path], output_dir: Path, output_name_prefix: str) -> list[Path]:
+    """Given paths to old files, return their paths in `output_dir`, <yyyy>/<mm>/<dd>/<prefix>_yyyy-mm-ddTHH-MM-SS.wav
+
+    Files without timestamps (probably Toshiba files) keep their names, in <output_name_prefix>/.  Timestamps of all
+    files are parsed together (see `acoustic_tools.timestamps.parse_timestamps`).
+    """
+    timestamps = parse_timestamps(fnames)['timestamp']
+    missing = timestamps.isna()
+    if missing.any():
+        logging.warning(f'Unable to parse timestamps of {missing.sum()} files in {output_dir}, keeping their names')
+    dirs = timestamps.dt.strftime('%Y/%m/%d')
+    names = output_name_prefix + '_' + timestamps.dt.strftime('%Y-%m-%dT%H-%M-%S') + '.wav'
+    return [
+        output_dir / output_name_prefix / fname.name if is_missing else output_dir / dir_ / name
+        for fname, is_missing, dir_, name in zip(fnames, missing, dirs, names)
+    ]
+
+
+def new_path(fname: Path, output_dir: Path, output_name_prefix: str) -> Path:
+    """Given path to old file, return its path in `output_dir`, see `new_paths`."""
+    return new_paths([fname], output_dir, output_name_prefix)[0]
+
+
+def copy_files(
+    sample_dir: Path,
+    output_dir: Path,
+    output_name_prefix: str,
+    link_mode: str = 'copy',
+    shard: Shard | None = None
+) -> None:
     """Given directory with sample files, *COPY* files to new standard to ease data munging.
 
     Notes
     -----
     - Copying the files here to ensure that the new files match the originals.  Old files will be manually deleted.
     - Files saved in yyyy/mm/dd/<name>_yyyy-mm-dd_HH-MM-SS.wav
+    - `link_mode` other than 'copy' links the new files to the originals instead (see `acoustic_tools.files.link_file`),
+      so originals must not be deleted.
+    - Only files in `shard` (by their path in `sample_dir`, see `acoustic_tools.shard`) are copied if given.
+    - Copies, bytes and failures are recorded to the current `acoustic_tools.instrument`.
     """
     original_files = list(sample_dir.glob('**/*.wav'))
     if len(original_files) == 0:
         original_files = list(sample_dir.glob('**/*.WAV'))
+    original_files = select(original_files, shard, key=lambda fname: fname.relative_to(sample_dir).as_posix())
 
-    for file in original_files:
-        timestamp = get_file_timestamp(file)
-
+    run = instrument.current()
+    run.total = len(original_files)
+    for file, new_file in zip(original_files, new_paths(original_files, output_dir, output_name_prefix)):
         try:
-            # Probably Toshiba files
-            if timestamp is None:
-                outdir = output_dir / output_name_prefix
-                outdir.mkdir(exist_ok=True, parents=True)
-                new_file = outdir / file.name
-            else:
-                outdir = output_dir / str(timestamp.year) / f'{timestamp.month:02}' / f'{timestamp.day:02}'
-                outdir.mkdir(exist_ok=True, parents=True)
-                new_file = outdir / f'{output_name_prefix}_{timestamp.strftime("%Y-%m-%dT%H-%M-%S")}.wav'
+            new_file.parent.mkdir(exist_ok=True, parents=True)
             logging.info(f'Copying {file} to {new_file}')
-            shutil.copy2(file, new_file)
-        except:
-            logging.warning(f'Unable to copy {file}')
+            with run.stage('copy'):
+                mode = files.link_file(file, new_file, link_mode, copy_function=shutil.copy2)
+            if mode == 'copy':
+                size = instrument.file_size(new_file)
+                run.add_bytes(read=size, written=size)
+        except Exception as e:
+            logging.warning(f'Unable to copy {file}: {type(e).__name__}: {e}')
+            run.done(errors=[e])
+            continue
+        run.done()
 
 
 def main():
@@ -98,10 +103,44 @@ def main():
         type=str,
         help='Name of output files (e.g. <name>_yyyy-mm-dd_HH-MM-SS.wav)'
     )
+    parser.add_argument(
+        '--link-mode',
+        choices=files.LINK_MODES,
+        help='How new files are written.  Links fall back to copies if they are not supported (e.g. across filesystems).',
+        default='copy'
+    )
+
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        help='Only copy shard i of N (e.g. 0/4) of the files, by their path in sample_dir',
+        default=None
+    )
+    parser.add_argument(
+        '--report',
+        type=Path,
+        help='Path to save a JSON report of the time spent in each stage to',
+        default=None
+    )
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        help='Seconds between progress lines',
+        default=60.0
+    )
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        help='Path to save cProfile stats to',
+        default=None
+    )
 
     args = parser.parse_args()
     args.output_dir.mkdir(exist_ok=True, parents=True)
-    copy_files(args.sample_dir, args.output_dir, args.output_name_prefix)
+    run = instrument.start('rename-training-set-files', progress_interval=args.progress_interval)
+    with instrument.profile(args.profile):
+        copy_files(args.sample_dir, args.output_dir, args.output_name_prefix, args.link_mode, args.shard)
+    run.log_report(args.report)
 
 
 if __name__ == '__main__':
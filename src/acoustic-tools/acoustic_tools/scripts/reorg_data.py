@@ -0,0 +1,272 @@
+#!python
+"""Copy recordings from the directories listed in a config file to <output>/yyyy/mm/dd/<prefix>_yyyy-mm-ddTHH-MM-SS.wav
+
+The config is a csv with a `source` directory (relative to the source root) and the `prefix` of file names of each
+dataset, and optionally the `output` directory (relative to the output root, defaults to `source`), e.g.
+`mote-data.csv`:
+
+    source,prefix
+    exxon-template-tower/exxon-tower,exxon-exxon-tower
+    jupiter,jupiter
+
+Files are named as `rename_training_set_files.py` names them and copied by a pool of threads.  Each copy is written
+to a temporary file, checked against the checksum of the source calculated as it is read, and moved into place.
+Files already copied (same size and checksum) are skipped, so interrupted runs can be restarted.
+"""
+from __future__ import annotations
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from acoustic_tools import instrument
+from acoustic_tools.cache import file_hash
+from acoustic_tools.scripts.rename_training_set_files import new_paths
+from acoustic_tools.shard import Shard, parse_shard, shard_index
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logging.basicConfig(format='%(asctime)s - %(levelname)s: %(message)s')
+# Plans are logged at INFO, without the INFO lines of each file copied by `rename_training_set_files`
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+ACTIONS = ('copy', 'skip', 'conflict')
+
+CHUNK_SIZE = 2**20
+
+
+def read_config(config: Path) -> pd.DataFrame:
+    """Given path to a config csv, return its `source`, `prefix` and `output` of each dataset."""
+    import pandas as pd
+
+    datasets = pd.read_csv(config, dtype=str, comment='#', skipinitialspace=True)
+    missing = {'source', 'prefix'} - set(datasets.columns)
+    if missing:
+        raise ValueError(f'Config {config} is missing columns {sorted(missing)}')
+    if 'output' not in datasets.columns:
+        datasets['output'] = datasets['source']
+    datasets['output'] = datasets['output'].fillna(datasets['source'])
+    return datasets[['source', 'prefix', 'output']]
+
+
+def plan(
+    datasets: pd.DataFrame,
+    source_root: Path,
+    output_root: Path,
+    verify: bool = True,
+    workers: int = 4,
+    shard: Shard | None = None
+) -> pd.DataFrame:
+    """Given datasets from `read_config`, return the `source` and `destination` of every file and its `action`.
+
+    Files whose destination exists are skipped if it is the same size (and has the same checksum if `verify`,
+    compared by `workers` threads).  Files with the same destination as a file before them (e.g. two recordings
+    with the same timestamp) are conflicts and are not copied.  If `shard` is given, only files in the shard (by
+    their path in `source_root`, see `acoustic_tools.shard`) are returned, conflicts are found between all files.
+    """
+    import pandas as pd
+
+    sources = []
+    destinations = []
+    actions = []
+    seen = set()
+    for source, prefix, output in datasets.itertuples(index=False):
+        source_dir = source_root / source
+        wavs = sorted(source_dir.glob('**/*.wav')) or sorted(source_dir.glob('**/*.WAV'))
+        if not wavs:
+            logger.warning(f'No wav files in {source_dir}')
+            continue
+        logger.info(f'Planning {len(wavs)} files from {source_dir} to {output_root / output}')
+
+        for wav, destination in zip(wavs, new_paths(wavs, output_root / output, prefix)):
+            sources.append(wav)
+            destinations.append(destination)
+            actions.append('conflict' if destination in seen else None)
+            seen.add(destination)
+
+    if shard is not None:
+        index, count = shard
+        keep = [ix for ix, source in enumerate(sources) if shard_index(source.relative_to(source_root).as_posix(), count) == index]
+        sources, destinations, actions = ([values[ix] for ix in keep] for values in (sources, destinations, actions))
+
+    checks = [ix for ix, action in enumerate(actions) if action is None]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        copied = executor.map(
+            _is_copy, [sources[ix] for ix in checks], [destinations[ix] for ix in checks], itertools.repeat(verify)
+        )
+        for ix, is_copy in zip(checks, copied):
+            actions[ix] = 'skip' if is_copy else 'copy'
+
+    return pd.DataFrame({'source': sources, 'destination': destinations, 'action': actions})
+
+
+def _is_copy(source: Path, destination: Path, verify: bool) -> bool:
+    """Given paths, return whether the destination is a copy of the source."""
+    try:
+        if destination.stat().st_size != source.stat().st_size:
+            return False
+    except FileNotFoundError:
+        return False
+    if not verify:
+        return True
+    with instrument.stage('hash'):
+        same = file_hash(source) == file_hash(destination)
+    instrument.add_bytes(read=2 * source.stat().st_size)
+    return same
+
+
+def copy_verified(source: Path, destination: Path) -> None:
+    """Given paths, copy the source to the destination, checking the copy against the source's checksum.
+
+    The source is hashed as it is copied to a temporary file next to the destination.  The temporary file is read
+    back, and moved to the destination only if its checksum matches, so the destination is never a partial copy.
+    """
+    destination.parent.mkdir(exist_ok=True, parents=True)
+    tmp = destination.with_name(f'.{destination.name}.tmp')
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        with instrument.stage('copy'):
+            with open(source, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+                for chunk in iter(lambda: fsrc.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    fdst.write(chunk)
+            shutil.copystat(source, tmp)
+        size = tmp.stat().st_size
+        instrument.add_bytes(read=size, written=size)
+
+        with instrument.stage('verify'):
+            copy_digest = file_hash(tmp, CHUNK_SIZE)
+        instrument.add_bytes(read=size)
+        if copy_digest != digest.hexdigest():
+            raise OSError(f'Checksum of copy of {source} does not match')
+        os.replace(tmp, destination)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _copy_or_error(source: Path, destination: Path) -> str | None:
+    try:
+        copy_verified(source, destination)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return None
+
+
+def reorg(jobs: pd.DataFrame, workers: int = 4) -> dict:
+    """Given a plan from `plan`, copy files marked 'copy' with `workers` threads and return errors by source."""
+    run = instrument.current()
+    copies = jobs[jobs['action'] == 'copy']
+    run.total = len(copies)
+    logger.info(f'Files to copy, skip or not copy due to conflicts: {_counts(jobs)}')
+    for source, destination in jobs.loc[jobs['action'] == 'conflict', ['source', 'destination']].itertuples(index=False):
+        logger.warning(f'Not copying {source}, another file is copied to {destination}')
+
+    errors = {}
+    # Copies wait on I/O, so threads copy files concurrently.  Bounded by `workers` to avoid saturating shares.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_copy_or_error, copies['source'], copies['destination'])
+        for source, destination, error in zip(copies['source'], copies['destination'], results):
+            if error is not None:
+                logger.warning(f'Unable to copy {source} to {destination}: {error}')
+                errors[source] = error
+            else:
+                logger.debug(f'Copied {source} to {destination}')
+            run.done(errors=[error])
+
+    return errors
+
+
+def _counts(jobs: pd.DataFrame) -> dict:
+    return jobs['action'].value_counts().reindex(ACTIONS, fill_value=0).to_dict()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'config',
+        type=Path,
+        help='Path to csv of source directories and their file name prefixes'
+    )
+    parser.add_argument(
+        'source_root',
+        type=Path,
+        help='Path to directory sources are in'
+    )
+    parser.add_argument(
+        'output_root',
+        type=Path,
+        help='Path to directory to copy to'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Number of files copied at a time',
+        default=4
+    )
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Plan copies without copying'
+    )
+    parser.add_argument(
+        '--plan',
+        type=Path,
+        help='Path to save a csv of the source, destination and action of every file to',
+        default=None
+    )
+    parser.add_argument(
+        '--no-verify',
+        action='store_true',
+        help='Skip files already copied if they are the same size, without comparing checksums'
+    )
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        help='Only copy shard i of N (e.g. 0/4) of the files, by their path in source_root',
+        default=None
+    )
+    parser.add_argument(
+        '--report',
+        type=Path,
+        help='Path to save a JSON report of the time spent in each stage to',
+        default=None
+    )
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        help='Seconds between progress lines',
+        default=60.0
+    )
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        help='Path to save cProfile stats of the main thread to',
+        default=None
+    )
+
+    args = parser.parse_args()
+    run = instrument.start('reorg-data', progress_interval=args.progress_interval)
+    with instrument.profile(args.profile):
+        jobs = plan(read_config(args.config), args.source_root, args.output_root, not args.no_verify, args.workers, args.shard)
+        if args.plan is not None:
+            jobs.to_csv(args.plan, index=False)
+            logger.info(f'Saved plan of {len(jobs)} files to {args.plan}')
+        if args.dry_run:
+            logger.info(f'Dry run, files to copy, skip or not copy due to conflicts: {_counts(jobs)}')
+            return
+        errors = reorg(jobs, args.workers)
+    run.log_report(args.report)
+    if errors:
+        raise SystemExit(f'Failed to copy {len(errors)} files')
+
+
+if __name__ == '__main__':
+    main()
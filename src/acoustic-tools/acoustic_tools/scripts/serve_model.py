@@ -0,0 +1,59 @@
+#!python
+"""Serve a trained model over HTTP, classifying wav clips and spectrograms in batches (see `acoustic_tools.serve`)."""
+import logging
+
+import click
+
+logging.basicConfig(format='%(asctime)s: %(message)s', level=logging.INFO)
+
+
+@click.command()
+@click.argument('path_to_model', type=click.Path(exists=True))
+@click.option('--host', type=str, default='127.0.0.1', show_default=True, help='Address to listen on')
+@click.option('--port', type=int, default=8000, show_default=True, help='Port to listen on')
+@click.option('--max-batch-size', type=int, default=32, show_default=True, help='Most requests classified at a time')
+@click.option('--max-latency', type=float, default=10.0, show_default=True, help='Most time (ms) a request waits for others to batch with')
+@click.option('--threads', type=int, default=None, help='Number of threads torch uses for each batch')
+@click.option('--decimate', is_flag=True, help='Decimate wav clips before the STFT, as `create-spectrograms --decimate`')
+def main(
+    path_to_model: str,
+    host: str,
+    port: int,
+    max_batch_size: int,
+    max_latency: float,
+    threads: int,
+    decimate: bool
+) -> None:
+    """Given a fastai learner or exported TorchScript model (.pt), classify wav clips or spectrogram arrays POSTed to /predict"""
+    # torch and the libraries spectrograms are made with take seconds to import, so `--help` doesn't import them
+    import torch
+
+    from acoustic_tools.scripts.create_spectrograms import FFTConfig
+    from acoustic_tools.serve import PredictionServer, load_model
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    logging.info(f'Loading model {path_to_model}')
+    predict_batch, labels = load_model(path_to_model)
+
+    server = PredictionServer(
+        (host, port),
+        predict_batch,
+        labels,
+        FFTConfig(decimate=decimate),
+        max_batch_size=max_batch_size,
+        max_latency=max_latency / 1000
+    )
+    logging.info(f'Serving {path_to_model} on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(f'Metrics: {server.metrics.summary()}')
+
+
+if __name__ == '__main__':
+    main()
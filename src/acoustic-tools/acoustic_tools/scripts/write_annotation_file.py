@@ -1,44 +1,131 @@
 #!python
 """Write csv file with Black Grouper annotations from a direcotry combined and cleaned."""
+from __future__ import annotations
+import concurrent.futures
 import logging
+from itertools import repeat
 from pathlib import Path
+from typing import TYPE_CHECKING, Tuple, Union
 
-import pandas as pd
+from acoustic_tools import annotation, annotation_store, instrument
 
-from acoustic_tools import annotation
+if TYPE_CHECKING:
+    import pandas as pd
 
 logging.basicConfig(format='%(process)s - %(levelname)s: %(message)s', level=logging.INFO)
 
 
-def read_annotation_files(annotation_dir: Path, glob_str: str) -> pd.DataFrame:
-    """Given dir with annotation files and glob string for files, return all annotations as DataFrame"""
-    annotation_files = list(annotation_dir.glob(glob_str))
-    annotation_files.sort()
+def _read_annotation_file(annotation_file: Path, engine: str = 'python') -> Tuple[Union[pd.DataFrame, None], Union[str, None]]:
+    """Given path to annotation file, return its annotations or a description of the error if it can't be read."""
+    try:
+        return annotation.read_annotation_file(annotation_file, engine=engine), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
 
-    dfs = []
-    for annotation_file in annotation_files:
-        logging.info(f'Reading annotation file {annotation_file}')
-        try:
-            df = annotation.read_annotation_file(annotation_file)
-        except Exception as e:
-            logging.warning(f'Failed to read annotation file {annotation_file}')
-            continue
-        dfs.append(annotation.read_annotation_file(annotation_file))
 
-    return pd.concat(dfs)
+def read_annotation_files(
+    annotation_dir: Path,
+    glob_str: str,
+    workers: int = 1,
+    processes: bool = False,
+    error_report: Union[Path, None] = None,
+    engine: str = 'vectorized'
+) -> pd.DataFrame:
+    """Given dir with annotation files and glob string for files, return all annotations as DataFrame
 
+    Files are read once each, by `workers` threads (or processes if `processes`).  With the 'vectorized' engine
+    all files are parsed together (see `annotation.read_annotation_files`), with the 'python' engine one at a time.
+    Files that can't be parsed are skipped and listed with their errors in `error_report` if given.  `file` and
+    `call_variant` are categorical.
+    """
+    import pandas as pd
 
-def write_annotation_file(annotation_dir: Path, glob_str: str, output_file: Path) -> None:
-    """Given a directory with annotation files and a glob string, write combined annotations to the given output file."""
+    annotation_files = list(annotation_dir.glob(glob_str))
+    annotation_files.sort()
+    run = instrument.current()
+    run.total = len(annotation_files)
+
+    executor = None
+    map_func = map
+    if workers > 1:
+        pool = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+        executor = pool(max_workers=workers)
+        map_func = executor.map
+
+    try:
+        # Files are read and parsed together by the vectorized engine, so both are timed as one stage
+        with run.stage('parse'):
+            if engine == 'vectorized':
+                df, errors = annotation.read_annotation_files(annotation_files, map_func=map_func)
+                run.done(errors=[errors.get(annotation_file) for annotation_file in annotation_files])
+            else:
+                dfs = []
+                errors = {}
+                results = map_func(_read_annotation_file, annotation_files, repeat(engine))
+                for annotation_file, (file_df, error) in zip(annotation_files, results):
+                    logging.info(f'Read annotation file {annotation_file}')
+                    if error is not None:
+                        errors[annotation_file] = error
+                    else:
+                        dfs.append(file_df)
+                    run.done(errors=[error])
+                df = pd.concat(dfs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    run.add_bytes(read=sum(instrument.file_size(annotation_file) for annotation_file in annotation_files))
+
+    for annotation_file, error in errors.items():
+        logging.warning(f'Failed to read annotation file {annotation_file}: {error}')
+    logging.info(f'Read {len(annotation_files) - len(errors)} of {len(annotation_files)} annotation files')
+
+    if error_report is not None:
+        logging.info(f'Writing {len(errors)} annotation file errors to {error_report}')
+        pd.DataFrame(
+            [{'file': str(annotation_file), 'error': error} for annotation_file, error in errors.items()],
+            columns=['file', 'error']
+        ).to_csv(error_report, index=False)
+
+    return df.astype({'file': 'category', 'call_variant': 'category'})
+
+
+def write_annotation_file(
+    annotation_dir: Path,
+    glob_str: str,
+    output_file: Path,
+    workers: int = 1,
+    processes: bool = False,
+    error_report: Union[Path, None] = None,
+    engine: str = 'vectorized',
+    store: Union[Path, None] = None
+) -> None:
+    """Given a directory with annotation files and a glob string, write combined annotations to the given output file.
+
+    If `store` is given, annotations are also saved to a parquet annotation store (see `acoustic_tools.annotation_store`).
+    """
     logging.info(f'Reading annotation files from {annotation_dir} using {glob_str} glob string')
 
     annotation_df = read_annotation_files(
         annotation_dir,
         glob_str,
+        workers=workers,
+        processes=processes,
+        error_report=error_report,
+        engine=engine
     )
 
+    run = instrument.current()
     logging.info(f'Writing combined annotation data to {output_file}')
-    annotation_df.to_csv(output_file, index=False)
+    with run.stage('write'):
+        annotation_df.to_csv(output_file, index=False)
+    run.add_bytes(written=instrument.file_size(output_file))
+
+    if store is not None:
+        logging.info(f'Writing annotation store to {store}')
+        with run.stage('store'):
+            index = annotation_store.write_annotation_store(annotation_df, store)
+        run.add_bytes(written=sum(instrument.file_size(fpath) for fpath in Path(store).rglob('*')))
+        logging.info(f'Wrote {index["rows"].sum()} annotations in {len(index)} groups to {store}')
 
 
 def main():
@@ -60,15 +147,70 @@ def main():
         default='*.txt',
         help='String to glob appropriate annotation files to combine'
     )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of threads used to read annotation files'
+    )
+    parser.add_argument(
+        '--processes',
+        action='store_true',
+        help='Read annotation files with a pool of processes instead of threads'
+    )
+    parser.add_argument(
+        '--error_report',
+        type=Path,
+        default=None,
+        help='Path to csv file listing annotation files that could not be read'
+    )
+    parser.add_argument(
+        '--engine',
+        choices=annotation.ENGINES,
+        default='vectorized',
+        help='Parse all annotation files together (vectorized) or one at a time (python)'
+    )
+    parser.add_argument(
+        '--store',
+        type=Path,
+        default=None,
+        help='Path to directory to also save annotations to as a parquet annotation store (requires pyarrow)'
+    )
+    parser.add_argument(
+        '--report',
+        type=Path,
+        default=None,
+        help='Path to save a JSON report of the time spent in each stage to'
+    )
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        default=60.0,
+        help='Seconds between progress lines'
+    )
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        default=None,
+        help='Path to save cProfile stats of the main process to'
+    )
     args = parser.parse_args()
     output_dir = args.output_file.parent
     output_dir.mkdir(exist_ok=True)
 
-    write_annotation_file(
-        args.annotation_dir,
-        args.glob_str,
-        args.output_file
-    )
+    run = instrument.start('write-annotation-file', progress_interval=args.progress_interval)
+    with instrument.profile(args.profile):
+        write_annotation_file(
+            args.annotation_dir,
+            args.glob_str,
+            args.output_file,
+            workers=args.workers,
+            processes=args.processes,
+            error_report=args.error_report,
+            engine=args.engine,
+            store=args.store
+        )
+    run.log_report(args.report)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,321 @@
+"""HTTP server classifying spectrograms with a trained model, batching concurrent requests together.
+
+The model is loaded once.  Requests are preprocessed in their own threads and queued for a single model thread,
+which runs the images of all requests waiting (up to `max_batch_size`) as one batch.  A batch is started at most
+`max_latency` seconds after its first request arrived.  Endpoints:
+
+    POST /predict   wav clip (any other content type) or .npy array (`application/x-npy`), returns
+                    {"call_variant": "4", "probs": {"0": 0.01, ...}}
+    GET  /metrics   request latency and batch size percentiles
+    GET  /health
+
+Arrays are either spectrograms (2d float arrays, as from `create_spectrograms.audio_to_spec`) or rendered
+images (uint8 arrays).  Audio is transformed as `detect` transforms windows.
+"""
+from __future__ import annotations
+import collections
+import concurrent.futures
+import dataclasses
+import io
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+
+import librosa
+import numpy as np
+import soundfile
+import torch
+
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, audio_to_spec, save_spec, trim
+from acoustic_tools.export import LABELS_FILE
+
+NPY_CONTENT_TYPE = 'application/x-npy'
+
+
+class Metrics:
+    """Request latencies and batch sizes of the last `window` requests and batches."""
+
+    def __init__(self, window: int = 10_000):
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._batch_sizes = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+
+    def record_request(self, seconds: float, error: bool = False) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self._latencies.append(seconds)
+
+    def record_batch(self, size: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self._batch_sizes.append(size)
+
+    def summary(self) -> dict:
+        """Return counts, and p50/p99 of request latency (ms) and batch size."""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            batch_sizes = np.array(self._batch_sizes)
+            summary = {'requests': self.requests, 'errors': self.errors, 'batches': self.batches}
+
+        for name, values in [('latency_ms', latencies), ('batch_size', batch_sizes)]:
+            if len(values):
+                p50, p99 = np.percentile(values, [50, 99])
+                summary[name] = {'p50': float(p50), 'p99': float(p99), 'mean': float(values.mean()), 'max': float(values.max())}
+            else:
+                summary[name] = None
+        return summary
+
+
+class MicroBatcher:
+    """Run images submitted from any thread through `predict_batch` in batches, in a single thread.
+
+    Parameters
+    ----------
+    predict_batch: Callable
+        Given a list of images, return an (n_images, n_labels) array of probabilities
+    max_batch_size: int
+        Most images run at a time
+    max_latency: float
+        Most seconds the first image of a batch waits for others to join it
+    metrics: Metrics
+        Batch sizes are recorded to `metrics` if given
+    """
+
+    def __init__(
+        self,
+        predict_batch: Callable[[list[np.ndarray]], np.ndarray],
+        max_batch_size: int = 32,
+        max_latency: float = 0.01,
+        metrics: Metrics | None = None
+    ):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = metrics
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, image: np.ndarray) -> concurrent.futures.Future:
+        """Given an image, return a future of its probabilities."""
+        future = concurrent.futures.Future()
+        self._queue.put((time.perf_counter(), image, future))
+        return future
+
+    def predict(self, image: np.ndarray, timeout: float | None = None) -> np.ndarray:
+        """Given an image, return its probabilities once its batch has run."""
+        return self.submit(image).result(timeout)
+
+    def close(self) -> None:
+        """Run images already submitted and stop the batching thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self) -> tuple[list, bool]:
+        item = self._queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = item[0] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            try:
+                # Take whatever is already waiting, then wait until the deadline of the first request
+                item = self._queue.get(timeout=max(0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        closed = False
+        while not closed:
+            batch, closed = self._next_batch()
+            if not batch:
+                continue
+            futures = [future for _, _, future in batch]
+            try:
+                probs = self.predict_batch([image for _, image, _ in batch])
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, image_probs in zip(futures, probs):
+                    future.set_result(image_probs)
+            if self.metrics is not None:
+                self.metrics.record_batch(len(batch))
+
+
+def load_learner(path_to_model: Path) -> tuple[Callable[[list[np.ndarray]], np.ndarray], list[str]]:
+    """Given path to an exported fastai learner, return a function predicting batches of images on CPU, and labels.
+
+    Images are transformed by the learner's test dataloader and run through its model directly, skipping the
+    callbacks of `Learner.get_preds`.
+    """
+    import fastai.vision.all as fai_vision
+
+    learner = fai_vision.load_learner(path_to_model, cpu=True)
+    learner.model.eval()
+    activation = getattr(learner.loss_func, 'activation', lambda x: x)
+
+    def predict_batch(images: list[np.ndarray]) -> np.ndarray:
+        dl = learner.dls.test_dl([fai_vision.PILImage.create(image) for image in images], bs=len(images))
+        with torch.inference_mode():
+            xb = dl.one_batch()[0]
+            return activation(learner.model(xb)).float().numpy()
+
+    return predict_batch, [str(label) for label in learner.dls.vocab]
+
+
+def load_torchscript(path_to_model: Path) -> tuple[torch.jit.ScriptModule, list[str]]:
+    """Given path to a model saved by `export_model.py`, return the model and its labels."""
+    extra_files = {LABELS_FILE: ''}
+    model = torch.jit.load(str(path_to_model), map_location='cpu', _extra_files=extra_files)
+    return model, json.loads(extra_files[LABELS_FILE])
+
+
+def load_model(path_to_model: Path) -> tuple[Callable[[list[np.ndarray]], np.ndarray], list[str]]:
+    """Given path to a fastai learner, or a TorchScript model (.pt) saved by `export_model.py`, return a function
+    predicting batches of images on CPU, and labels.
+    """
+    if Path(path_to_model).suffix != '.pt':
+        return load_learner(path_to_model)
+
+    model, labels = load_torchscript(path_to_model)
+
+    def predict_batch(images: list[np.ndarray]) -> np.ndarray:
+        with torch.inference_mode():
+            return model(torch.from_numpy(np.stack([image[..., :3] for image in images]))).numpy()
+
+    return predict_batch, labels
+
+
+def wav_image(data: bytes, fft_config: FFTConfig) -> np.ndarray:
+    """Given the bytes of an audio file, return its spectrogram image, as `create_spectrograms.plot_spec` draws it.
+
+    Audio is mixed down, resampled and trimmed as `create_spectrograms.load_wav` loads files.
+    """
+    audio, sr = soundfile.read(io.BytesIO(data), dtype='float32', always_2d=True)
+    # Mix down to mono as librosa.load does
+    audio = audio.mean(axis=1)
+    # Decimated spectrograms are calculated from audio at its own rate
+    if sr != fft_config.sr and not fft_config.decimate:
+        audio = librosa.resample(audio, orig_sr=sr, target_sr=fft_config.sr)
+        sr = fft_config.sr
+    audio = trim(audio, sr)
+    spec = audio_to_spec(audio, sr, fft_config)
+    return save_spec(spec, None, fft_config)
+
+
+def array_image(data: bytes, fft_config: FFTConfig) -> np.ndarray:
+    """Given the bytes of a .npy array, return it as an image, rendering it first if it is a spectrogram."""
+    array = np.load(io.BytesIO(data), allow_pickle=False)
+    if array.dtype == np.uint8:
+        return array
+    if array.ndim != 2:
+        raise ValueError(f'Expected a 2d spectrogram or uint8 image, got a {array.ndim}d {array.dtype} array')
+    return save_spec(array, None, fft_config)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """Handler of `PredictionServer` requests."""
+
+    server: PredictionServer
+
+    def do_GET(self) -> None:
+        if self.path == '/metrics':
+            self._send_json(200, self.server.metrics.summary())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self) -> None:
+        if self.path != '/predict':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+
+        start = time.perf_counter()
+        try:
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.headers.get('Content-Type') == NPY_CONTENT_TYPE:
+                image = array_image(data, self.server.fft_config)
+            else:
+                image = wav_image(data, self.server.fft_config)
+            probs = self.server.batcher.predict(image)
+        except Exception as e:
+            self.server.metrics.record_request(time.perf_counter() - start, error=True)
+            self._send_json(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+
+        self.server.metrics.record_request(time.perf_counter() - start)
+        labels = self.server.labels
+        self._send_json(200, {
+            'call_variant': labels[int(probs.argmax())],
+            'probs': {label: float(prob) for label, prob in zip(labels, probs)},
+        })
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f'{self.address_string()} - {format % args}')
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class PredictionServer(ThreadingHTTPServer):
+    """HTTP server predicting the call variant of requests with `predict_batch`, see `MicroBatcher`.
+
+    Spectrograms are rendered with the 'fast' renderer, matching images drawn by matplotlib.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        predict_batch: Callable[[list[np.ndarray]], np.ndarray],
+        labels: list[str],
+        fft_config: FFTConfig | None = None,
+        max_batch_size: int = 32,
+        max_latency: float = 0.01
+    ):
+        super().__init__(address, PredictionHandler)
+        self.labels = labels
+        self.fft_config = dataclasses.replace(fft_config or FFTConfig(), renderer='fast')
+        self.metrics = Metrics()
+        self.batcher = MicroBatcher(predict_batch, max_batch_size, max_latency, self.metrics)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.batcher.close()
+
+
+def predict(url: str, fpath: Path, timeout: float | None = None) -> dict:
+    """Given the url of a server and path to a wav file or .npy array, return the server's prediction."""
+    fpath = Path(fpath)
+    content_type = NPY_CONTENT_TYPE if fpath.suffix == '.npy' else 'audio/wav'
+    request = urllib.request.Request(
+        f'{url.rstrip("/")}/predict',
+        data=fpath.read_bytes(),
+        headers={'Content-Type': content_type},
+        method='POST'
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
@@ -0,0 +1,70 @@
+"""Deterministic partitioning of the files or annotations of batch scripts between nodes.
+
+Scripts given `--shard i/N` only process the items in shard `i` (counted from 0) of `N`.  Items are assigned to
+shards by a hash of a key that is the same on every node, e.g. the path of a file relative to the input directory,
+so N nodes can each process a disjoint shard without coordinating, and together process every item once.  An item
+stays in the same shard when other items are added or removed.
+
+Outputs of each shard are combined with `merge-shards` (see `scripts/merge_shards.py`).
+"""
+from __future__ import annotations
+import hashlib
+from typing import TYPE_CHECKING, Callable, Iterable, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+T = TypeVar('T')
+
+Shard = Tuple[int, int]
+
+
+def parse_shard(value: str) -> Shard:
+    """Given a shard as 'i/N', return (i, N)."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f'Shard must be given as i/N, e.g. 0/4, got {value!r}') from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'Shard index must be from 0 to N - 1, got {value!r}')
+    return index, count
+
+
+def parse_shard_option(ctx, param, value: str | None) -> Shard | None:
+    """Parse a click `--shard` option with `parse_shard`."""
+    import click
+
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from None
+
+
+def shard_index(key: str, count: int) -> int:
+    """Given the key of an item, return the shard (of `count`) it is in."""
+    # Unlike `hash`, the digest is the same in every process
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def select(items: Iterable[T], shard: Shard | None, key: Callable[[T], str] = str) -> list[T]:
+    """Given items, return those in `shard` (all of them if None), in order."""
+    if shard is None:
+        return list(items)
+    index, count = shard
+    return [item for item in items if shard_index(key(item), count) == index]
+
+
+def select_rows(df: pd.DataFrame, shard: Shard | None, column: str) -> pd.DataFrame:
+    """Given a DataFrame, return the rows in `shard` (all of them if None) by their value of `column`.
+
+    Rows with the same value are in the same shard, e.g. annotations of the same file.
+    """
+    if shard is None:
+        return df
+    index, count = shard
+    keys = df[column].astype(str)
+    shards = {key: shard_index(key, count) for key in keys.unique()}
+    return df[keys.map(shards) == index]
@@ -0,0 +1,129 @@
+"""Overlap reading, computing and writing the items of batch scripts.
+
+`stream` reads items ahead in a pool of threads, computes them in the calling thread and writes the results in a
+writer thread, so files are read and written while others are computed:
+
+    read (`readers` threads) -> read queue -> compute (calling thread) -> write queue -> write (writer thread)
+
+Both queues hold at most `queue_size` items.  Readers stop reading ahead when the read queue is full, and computing
+waits for the writer when the write queue is full, so at most about `2 * queue_size` items are held in memory.
+
+The depth of each queue when the calling thread takes an item from (or adds an item to) it and the time the calling
+thread waits on it are recorded to the current `acoustic_tools.instrument` (see `Instrument.add_queue`), which
+shows the slowest stage of a run:
+
+- waiting on the read queue, with it empty, means reading is slowest (add `readers`)
+- waiting on the write queue, with it full, means writing is slowest
+- a full read queue and an empty write queue, with little waiting on either, means computing is slowest
+
+Stages recorded by read and write functions (e.g. 'decode', 'write') are recorded from their threads, so the
+seconds of stages add up to more than the time of the run.
+"""
+from __future__ import annotations
+import collections
+import concurrent.futures
+import time
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar
+
+from acoustic_tools import instrument
+
+T = TypeVar('T')
+
+
+def _error(e: Exception) -> str:
+    return f'{type(e).__name__}: {e}'
+
+
+def stream(
+    items: Iterable[T],
+    read: Callable,
+    compute: Callable,
+    write: Callable,
+    readers: int = 4,
+    queue_size: int = 8
+) -> Iterator[Tuple[T, object, str | None]]:
+    """Given items, read, compute and write each, overlapping reads and writes with computing.
+
+    Parameters
+    ----------
+    items: Iterable
+        Items to process, consumed as reading reaches them
+    read: Callable
+        Given an item, return what is read for it, called in reader threads
+    compute: Callable
+        Given an item and what was read for it, return what to write, called in the calling thread
+    write: Callable
+        Given an item and what was computed for it, write it and return a result, called in one writer thread in
+        the order of items
+    readers: int
+        Number of threads reading items
+    queue_size: int
+        Most items read ahead of computing, and computed ahead of writing
+
+    Yields
+    ------
+    item, result, error
+        Each item in order, with the result of `write` and None, or None and a description of the error of the
+        first stage that failed (as '<type>: <message>')
+    """
+    run = instrument.current()
+    items = iter(items)
+    reads = collections.deque()
+    writes = collections.deque()
+
+    with concurrent.futures.ThreadPoolExecutor(readers, thread_name_prefix='read') as read_pool, \
+            concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='write') as write_pool:
+
+        def read_ahead():
+            while len(reads) < queue_size:
+                item = next(items, reads)
+                if item is reads:
+                    return
+                reads.append((item, read_pool.submit(read, item)))
+
+        def finish_write():
+            item, future, error = writes.popleft()
+            if future is None:
+                return item, None, error
+            try:
+                return item, future.result(), None
+            except Exception as e:
+                return item, None, _error(e)
+
+        read_ahead()
+        while reads:
+            item, future = reads.popleft()
+            depth = sum(read_future.done() for _, read_future in reads) + future.done()
+            start = time.perf_counter()
+            try:
+                data = future.result()
+            except Exception as e:
+                data, error = None, _error(e)
+            else:
+                error = None
+            run.add_queue('read', depth, time.perf_counter() - start)
+            read_ahead()
+
+            if error is None:
+                try:
+                    data = compute(item, data)
+                except Exception as e:
+                    error = _error(e)
+
+            depth = len(writes)
+            start = time.perf_counter()
+            results = []
+            while len(writes) >= queue_size:
+                results.append(finish_write())
+            run.add_queue('write', depth, time.perf_counter() - start)
+            if error is None:
+                writes.append((item, write_pool.submit(write, item, data), None))
+            else:
+                writes.append((item, None, error))
+
+            while writes and (writes[0][1] is None or writes[0][1].done()):
+                results.append(finish_write())
+            yield from results
+
+        while writes:
+            yield finish_write()
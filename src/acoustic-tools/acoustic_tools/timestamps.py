@@ -0,0 +1,95 @@
+"""Timestamps of recordings, parsed from the names DSG recorders give them.
+
+Names of every format are matched by a single compiled regex, fields are padded by spaces and repeated '_':
+
+    0059.DSG_RAWD_HMS__7__0__0__DMY_27__1_16.wav
+    748.DSG_RAWD_HMS_19_0_0__DMY_25_7_16.wav (spaces removed, as in annotation files)
+    3035.DSG_HMS_12_50_ 0__DMY_ 4_ 7_ 9.wav (rileys-hump 2009)
+    DSG_6_RG_3-000.5078.YMD_2009_04_27_HMS_21_30_00.dsg_RAWD_HMS_21_30__0__DMY_27__4__9.wav (steamboat)
+
+Years are 2 digits (1 digit in rileys-hump 2009 and steamboat names) after 2000.
+
+`parse_timestamps` parses a list or Series of names at once, with the site of each found from its directories.  It
+indexes millions of names in seconds, searching each name once and converting all fields to numbers together.
+"""
+from __future__ import annotations
+import datetime
+import math
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+FIELDS = ['hour', 'minute', 'second', 'day', 'month', 'year']
+
+# Starts with a literal, which `re` searches for quickly.  Steamboat names match the DSG timestamp after their YMD
+# timestamp, which is the same time.
+TIMESTAMP_RE = re.compile(
+    r'HMS[_ ]+(?P<hour>\d+)[_ ]+(?P<minute>\d+)[_ ]+(?P<second>\d+)'
+    r'[_ ]+DMY[_ ]+(?P<day>\d+)[_ ]+(?P<month>\d+)[_ ]+(?P<year>\d+)'
+)
+
+_NO_MATCH = (math.nan,) * len(FIELDS)
+
+
+def parse_timestamp(name: str | Path) -> datetime.datetime | None:
+    """Given a file name (or path), return its timestamp, or None if it has none or it isn't a valid date."""
+    match = TIMESTAMP_RE.search(Path(name).name)
+    if match is None:
+        return None
+    hour, minute, second, day, month, year = (int(value) for value in match.groups())
+    try:
+        return datetime.datetime(year + 2000, month, day, hour, minute, second)
+    except ValueError:
+        return None
+
+
+def find_site(path: str | Path, sites: Iterable[str]) -> str | None:
+    """Given a path and names of sites, return the first site in the path, or None if none are."""
+    for site in sites:
+        if site in str(path):
+            return site
+    return None
+
+
+def parse_timestamps(names: Iterable[str | Path] | pd.Series, sites: Iterable[str] | None = None) -> pd.DataFrame:
+    """Given file names (or paths), return the timestamp and site of each.
+
+    Parameters
+    ----------
+    names: Iterable[str | Path] | pd.Series
+        Names or paths of files, the index of a Series is kept
+    sites: Iterable[str] | None
+        Names of sites to find in the directories of each path (see `find_site`), sites are None if not given
+
+    Returns
+    -------
+    timestamps: pd.DataFrame
+        `timestamp` (NaT if it has none or it isn't a valid date) and `site` (None if not found) of each name
+    """
+    import numpy as np
+    import pandas as pd
+
+    index = names.index if isinstance(names, pd.Series) else None
+    # (directory, '/', name) of each path, only names are searched for timestamps as in `parse_timestamp`
+    paths = [str(name).rpartition('/') for name in names]
+
+    search = TIMESTAMP_RE.search
+    matches = [match.groups() if match else _NO_MATCH for match in (search(path[2]) for path in paths)]
+    parts = pd.DataFrame(np.array(matches, dtype=float).reshape(-1, len(FIELDS)), columns=FIELDS, index=index)
+    parts['year'] += 2000
+    # `to_datetime` adds hours, minutes and seconds out of range to the date rather than rejecting them
+    invalid = (parts['hour'] > 23) | (parts['minute'] > 59) | (parts['second'] > 59)
+    parts.loc[invalid, 'year'] = np.nan
+    timestamps = pd.to_datetime(parts[['year', 'month', 'day', 'hour', 'minute', 'second']], errors='coerce')
+
+    site = [None] * len(paths)
+    if sites is not None:
+        # Files of a site share few directories, so each is searched once
+        sites = list(sites)
+        directories = [path[0] for path in paths]
+        found = {directory: find_site(directory, sites) for directory in set(directories)}
+        site = [found[directory] for directory in directories]
+    return pd.DataFrame({'timestamp': timestamps, 'site': pd.Series(site, index=parts.index, dtype=object)})
@@ -0,0 +1,70 @@
+#!python
+"""Compare parsing Raven selection tables one at a time with parsing them together.
+
+The python engine is `annotation.read_annotation_file(engine='python')` for each file, concatenated as
+`write_annotation_file` did.  The vectorized engine is `annotation.read_annotation_files`.  Files whose parsed
+annotations differ are listed, there should be none.
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from acoustic_tools import annotation
+
+SELECTION_FILES = Path(__file__).resolve().parents[3] / 'data' / 'acoustic-data-annotations' / 'mote-lab' / 'selection-files'
+
+
+def python_engine(annotation_files):
+    return pd.concat([annotation.read_annotation_file(f, engine='python') for f in annotation_files])
+
+
+def vectorized_engine(annotation_files):
+    df, _ = annotation.read_annotation_files(annotation_files)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--annotation_dir', type=Path, default=SELECTION_FILES, help='Directory of selection tables')
+    parser.add_argument('--glob_str', type=str, default='**/*.txt', help='String to glob selection tables')
+    parser.add_argument('--copies', type=int, default=1, help='Number of times to parse each table, to simulate more tables')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each engine')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    annotation_files = sorted(args.annotation_dir.glob(args.glob_str))
+    tables = annotation_files * args.copies
+
+    timings = {}
+    rows = {}
+    for name, func in [('python', python_engine), ('vectorized', vectorized_engine)]:
+        seconds = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            df = func(tables)
+            seconds.append(time.perf_counter() - start)
+        timings[name] = min(seconds)
+        rows[name] = len(df)
+
+    differing = []
+    for annotation_file in annotation_files:
+        expected = annotation.read_annotation_file(annotation_file, engine='python')
+        result = annotation.read_annotation_file(annotation_file, engine='vectorized')
+        if not expected.equals(result):
+            differing.append(str(annotation_file.relative_to(args.annotation_dir)))
+
+    print(json.dumps({
+        'tables': len(tables),
+        'rows': rows,
+        'seconds': timings,
+        'speedup': timings['python'] / timings['vectorized'],
+        'differing': differing,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!python
+"""Compare calculating spectrograms of clips one at a time with calculating them in batches.
+
+Clips are `--length` long less up to `--trimmed` seconds, as `create_training_set --length` clips are after
+`librosa.effects.trim`.  The per-file loop designs the bandpass filter for every clip, as `fish_filter` did before
+filter designs were cached, and transforms each clip separately.  The batched path is `create_spectrograms.calc_batch`,
+which pads clips to a common length.
+"""
+import argparse
+import json
+import time
+
+import librosa
+import numpy as np
+import scipy.signal as signal
+
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, calc_batch
+
+
+def per_file(audios, sr, fft_config):
+    specs = []
+    for audio in audios:
+        sos = signal.butter(8, [50, 512], 'bandpass', output='sos', fs=sr)
+        filtered = signal.sosfilt(sos, audio)
+        stft = librosa.stft(filtered, n_fft=fft_config.n_fft, hop_length=fft_config.hop_length, win_length=fft_config.win_length)
+        specs.append(np.abs(stft))
+    return specs
+
+
+def batched(audios, sr, fft_config):
+    batch = {
+        'errors': [None] * len(audios),
+        'keys': {},
+        'magnitudes': {},
+        'audios': dict(enumerate(audios)),
+        'srs': dict.fromkeys(range(len(audios)), sr),
+    }
+    calc_batch(batch, fft_config)
+    return [batch['magnitudes'][ix] for ix in range(len(audios))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=256, help='Number of clips')
+    parser.add_argument('--length', type=float, default=2.0, help='Length of clips (s)')
+    parser.add_argument('--trimmed', type=float, default=0.25, help='Most trimmed from each clip (s)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each path')
+    args = parser.parse_args()
+
+    fft_config = FFTConfig()
+    sr = fft_config.sr
+    rng = np.random.default_rng(0)
+    lengths = int(args.length * sr) - rng.integers(0, int(args.trimmed * sr) + 1, args.n)
+    audios = [rng.standard_normal(length).astype(np.float32) for length in lengths]
+
+    timings = {}
+    for name, func in [('per_file', per_file), ('batched', batched)]:
+        seconds = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            func(audios, sr, fft_config)
+            seconds.append(time.perf_counter() - start)
+        timings[name] = min(seconds)
+
+    expected = per_file(audios[:4], sr, fft_config)
+    matches = all(
+        a.shape == b.shape and np.allclose(a, b, rtol=1e-4, atol=1e-4)
+        for a, b in zip(expected, batched(audios[:4], sr, fft_config))
+    )
+
+    print(json.dumps({
+        'n': args.n,
+        'length': args.length,
+        'trimmed': args.trimmed,
+        'seconds': timings,
+        'speedup': timings['per_file'] / timings['batched'],
+        'matches': matches,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
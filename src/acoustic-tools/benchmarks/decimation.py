@@ -0,0 +1,88 @@
+#!python
+"""Compare spectrograms of recordings resampled to 22,050 Hz with spectrograms of recordings decimated to the fish band.
+
+Synthetic fish-band calls are written at each of `--rates` and their spectrogram features (the grid of colormap
+indexes the 'fast' renderer draws, see `create_spectrograms.calc_features`) are calculated as configured by
+default and with `decimate`.  The time spent in each stage, the size of the STFTs and the mean absolute
+difference between the features (0 - 255) are reported for each rate.
+"""
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import scipy.io.wavfile
+
+from acoustic_tools import instrument
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, calc_features, spec_config
+from acoustic_tools.synthetic import synthetic_call
+
+
+def run(wavs, fft_config, repeat):
+    """Given paths to wav files, return their features and the fastest stage times of calculating them."""
+    best = None
+    for _ in range(repeat):
+        run = instrument.start('decimation', len(wavs), progress_interval=None)
+        features = [calc_features(wav, fft_config) for wav in wavs]
+        report = run.report()
+        if best is None or report['seconds'] < best['seconds']:
+            best = report
+    return features, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=8, help='Number of clips at each rate')
+    parser.add_argument('--duration', type=float, default=30.0, help='Length of clips (s)')
+    parser.add_argument('--rates', type=int, nargs='+', default=[22_050, 48_000], help='Sample rates of clips')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each config')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    configs = {'resampled': FFTConfig(renderer='fast'), 'decimated': FFTConfig(renderer='fast', decimate=True)}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rate in args.rates:
+            wavs = []
+            for ix in range(args.n):
+                wavs.append(Path(tmpdir) / f'call-{rate}-{ix}.wav')
+                scipy.io.wavfile.write(wavs[-1], rate, synthetic_call(rng, rate, args.duration))
+
+            features = {}
+            reports = {}
+            for name, fft_config in configs.items():
+                features[name], reports[name] = run(wavs, fft_config, args.repeat)
+            diffs = [
+                np.abs(full.astype(int) - decimated.astype(int)).mean()
+                for full, decimated in zip(features['resampled'], features['decimated'])
+            ]
+            results[rate] = {
+                'seconds_per_clip': {name: report['seconds'] / args.n for name, report in reports.items()},
+                'speedup': reports['resampled']['seconds'] / reports['decimated']['seconds'],
+                'stage_seconds': {
+                    name: {stage: values['seconds'] for stage, values in report['stages'].items()}
+                    for name, report in reports.items()
+                },
+                'mean_abs_diff': float(np.mean(diffs)),
+                'max_mean_abs_diff': float(np.max(diffs)),
+            }
+
+    print(json.dumps({
+        'n': args.n,
+        'duration': args.duration,
+        'stft': {
+            name: {
+                'sr': spec_config(fft_config).sr,
+                'n_fft': spec_config(fft_config).n_fft,
+                'hop_length': spec_config(fft_config).hop_length,
+            }
+            for name, fft_config in configs.items()
+        },
+        'rates': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
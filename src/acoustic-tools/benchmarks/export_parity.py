@@ -0,0 +1,85 @@
+#!python
+"""Compare models saved by `export_model.py` with the fastai learner they were exported from.
+
+Each model classifies the images listed in the training notebook's sample csv (requires the images and `fastai`).
+Accuracy is reported over all images and over the validation split the notebook trained with (`valid_pct=0.2`,
+`seed=666`), with the fraction of images each exported model labels as the learner does, and images per second.
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+from acoustic_tools import serve
+from acoustic_tools.export import read_images, read_labeled_images
+
+SAMPLES_CSV = Path(__file__).resolve().parents[3] / 'notebooks' / 'fish-sounds-resnet101-balanced-samples-n50.csv'
+
+
+def valid_split(n: int, valid_pct: float = 0.2, seed: int = 666) -> np.ndarray:
+    """Given number of rows, return the rows in the validation set of fastai's `RandomSplitter`."""
+    torch.manual_seed(seed)
+    return torch.randperm(n).numpy()[:int(valid_pct * n)]
+
+
+def predict(predict_batch, images, batch_size):
+    probs = [predict_batch(images[start:start + batch_size]) for start in range(0, len(images), batch_size)]
+    return np.concatenate(probs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('learner', type=Path, help='Path to exported fastai learner')
+    parser.add_argument('models', type=Path, nargs='+', help='Paths to models saved by export_model.py')
+    parser.add_argument('--csv', type=Path, default=SAMPLES_CSV, help='Csv of images (fname, label)')
+    parser.add_argument('--replace_prefix', type=str, nargs=2, default=None, help='Replace the first prefix of image paths with the second')
+    parser.add_argument('--batch_size', type=int, default=16, help='Number of images classified at a time')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each model')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    # Rows keep their position in the csv, which the split is made over
+    df = read_labeled_images(args.csv, args.replace_prefix)
+    valid = df.index.isin(valid_split(len(pd.read_csv(args.csv))))
+    images = read_images(df['fname'])
+
+    results = {}
+    expected = None
+    for name, path in [('learner', args.learner)] + [(str(model), model) for model in args.models]:
+        predict_batch, labels = serve.load_model(path)
+        predict_batch(images[:args.batch_size])
+        seconds = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            probs = predict(predict_batch, images, args.batch_size)
+            seconds.append(time.perf_counter() - start)
+
+        predicted = np.array(labels)[probs.argmax(axis=1)]
+        correct = predicted == df['label'].astype(str).to_numpy()
+        if expected is None:
+            expected = predicted
+        results[name] = {
+            'accuracy': float(correct.mean()),
+            'valid_accuracy': float(correct[valid].mean()),
+            'agreement': float((predicted == expected).mean()),
+            'images_per_second': len(images) / min(seconds),
+        }
+
+    for result in results.values():
+        result['speedup'] = result['images_per_second'] / results['learner']['images_per_second']
+
+    print(json.dumps({
+        'images': len(images),
+        'valid_images': int(valid.sum()),
+        'threads': torch.get_num_threads(),
+        'models': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!python
+"""Compare calculating spectrogram magnitudes with `SpecGraph` to `calc_magnitudes` before it, for each feature.
+
+Before `SpecGraph`, mel spectrograms were calculated by `librosa.feature.melspectrogram` from the audio, which
+transformed it a second time (with its default `n_fft`) after the configured STFT and built the mel filterbank for
+every call, and PCEN was calculated and then discarded when both were configured (`SpecGraph` calculates PCEN of the
+mel spectrogram, so 'mel+pcen' magnitudes differ, see `PCEN_VERSION`).  Mel spectrograms alone aren't faster, as the
+second STFT had half the configured `n_fft`.  The old `calc_magnitudes` is copied here.  The STFTs calculated by
+each are counted, and magnitudes are compared with the same features calculated by librosa from the configured STFT.
+"""
+import argparse
+import json
+import time
+
+import librosa
+import librosa.core.spectrum
+import numpy as np
+
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, calc_magnitudes, fish_filter
+
+CONFIGS = {
+    'stft': FFTConfig(),
+    'pcen': FFTConfig(pcen=True),
+    'mel': FFTConfig(mel=True),
+    'mel+pcen': FFTConfig(mel=True, pcen=True),
+}
+
+
+def legacy_magnitudes(audio, sr, fft_config):
+    """`create_spectrograms.calc_magnitudes` before `SpecGraph`, without instrumenting or changing the config."""
+    if fft_config.bandpass:
+        audio = fish_filter(audio, fs=sr)
+    stft = np.abs(librosa.stft(audio, n_fft=fft_config.n_fft, hop_length=fft_config.hop_length, win_length=fft_config.win_length))
+    if fft_config.pcen:
+        stft = librosa.pcen(stft * (2**31), sr=fft_config.sr, hop_length=fft_config.hop_length)
+    if fft_config.mel:
+        stft = librosa.feature.melspectrogram(
+            y=audio, sr=fft_config.sr, n_mels=fft_config.n_mels, fmin=fft_config.fmin, fmax=fft_config.fmax
+        )
+    return stft
+
+
+def reference_magnitudes(audio, sr, fft_config):
+    """Features of the configured STFT as calculated by librosa from the audio."""
+    if fft_config.bandpass:
+        audio = fish_filter(audio, fs=sr)
+    stft_args = dict(n_fft=fft_config.n_fft, hop_length=fft_config.hop_length, win_length=fft_config.win_length)
+    if fft_config.mel:
+        magnitudes = librosa.feature.melspectrogram(
+            y=audio, sr=sr, n_mels=fft_config.n_mels, fmin=fft_config.fmin, fmax=fft_config.fmax, **stft_args
+        )
+    else:
+        magnitudes = np.abs(librosa.stft(audio, **stft_args))
+    if fft_config.pcen:
+        magnitudes = librosa.pcen(magnitudes * (2**31), sr=sr, hop_length=fft_config.hop_length)
+    return magnitudes
+
+
+class CountSTFTs:
+    """Count calls of `librosa.stft`, including those of `librosa.feature.melspectrogram`, while entered."""
+
+    def __init__(self):
+        self.calls = 0
+        self._stft = librosa.core.spectrum.stft
+
+    def __enter__(self):
+        def stft(*args, **kwargs):
+            self.calls += 1
+            return self._stft(*args, **kwargs)
+
+        librosa.stft = librosa.core.spectrum.stft = stft
+        return self
+
+    def __exit__(self, *exc):
+        librosa.stft = librosa.core.spectrum.stft = self._stft
+
+
+def timed(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return result, min(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=64, help='Number of clips in the batch')
+    parser.add_argument('--length', type=float, default=2.0, help='Length of clips (s)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each path')
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS), choices=list(CONFIGS))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    sr = FFTConfig().sr
+    audio = rng.standard_normal((args.n, int(args.length * sr))).astype(np.float32)
+
+    results = {}
+    for name in args.configs:
+        fft_config = CONFIGS[name]
+        with CountSTFTs() as legacy_stfts:
+            _, legacy_seconds = timed(lambda: legacy_magnitudes(audio, sr, fft_config), args.repeat)
+        with CountSTFTs() as graph_stfts:
+            magnitudes, graph_seconds = timed(lambda: calc_magnitudes(audio, sr, fft_config), args.repeat)
+        expected = reference_magnitudes(audio, sr, fft_config)
+        results[name] = {
+            'seconds': {'legacy': legacy_seconds, 'graph': graph_seconds},
+            'speedup': legacy_seconds / graph_seconds,
+            'stfts_per_call': {'legacy': legacy_stfts.calls / args.repeat, 'graph': graph_stfts.calls / args.repeat},
+            'shape': list(magnitudes.shape),
+            'max_relative_difference': float(np.max(np.abs(magnitudes - expected)) / np.max(np.abs(expected))),
+        }
+
+    print(json.dumps({'n': args.n, 'length': args.length, 'configs': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!python
+"""Time how long each console script takes to start, to catch heavy imports creeping back into startup.
+
+Each script in `setup.cfg` (and the `acoustic-tools` dispatcher running it) is run with `--help` in a new
+interpreter with `python -X importtime`, which reports the time spent importing every module.  Results are the
+fastest of `--repeat` runs: the wall time of the process, the total time spent importing, and the modules that took
+longest to import themselves (excluding their imports).
+
+Save results with `--output` and compare later runs with `--baseline`: scripts that start more than `--tolerance`
+times slower than the baseline are listed, and the benchmark exits non-zero.
+"""
+from __future__ import annotations
+import argparse
+import configparser
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SETUP_CFG = Path(__file__).resolve().parents[1] / 'setup.cfg'
+
+
+def console_scripts(setup_cfg: Path = SETUP_CFG) -> dict:
+    """Given path to setup.cfg, return the 'module:function' of each console script."""
+    config = configparser.ConfigParser()
+    config.read(setup_cfg)
+    scripts = {}
+    for line in config['options.entry_points']['console_scripts'].strip().splitlines():
+        name, target = (part.strip() for part in line.split('='))
+        scripts[name] = target
+    return scripts
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Given the output of `python -X importtime`, return the self and cumulative seconds importing each module."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        # Modules imported more than once keep their first (real) import
+        modules.setdefault(module.strip(), (int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def time_startup(target: str, args: list[str], top: int) -> dict:
+    """Given 'module:function' of a script and its arguments, return the time taken to run it in a new process."""
+    module, function = target.split(':')
+    code = f'import sys; sys.argv = {[target] + args!r}; from {module} import {function}; {function}()'
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    modules = parse_importtime(result.stderr)
+    heaviest = sorted(modules.items(), key=lambda item: -item[1][0])[:top]
+    return {
+        'seconds': seconds,
+        'import_seconds': sum(self_seconds for self_seconds, _ in modules.values()),
+        'modules': len(modules),
+        'returncode': result.returncode,
+        'heaviest': {name: self_seconds for name, (self_seconds, _) in heaviest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scripts', nargs='+', default=None, help='Console scripts to time, defaults to all')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to start each script')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest imports to list for each script')
+    parser.add_argument('--output', type=Path, default=None, help='Path to also save results to as json')
+    parser.add_argument('--baseline', type=Path, default=None, help='Path to results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='Slowdown relative to the baseline allowed')
+    args = parser.parse_args()
+
+    scripts = console_scripts()
+    names = args.scripts or [name for name in scripts if name != 'acoustic-tools']
+    runs = {}
+    for name in names:
+        runs[name] = (scripts[name], ['--help'])
+        if 'acoustic-tools' in scripts:
+            runs[f'acoustic-tools {name}'] = (scripts['acoustic-tools'], [name, '--help'])
+    if 'acoustic-tools' in scripts:
+        runs['acoustic-tools'] = (scripts['acoustic-tools'], ['--help'])
+
+    results = {}
+    for name, (target, script_args) in runs.items():
+        results[name] = min(
+            (time_startup(target, script_args, args.top) for _ in range(args.repeat)), key=lambda result: result['seconds']
+        )
+
+    report = {'python': sys.version.split()[0], 'scripts': results}
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())['scripts']
+        report['slower'] = {
+            name: result['seconds'] / baseline[name]['seconds']
+            for name, result in results.items()
+            if name in baseline and result['seconds'] > args.tolerance * baseline[name]['seconds']
+        }
+
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + '\n')
+    print(text)
+    if report.get('slower'):
+        raise SystemExit(f'{len(report["slower"])} scripts start slower than the baseline')
+
+
+if __name__ == '__main__':
+    main()
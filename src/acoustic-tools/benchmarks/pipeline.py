@@ -0,0 +1,235 @@
+#!python
+"""Time each stage of the pipeline, from selection tables to model inference, on synthetic data.
+
+Synthetic recordings (named as the DSG recorders name them) and Raven selection tables of calls in them are written
+to a temporary directory.  Each stage is timed `--repeat` times and run once more with `tracemalloc` to measure the
+peak memory it allocates (numpy and python allocations, not those of libsndfile or torch).  `--scale` runs the suite
+with `--files` recordings and `--rows` selections per table multiplied by each scale, e.g. `--scale 1 4 16`.
+
+Inference is timed if `--model` is given (a fastai learner, or a `.pt` model saved by `export_model.py`).  Save
+results with `--output` to compare runs, they include the versions and commit they were measured with.
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.io.wavfile
+
+from acoustic_tools import annotation, sample
+from acoustic_tools.scripts import rename_training_set_files, write_annotation_file
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, calc_stft, fish_filter, load_wav, plot_spec
+from acoustic_tools.synthetic import synthetic_call
+
+STAGES = (
+    'read_annotation_file',
+    'write_annotation_file',
+    'create_sample',
+    'load_wav',
+    'fish_filter',
+    'calc_stft',
+    'plot_spec',
+    'plot_spec_fast',
+    'copy_files',
+    'inference',
+)
+
+COLUMNS = [
+    'Selection',
+    'View',
+    'Channel',
+    'Low Freq (Hz)',
+    'High Freq (Hz)',
+    'Begin File',
+    'Delta Time (s)',
+    'File Offset (s)',
+    'call variant',
+    'level',
+    'calls overlap',
+    'call cutoff @ end?',
+    'Notes',
+]
+
+
+def dsg_name(ix: int, timestamp: datetime.datetime) -> str:
+    """Given a file number and timestamp, return the name of a DSG recording, e.g. 0902.DSG_RAWD_HMS_15_ 0_ 0__DMY_ 9_ 8_15.wav"""
+    t = timestamp
+    return f'{ix:04}.DSG_RAWD_HMS_{t.hour:2}_{t.minute:2}_{t.second:2}__DMY_{t.day:2}_{t.month:2}_{t.year % 100:2}.wav'
+
+
+def write_recordings(wav_dir: Path, n: int, duration: float, sr: int, rng: np.random.Generator) -> list[Path]:
+    """Write `n` synthetic recordings of `duration` seconds, five minutes apart."""
+    wav_dir.mkdir(parents=True)
+    start = datetime.datetime(2016, 7, 25, 19)
+    wavs = []
+    for ix in range(n):
+        wav = wav_dir / dsg_name(ix, start + datetime.timedelta(minutes=5 * ix))
+        scipy.io.wavfile.write(wav, sr, synthetic_call(rng, sr=sr, duration=duration))
+        wavs.append(wav)
+    return wavs
+
+
+def write_tables(table_dir: Path, wavs: list[Path], rows: int, duration: float, rng: np.random.Generator) -> tuple[list[Path], list[tuple]]:
+    """Write a selection table of `rows` calls for each recording, with waveform and spectrogram rows for each call.
+
+    Returns paths to the tables, and the (recording, start, end) of every call.
+    """
+    table_dir.mkdir(parents=True)
+    tables = []
+    calls = []
+    for wav in wavs:
+        lines = ['\t'.join(COLUMNS)]
+        for selection in range(1, rows + 1):
+            call_length = rng.uniform(0.5, 3)
+            start = rng.uniform(0, max(0, duration - call_length))
+            values = [rng.integers(1, 7), rng.integers(1, 4), rng.integers(1, 3), rng.integers(1, 3)]
+            calls.append((wav, start, start + call_length))
+            for view in ('Waveform 1', 'Spectrogram 1'):
+                row = [selection, view, 1, 0, f'{rng.uniform(100, 500):.1f}', wav.name, f'{call_length:.4f}', f'{start:.4f}'] + values + ['']
+                lines.append('\t'.join(str(value) for value in row))
+        table = table_dir / f'{wav.stem}.Table.1.selections.txt'
+        table.write_text('\n'.join(lines) + '\n')
+        tables.append(table)
+    return tables, calls
+
+
+def make_stages(data: Path, wavs: list[Path], tables: list[Path], calls: list[tuple], args) -> dict:
+    """Return a (function, number of items) to time for each stage.
+
+    Inputs of each stage are prepared here, so only the stage itself is timed.
+    """
+    sample_dir = data / 'samples'
+    sample_dir.mkdir()
+    audios = [load_wav(wav)[0] for wav in wavs]
+    clips = [
+        path
+        for ix, (wav, start, end) in enumerate(calls)
+        for path in sample.create_sample(wav, sample_dir / f'clip-{ix}', start, end)
+    ]
+    image_dir = data / 'images'
+    image_dir.mkdir()
+
+    stages = {
+        'read_annotation_file': (lambda: [annotation.read_annotation_file(table) for table in tables], len(tables)),
+        'write_annotation_file': (lambda: write_annotation_file.write_annotation_file(data / 'tables', '**/*.txt', data / 'annotations.csv'), len(tables)),
+        'create_sample': (lambda: [sample.create_sample(wav, sample_dir / f'clip-{ix}', start, end, length=1, pad=0.5) for ix, (wav, start, end) in enumerate(calls)], len(calls)),
+        'load_wav': (lambda: [load_wav(wav) for wav in wavs], len(wavs)),
+        'fish_filter': (lambda: [fish_filter(audio) for audio in audios], len(audios)),
+        'calc_stft': (lambda: [calc_stft(audio, FFTConfig()) for audio in audios], len(audios)),
+        'plot_spec': (lambda: [plot_spec(clip, image_dir / f'{clip.stem}.png', FFTConfig()) for clip in clips], len(clips)),
+        'plot_spec_fast': (lambda: [plot_spec(clip, image_dir / f'{clip.stem}.png', FFTConfig(renderer='fast')) for clip in clips], len(clips)),
+        'copy_files': (lambda: rename_training_set_files.copy_files(wavs[0].parent, data / 'reorg', 'jupiter'), len(wavs)),
+    }
+
+    if args.model is not None:
+        from acoustic_tools import serve
+        predict_batch, _ = serve.load_model(args.model)
+        images = [plot_spec(clip, None, FFTConfig(renderer='fast')) for clip in clips]
+        batch_size = args.batch_size
+        stages['inference'] = (
+            lambda: [predict_batch(images[start:start + batch_size]) for start in range(0, len(images), batch_size)],
+            len(images)
+        )
+
+    return stages
+
+
+def measure(func, repeat: int) -> dict:
+    """Given a function, return its fastest time over `repeat` runs and the peak memory it allocates."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(seconds), 'mean_seconds': sum(seconds) / repeat, 'peak_mb': peak / 2**20}
+
+
+def run_suite(args, scale: int) -> dict:
+    """Given arguments and scale, generate synthetic data and time each stage selected."""
+    rng = np.random.default_rng(args.seed)
+    files = args.files * scale
+    rows = args.rows * scale
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = Path(tmpdir)
+        # Annotation file prefixes are found from the directory name
+        wavs = write_recordings(data / 'recordings' / 'jupiter', files, args.duration, args.sr, rng)
+        tables, calls = write_tables(data / 'tables' / 'jupiter', wavs, rows, args.duration, rng)
+        stages = make_stages(data, wavs, tables, calls, args)
+
+        for name in args.stages:
+            if name not in stages:
+                results[name] = None
+                continue
+            func, items = stages[name]
+            result = measure(func, args.repeat)
+            result['items'] = items
+            result['items_per_second'] = items / result['seconds']
+            results[name] = result
+
+    return {'scale': scale, 'files': files, 'rows': rows, 'calls': len(calls), 'stages': results}
+
+
+def metadata() -> dict:
+    """Return versions, machine and commit of this run."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=4, help='Number of recordings (and selection tables) at scale 1')
+    parser.add_argument('--rows', type=int, default=10, help='Number of calls in each selection table at scale 1')
+    parser.add_argument('--duration', type=float, default=60.0, help='Length of recordings (s)')
+    parser.add_argument('--sr', type=int, default=8_000, help='Sample rate of recordings')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1], help='Scales to run the suite at')
+    parser.add_argument('--stages', choices=STAGES, nargs='+', default=list(STAGES), help='Stages to time')
+    parser.add_argument('--model', type=Path, default=None, help='Path to model to time inference with')
+    parser.add_argument('--batch_size', type=int, default=16, help='Number of images classified at a time')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=None, help='Path to also save results to as json')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    report = {
+        'meta': metadata(),
+        'args': {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        'runs': [run_suite(args, scale) for scale in args.scale],
+    }
+    report = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(report + '\n')
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!python
+"""Compare spectrogram images from the 'fast' renderer with images drawn by matplotlib.
+
+Synthetic fish-band calls are written to a temporary directory, rendered with both renderers and compared
+pixel by pixel.  Exits non-zero if the mean absolute difference is greater than `--tolerance`.
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import matplotlib.image
+import numpy as np
+import scipy.io.wavfile
+
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, plot_spec
+from acoustic_tools.synthetic import synthetic_call
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=10, help='Number of clips to compare')
+    parser.add_argument('--tolerance', type=float, default=2.0, help='Maximum mean absolute pixel difference (0-255)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    diffs = []
+    timings = {'matplotlib': 0.0, 'fast': 0.0}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        for ix in range(args.n):
+            wav = tmpdir / f'call-{ix}.wav'
+            scipy.io.wavfile.write(wav, 22_050, synthetic_call(rng))
+
+            images = {}
+            for renderer in timings:
+                output = tmpdir / f'call-{ix}-{renderer}.png'
+                start = time.perf_counter()
+                plot_spec(wav, output, FFTConfig(renderer=renderer))
+                timings[renderer] += time.perf_counter() - start
+                images[renderer] = (matplotlib.image.imread(output)[..., :3] * 255).astype(np.int16)
+
+            if images['matplotlib'].shape != images['fast'].shape:
+                raise SystemExit(f'Image sizes differ: {images["matplotlib"].shape} != {images["fast"].shape}')
+            diffs.append(np.abs(images['matplotlib'] - images['fast']).mean())
+
+    report = {
+        'n': args.n,
+        'mean_abs_diff': float(np.mean(diffs)),
+        'max_mean_abs_diff': float(np.max(diffs)),
+        'seconds_per_image': {renderer: seconds / args.n for renderer, seconds in timings.items()},
+    }
+    print(json.dumps(report, indent=2))
+    if report['max_mean_abs_diff'] > args.tolerance:
+        raise SystemExit(f'Fast renderer differs from matplotlib by more than {args.tolerance}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!python
+"""Check that a run sharded between processes (`--shard i/N`) creates the same outputs as a single run.
+
+Synthetic recordings and annotations of calls in them are written to a temporary directory.  A training set is
+created from them with `create-training-set` and spectrograms of its samples are saved to a feature store with
+`create-spectrograms --output-format npy`, once in a single process and once in `--shards` processes at a time,
+whose manifests, reports and feature stores are combined with `merge-shards`.  The samples, manifest records and
+spectrograms of both runs are compared, and the benchmark exits non-zero if they differ.
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.io.wavfile
+
+from acoustic_tools.feature_store import FeatureStore
+from acoustic_tools.synthetic import synthetic_call
+
+SITES = ['jupiter', 'port-manatee', 'rileys-hump']
+
+
+def write_data(data: Path, n_files: int, rows: int, duration: float, rng: np.random.Generator) -> Path:
+    """Write recordings to data/recordings as `create_training_set.source_path` expects and return their annotations csv."""
+    start = datetime.datetime(2016, 7, 25, 19)
+    annotations = []
+    for ix in range(n_files):
+        site = SITES[ix % len(SITES)]
+        t = start + datetime.timedelta(minutes=5 * ix)
+        wav = data / 'recordings' / site / f'{t:%Y/%m/%d}' / f'{site}_{t:%Y-%m-%dT%H-%M-%S}.wav'
+        wav.parent.mkdir(parents=True, exist_ok=True)
+        scipy.io.wavfile.write(wav, 22_050, synthetic_call(rng, duration=duration))
+        for _ in range(rows):
+            call_length = rng.uniform(0.5, 3)
+            annotations.append({
+                'file': f'{site}_{t:%Y-%m-%dT%H%M%S}.wav',
+                'start_time': rng.uniform(0, duration - call_length),
+                'call_length': call_length,
+                'call_variant': int(rng.choice([1, 2, 3, 7])),
+                'call_overlap': bool(rng.integers(0, 2)),
+                'call_cutoff': bool(rng.integers(0, 2)),
+                'signal_level': int(rng.integers(1, 4)),
+            })
+
+    annotations_path = data / 'annotations.csv'
+    pd.DataFrame(annotations).to_csv(annotations_path, index=False)
+    return annotations_path
+
+
+def run_commands(commands: list[list[str]]) -> float:
+    """Run `acoustic-tools` commands at the same time, returning the seconds until all finished."""
+    start = time.perf_counter()
+    processes = [
+        subprocess.Popen([sys.executable, '-m', 'acoustic_tools.cli', *command], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        for command in commands
+    ]
+    for command, process in zip(commands, processes):
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            raise SystemExit(f'{" ".join(command)} failed:\n{stderr.decode()}')
+    return time.perf_counter() - start
+
+
+def build(data: Path, name: str, annotations: Path, shards: int | None) -> float:
+    """Create a training set and feature store in data/<name>, in `shards` processes if given, returning the seconds taken."""
+    out = data / name
+    out.mkdir()
+    parts = [None] if shards is None else [f'{ix}/{shards}' for ix in range(shards)]
+
+    def suffix(part):
+        return '' if part is None else f'-{part.replace("/", "-of-")}'
+
+    def shard_args(part):
+        return [] if part is None else ['--shard', part]
+
+    seconds = run_commands([
+        [
+            'create-training-set', str(data / 'recordings'), str(annotations), str(out / 'training'),
+            '--length', '1', '--manifest', str(out / f'manifest{suffix(part)}.sqlite'),
+            '--report', str(out / f'training-report{suffix(part)}.json'), *shard_args(part)
+        ]
+        for part in parts
+    ])
+    seconds += run_commands([
+        [
+            'create-spectrograms', str(out / 'training'), str(out / f'store{suffix(part)}'), '--output-format', 'npy',
+            '--renderer', 'fast', '--report', str(out / f'spectrogram-report{suffix(part)}.json'), *shard_args(part)
+        ]
+        for part in parts
+    ])
+    if shards is not None:
+        seconds += run_commands([
+            [
+                'merge-shards',
+                '--manifests', *[str(out / f'manifest{suffix(part)}.sqlite') for part in parts],
+                '--manifest-output', str(out / 'manifest.sqlite'),
+                '--feature-stores', *[str(out / f'store{suffix(part)}') for part in parts],
+                '--feature-store-output', str(out / 'store'),
+                '--reports', *[str(out / f'spectrogram-report{suffix(part)}.json') for part in parts],
+                '--report-output', str(out / 'spectrogram-report.json'),
+            ]
+        ])
+    return seconds
+
+
+def outputs(out: Path) -> dict:
+    """Given the output directory of a build, return its samples, manifest records and spectrograms by relative path."""
+    samples = sorted(
+        fpath.relative_to(out).as_posix()
+        for training in (out / 'training', out / 'training-whole')
+        for fpath in training.glob('**/*.wav')
+    )
+    with sqlite3.connect(out / 'manifest.sqlite') as conn:
+        records = sorted(
+            (Path(fpath_out).relative_to(out).as_posix(), start_time, call_length)
+            for fpath_out, start_time, call_length in conn.execute('SELECT fpath_out, start_time, call_length FROM samples')
+        )
+    store = FeatureStore(out / 'store')
+    spectrograms = {
+        Path(source).relative_to(out).as_posix(): store[ix][0]
+        for ix, source in enumerate(store.index['source'])
+    }
+    return {'samples': samples, 'records': records, 'spectrograms': spectrograms}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=3, help='Number of shards run at the same time')
+    parser.add_argument('--files', type=int, default=12, help='Number of recordings')
+    parser.add_argument('--rows', type=int, default=5, help='Number of calls annotated in each recording')
+    parser.add_argument('--duration', type=float, default=20.0, help='Length of recordings (s)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = Path(tmpdir)
+        annotations = write_data(data, args.files, args.rows, args.duration, rng)
+        seconds = {
+            'single': build(data, 'single', annotations, None),
+            'sharded': build(data, 'sharded', annotations, args.shards),
+        }
+        single = outputs(data / 'single')
+        sharded = outputs(data / 'sharded')
+        report = json.loads((data / 'sharded' / 'spectrogram-report.json').read_text())
+
+    same_spectrograms = single['spectrograms'].keys() == sharded['spectrograms'].keys() and all(
+        np.array_equal(spec, sharded['spectrograms'][source]) for source, spec in single['spectrograms'].items()
+    )
+    matches = {
+        'samples': single['samples'] == sharded['samples'],
+        'records': single['records'] == sharded['records'],
+        'spectrograms': same_spectrograms,
+    }
+    print(json.dumps({
+        'shards': args.shards,
+        'seconds': seconds,
+        'samples': len(single['samples']),
+        'records': len(single['records']),
+        'spectrograms': len(single['spectrograms']),
+        'merged_report_files': report['files'],
+        'matches': matches,
+    }, indent=2))
+    if not all(matches.values()):
+        raise SystemExit('Sharded outputs differ from the single run')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!python
+"""Compare creating spectrograms one file at a time with reading and writing files while others are calculated.
+
+Synthetic recordings are written to a temporary directory and their spectrograms saved as PNGs with `plot_specs`
+one file after another, as `create_spectrograms.py` saved them before `acoustic_tools.stream`, and with
+`convert_files` for each of `--readers`.  The seconds of each run, its stage times, the depth of its queues and the
+time spent waiting on them are reported, and the benchmark exits non-zero if the PNGs differ.
+"""
+import argparse
+import json
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import scipy.io.wavfile
+
+from acoustic_tools import instrument
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, convert_files, plot_specs
+from acoustic_tools.synthetic import synthetic_call
+
+
+def run(name, func, n):
+    """Call func with a new instrument, returning the report of the run."""
+    run = instrument.start(name, n, progress_interval=None)
+    func()
+    report = run.report()
+    return {
+        'seconds': report['seconds'],
+        'stage_seconds': {stage: values['seconds'] for stage, values in report['stages'].items()},
+        'queues': report['queues'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=64, help='Number of recordings')
+    parser.add_argument('--duration', type=float, default=10.0, help='Length of recordings (s)')
+    parser.add_argument('--rate', type=int, default=48_000, help='Sample rate of recordings, resampled as they are read')
+    parser.add_argument('--renderer', choices=['matplotlib', 'fast'], default='fast')
+    parser.add_argument('--readers', type=int, nargs='+', default=[1, 4], help='Numbers of reader threads to time')
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    fft_config = FFTConfig(renderer=args.renderer)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        wavs = [tmpdir / f'call-{ix}.wav' for ix in range(args.n)]
+        for wav in wavs:
+            scipy.io.wavfile.write(wav, args.rate, synthetic_call(rng, args.rate, args.duration))
+        # Imports librosa and matplotlib, so neither run times them
+        plot_specs(wavs[:1], [tmpdir / 'warmup.png'], fft_config)
+
+        outputs = {}
+        for name in ['sequential', *[f'readers-{readers}' for readers in args.readers]]:
+            (tmpdir / name).mkdir()
+            outputs[name] = [tmpdir / name / f'{wav.stem}.png' for wav in wavs]
+        results['sequential'] = run(
+            'sequential',
+            lambda: [plot_specs([wav], [output], fft_config) for wav, output in zip(wavs, outputs['sequential'])],
+            args.n
+        )
+        for readers in args.readers:
+            name = f'readers-{readers}'
+            results[name] = run(
+                name,
+                lambda: convert_files(wavs, outputs[name], fft_config, readers=readers, queue_size=args.queue_size),
+                args.n
+            )
+
+        same = {
+            name: all(a.read_bytes() == b.read_bytes() for a, b in zip(outputs['sequential'], name_outputs))
+            for name, name_outputs in outputs.items() if name != 'sequential'
+        }
+
+    for name, result in results.items():
+        result['speedup'] = results['sequential']['seconds'] / result['seconds']
+    print(json.dumps({
+        'n': args.n,
+        'duration': args.duration,
+        'rate': args.rate,
+        'renderer': args.renderer,
+        'queue_size': args.queue_size,
+        'runs': results,
+        'same_pngs': same,
+    }, indent=2))
+    if not all(same.values()):
+        raise SystemExit('Streamed PNGs differ from sequential PNGs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!python
+"""Compare parsing timestamps of recordings one at a time with parsing them together.
+
+Synthetic paths of recordings in every name format (see `acoustic_tools.timestamps`), and some without timestamps,
+are parsed by the split based parser `rename_training_set_files` used before `acoustic_tools.timestamps` (copied
+here), by `parse_timestamp` for each path and by `parse_timestamps` for all paths, with the site of each path.
+Paths whose timestamps differ between the parsers are counted.
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from acoustic_tools.timestamps import parse_timestamp, parse_timestamps
+
+SITES = ['exxon-template-tower', 'goliath-jupiter-gulf', 'jupiter', 'port-manatee', 'rileys-hump', 'steamboat']
+
+
+def legacy_timestamp(fname: Path) -> datetime.datetime | None:
+    """`rename_training_set_files.get_file_timestamp` before `acoustic_tools.timestamps`, without logging."""
+    try:
+        if 'rileys-hump' in str(fname) and '2009' in str(fname):
+            segments = [seg for seg in fname.name.split('.')[1].split('_') if seg != '']
+            _, _, hour, minute, second, _, day, month, year = segments
+        elif 'steamboat' in str(fname):
+            segments = [seg for seg in fname.name.split('.')[2].split('_') if seg != '']
+            _, year, month, day, _, hour, minute, second = segments
+        else:
+            segments = [seg for seg in fname.name.split('.')[1].split('_') if seg != '']
+            _, _, _, hour, minute, second, _, day, month, year = segments
+    except ValueError:
+        return None
+
+    try:
+        if 'steamboat' not in str(fname):
+            return datetime.datetime(int(year) + 2000, int(month), int(day), int(hour), int(minute), int(second))
+        return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+    except ValueError:
+        return None
+
+
+def synthetic_paths(n: int, rng: np.random.Generator) -> list[str]:
+    """Return `n` paths of recordings, a fifth in each name format and a fifth without timestamps."""
+    start = datetime.datetime(2009, 1, 1)
+    paths = []
+    for ix, minutes in enumerate(rng.integers(0, 60 * 24 * 365 * 9, n)):
+        kind = ix % 5
+        # rileys-hump and steamboat names are of 2009 recordings
+        t = start + datetime.timedelta(minutes=int(minutes) % (60 * 24 * 365) if kind in (2, 3) else int(minutes))
+        if kind == 0:
+            name = f'{ix % 10_000:04}.DSG_RAWD_HMS_{t.hour:2}_{t.minute:2}_{t.second:2}__DMY_{t.day:2}_{t.month:2}_{t.year % 100:2}.wav'
+            paths.append(f'mote/jupiter/{t.year}/{name}')
+        elif kind == 1:
+            name = f'{ix % 10_000:04}.DSG_RAWD_HMS_{t.hour}_{t.minute}_{t.second}__DMY_{t.day}_{t.month}_{t.year % 100}.wav'
+            paths.append(f'mote/port-manatee/{name}')
+        elif kind == 2:
+            name = f'{ix % 10_000:04}.DSG_HMS_{t.hour:2}_{t.minute:2}_{t.second:2}__DMY_{t.day:2}_{t.month:2}_{t.year % 10:2}.wav'
+            paths.append(f'mote/rileys-hump/2009/{name}')
+        elif kind == 3:
+            name = (
+                f'DSG_6_RG_3-000.{ix % 10_000:04}.YMD_{t:%Y_%m_%d}_HMS_{t:%H_%M_%S}'
+                f'.dsg_RAWD_HMS_{t.hour}_{t.minute}__{t.second}__DMY_{t.day}__{t.month}__{t.year % 10}.wav'
+            )
+            paths.append(f'mote/steamboat/{name}')
+        else:
+            paths.append(f'mote/exxon-template-tower/toshiba/{ix:08}.wav')
+    return paths
+
+
+def timed(func, repeat: int):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+    return result, min(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--names', type=int, default=1_000_000, help='Number of paths to parse')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to time each parser')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    paths = synthetic_paths(args.names, np.random.default_rng(args.seed))
+    parsers = {
+        'legacy': lambda: pd.Series([legacy_timestamp(Path(path)) for path in paths], dtype='datetime64[ns]'),
+        'parse_timestamp': lambda: pd.Series([parse_timestamp(path) for path in paths], dtype='datetime64[ns]'),
+        'parse_timestamps': lambda: parse_timestamps(paths, SITES)['timestamp'],
+    }
+
+    timings = {}
+    differing = {}
+    expected = None
+    for name, func in parsers.items():
+        timestamps, timings[name] = timed(func, args.repeat)
+        if expected is None:
+            expected = timestamps
+        differing[name] = int((timestamps.fillna(pd.Timestamp(0)) != expected.fillna(pd.Timestamp(0))).sum())
+
+    print(json.dumps({
+        'names': len(paths),
+        'parsed': int(expected.notna().sum()),
+        'seconds': timings,
+        'names_per_second': {name: len(paths) / seconds for name, seconds in timings.items()},
+        'speedup': {name: timings['legacy'] / seconds for name, seconds in timings.items()},
+        'differing': differing,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Tests of `acoustic_tools.scripts.create_spectrograms`."""
+import numpy as np
+import pytest
+
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, calc_batch, calc_magnitudes
+
+
+@pytest.mark.parametrize('sr, config', [
+    (22_050, {}),
+    (22_050, {'bandpass': False}),
+    (22_050, {'mel': True, 'pcen': True}),
+    (48_000, {'decimate': True}),
+    (48_000, {'decimate': True, 'pcen': True}),
+])
+def test_calc_batch_matches_calc_magnitudes(sr: int, config: dict):
+    """Clips of different lengths, as `create_training_set --length` clips are after trimming, are padded to a
+    common length and calculated together, with the same magnitudes as each clip calculated alone."""
+    fft_config = FFTConfig(**config)
+    rng = np.random.default_rng(0)
+    lengths = [2 * sr, 2 * sr - 1, 2 * sr - 3000, 2 * sr - sr // 5, sr // 2]
+    audios = {ix: rng.standard_normal(length).astype(np.float32) for ix, length in enumerate(lengths)}
+    batch = {
+        'errors': [None] * len(audios),
+        'keys': {},
+        'magnitudes': {},
+        'audios': dict(audios),
+        'srs': dict.fromkeys(audios, sr),
+    }
+
+    calc_batch(batch, fft_config)
+
+    assert batch['errors'] == [None] * len(audios)
+    for ix, audio in audios.items():
+        expected = calc_magnitudes(audio, sr, fft_config)
+        assert batch['magnitudes'][ix].shape == expected.shape
+        np.testing.assert_allclose(batch['magnitudes'][ix], expected, rtol=1e-5, atol=1e-5 * expected.max())
@@ -0,0 +1,20 @@
+"""Tests of `acoustic_tools.scripts.create_training_set`."""
+import argparse
+
+import pytest
+
+from acoustic_tools.scripts.create_training_set import positive_float, positive_int
+
+
+def test_positive_int():
+    assert positive_int('4') == 4
+    for value in ['0', '-1', 'x']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_int(value)
+
+
+def test_positive_float():
+    assert positive_float('0.5') == 0.5
+    for value in ['0', '-1', 'nan', 'x']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            positive_float(value)
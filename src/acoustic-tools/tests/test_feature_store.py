@@ -0,0 +1,27 @@
+"""Tests of `acoustic_tools.feature_store`."""
+from pathlib import Path
+
+import numpy as np
+
+from acoustic_tools import feature_store
+
+
+def test_shard_writer_index(tmp_path: Path):
+    store = tmp_path / 'store'
+    store.mkdir()
+    (store / 'notes.txt').write_text('Written before the store')
+
+    with feature_store.ShardWriter(store, shard_size=2) as writer:
+        for ix in range(3):
+            source = Path(f'training/call-1/clean/sample-{ix:04}-0000.wav')
+            recording, offset = ('reorg/mote/mote_2021-06-01T12-00-00.wav', ix * 1.5) if ix else (None, None)
+            writer.add(np.full((2, 3), ix, dtype='uint8'), source, recording, offset)
+
+    assert sorted(path.name for path in writer.written) == ['index.csv', 'shard-00000.npy', 'shard-00001.npy']
+
+    store = feature_store.FeatureStore(store)
+    assert list(store.index.columns) == feature_store.INDEX_COLUMNS
+    assert store.index['recording'].isna().tolist() == [True, False, False]
+    assert store.index['recording_offset'].tolist()[1:] == [1.5, 3.0]
+    spec, label = store[2]
+    assert label == 1 and (spec == 2).all()
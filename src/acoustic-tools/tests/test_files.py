@@ -0,0 +1,52 @@
+"""Tests of `acoustic_tools.files`."""
+from pathlib import Path
+
+import pytest
+
+from acoustic_tools import files
+
+
+@pytest.mark.parametrize('mode', files.LINK_MODES)
+@pytest.mark.parametrize('first_mode', ['hardlink', 'symlink'])
+def test_link_file_replaces_links(tmp_path: Path, first_mode: str, mode: str):
+    """Writing a source over a hard link or symlink left by an earlier run replaces it rather than writing through it.
+
+    Whole files of `create_training_set.py` are hard links to the first copy of their source with a link mode, and
+    symlinks to the source with `--link-mode symlink`.
+    """
+    src_a = tmp_path / 'src-a.wav'
+    src_b = tmp_path / 'src-b.wav'
+    src_a.write_bytes(b'AAAA')
+    src_b.write_bytes(b'BBBB')
+
+    first = tmp_path / 'sample-0000'
+    sibling = tmp_path / 'sample-0001'
+    if first_mode == 'hardlink':
+        # As `write_samples` writes the whole files of a source after its first copy
+        files.link_file(src_a, first, 'copy')
+        files.link_file(first, sibling, 'hardlink')
+    else:
+        files.link_file(src_a, first, first_mode)
+
+    files.link_file(src_b, first, mode)
+
+    assert first.read_bytes() == b'BBBB'
+    assert src_a.read_bytes() == b'AAAA'
+    if first_mode == 'hardlink':
+        assert sibling.read_bytes() == b'AAAA'
+    assert not (tmp_path / '.sample-0000.tmp').exists()
+
+
+def test_link_file_copy(tmp_path: Path):
+    src = tmp_path / 'src.wav'
+    src.write_bytes(b'AAAA')
+    dst = tmp_path / 'dst.wav'
+
+    assert files.link_file(src, dst, 'copy') == 'copy'
+    assert dst.read_bytes() == b'AAAA'
+    assert not dst.is_symlink() and dst.stat().st_ino != src.stat().st_ino
+
+
+def test_link_file_unknown_mode(tmp_path: Path):
+    with pytest.raises(ValueError):
+        files.link_file(tmp_path / 'src.wav', tmp_path / 'dst.wav', 'move')
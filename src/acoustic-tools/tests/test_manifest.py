@@ -0,0 +1,30 @@
+"""Tests of `acoustic_tools.manifest`."""
+from pathlib import Path
+
+from acoustic_tools.manifest import Manifest
+
+
+def test_recordings(tmp_path: Path):
+    infile = tmp_path / 'mote_2021-06-01T12-00-00.wav'
+    infile.write_bytes(b'RIFF')
+    job = {
+        'infile': infile,
+        'fpath_out': tmp_path / 'call-1' / 'clean' / 'sample-0001',
+        'whole_outfile': tmp_path / 'whole' / 'sample-0001',
+        'time_start': 12.5,
+        'time_end': 14.0,
+    }
+    clips = [tmp_path / 'call-1' / 'clean' / f'sample-0001-{ix:04}.wav' for ix in range(2)]
+
+    manifest = Manifest(tmp_path / 'manifest.sqlite')
+    try:
+        manifest.record(job, 1.0, None, clips + [job['whole_outfile']])
+        recordings = manifest.recordings()
+    finally:
+        manifest.close()
+
+    assert recordings == {
+        clips[0].resolve(): (str(infile), 12.5),
+        clips[1].resolve(): (str(infile), 13.5),
+        job['whole_outfile'].resolve(): (str(infile), 0.0),
+    }
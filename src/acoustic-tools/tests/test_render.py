@@ -0,0 +1,33 @@
+"""Tests of `acoustic_tools.render` against images drawn by matplotlib."""
+from pathlib import Path
+
+import matplotlib.image
+import numpy as np
+import pytest
+import scipy.io.wavfile
+
+from acoustic_tools.render import MATPLOTLIB_SIZE
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, plot_spec
+from acoustic_tools.synthetic import synthetic_call
+
+# Most mean absolute difference (0-255) of a 'fast' image from the matplotlib image, as `benchmarks/render_parity.py`
+TOLERANCE = 2.0
+
+
+def read_png(fpath: Path) -> np.ndarray:
+    return (matplotlib.image.imread(fpath)[..., :3] * 255).astype(np.int16)
+
+
+@pytest.mark.parametrize('config', [{}, {'db': True}, {'pcen': True}, {'db': True, 'denoise': 'median'}])
+def test_fast_renderer_matches_matplotlib(tmp_path: Path, config: dict):
+    rng = np.random.default_rng(0)
+    for ix in range(3):
+        wav = tmp_path / f'call-{ix}.wav'
+        scipy.io.wavfile.write(wav, 22_050, synthetic_call(rng))
+        plot_spec(wav, tmp_path / 'matplotlib.png', FFTConfig(renderer='matplotlib', **config))
+        plot_spec(wav, tmp_path / 'fast.png', FFTConfig(renderer='fast', **config))
+
+        expected = read_png(tmp_path / 'matplotlib.png')
+        image = read_png(tmp_path / 'fast.png')
+        assert image.shape == expected.shape == (MATPLOTLIB_SIZE[1], MATPLOTLIB_SIZE[0], 3)
+        assert np.abs(image - expected).mean() <= TOLERANCE
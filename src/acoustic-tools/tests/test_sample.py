@@ -0,0 +1,21 @@
+"""Tests of `acoustic_tools.sample`."""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from acoustic_tools.sample import sample_outputs
+
+
+def test_sample_outputs_splits_clip():
+    clip = np.arange(10).reshape(-1, 1)
+
+    outputs = sample_outputs(Path('call-1/clean/sample-0001'), clip, 4, length=1)
+
+    assert [fpath.name for fpath, _ in outputs] == [f'sample-0001-{ix:04}.wav' for ix in range(3)]
+    assert [len(subclip) for _, subclip in outputs] == [4, 4, 2]
+
+
+def test_sample_outputs_shorter_than_a_sample():
+    with pytest.raises(ValueError):
+        sample_outputs(Path('sample-0001'), np.zeros((10, 1)), 4, length=0.1)
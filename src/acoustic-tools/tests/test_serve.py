@@ -0,0 +1,24 @@
+"""Tests of `acoustic_tools.serve`."""
+from pathlib import Path
+
+import numpy as np
+import pytest
+import scipy.io.wavfile
+
+from acoustic_tools.scripts.create_spectrograms import FFTConfig, plot_spec
+from acoustic_tools.serve import wav_image
+from acoustic_tools.synthetic import synthetic_call
+
+
+@pytest.mark.parametrize('config', [{}, {'decimate': True}])
+def test_wav_image_matches_plot_spec(tmp_path: Path, config: dict):
+    """Clips are trimmed before they are transformed, as files are by `create_spectrograms`."""
+    fft_config = FFTConfig(renderer='fast', **config)
+    call = synthetic_call(np.random.default_rng(0))
+    silence = np.zeros(22_050, dtype=call.dtype)
+    wav = tmp_path / 'call.wav'
+    scipy.io.wavfile.write(wav, 22_050, np.concatenate([silence, call, silence]))
+
+    expected = plot_spec(wav, tmp_path / 'call.png', fft_config)
+
+    np.testing.assert_array_equal(wav_image(wav.read_bytes(), fft_config), expected)
@@ -0,0 +1,20 @@
+"""Tests of `acoustic_tools.timestamps`."""
+import pandas as pd
+
+from acoustic_tools.timestamps import parse_timestamp, parse_timestamps
+
+
+def test_parse_timestamps_matches_parse_timestamp():
+    names = [
+        'jupiter/0059.DSG_RAWD_HMS__7__0__0__DMY_27__1_16.wav',
+        'rileys-hump/3035.DSG_HMS_12_50_ 0__DMY_ 4_ 7_ 9.wav',
+        # Only names are searched, not their directories
+        'HMS_1_2_3__DMY_4_5_16/recording.wav',
+        'jupiter/0060.DSG_RAWD_HMS_25_0_0__DMY_27__1_16.wav',
+    ]
+
+    timestamps = parse_timestamps(names, ['jupiter', 'rileys-hump'])
+
+    expected = [parse_timestamp(name) for name in names]
+    assert [None if pd.isna(timestamp) else timestamp for timestamp in timestamps['timestamp']] == expected
+    assert timestamps['site'].tolist() == ['jupiter', 'rileys-hump', None, 'jupiter']